@@ -2,7 +2,7 @@ import datetime
 import os
 from flask import Flask, jsonify
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, get_jwt_identity, jwt_required
 from flask_migrate import Migrate
 
 # 导入配置文件
@@ -10,6 +10,14 @@ import config
 
 # 导入数据库扩展
 from extensions import db
+from utils.counters import counters
+from utils.leaderboard import leaderboard
+from utils.phash import phash_index
+from utils.relation_cache import relation_cache
+from utils.response_cache import response_cache
+from utils.search_index import search_index
+from utils.tag_index import tag_index
+from utils.topic_cache import topic_cache
 
 # 导入路由（蓝图）
 from blueprints.wallpaper.index import wallpaper_bp
@@ -19,12 +27,13 @@ from blueprints.qr_image.index import qr_image_bp
 from blueprints.post.index import post_bp
 from blueprints.topic.index import topic_bp
 from blueprints.verify.index import verify_bp
+from blueprints.assets.index import assets_bp
 # 加载环境变量
 from dotenv import load_dotenv
 load_dotenv()
 
-# 创建Flask应用
-app = Flask(__name__)
+# 创建Flask应用, 静态文件由 assets 蓝图提供 (ETag / Range / 长缓存)
+app = Flask(__name__, static_folder=None)
 
 # 配置应用
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY')
@@ -51,16 +60,95 @@ app.register_blueprint(qr_image_bp)
 app.register_blueprint(post_bp)
 app.register_blueprint(topic_bp)
 app.register_blueprint(verify_bp)
+app.register_blueprint(assets_bp)
 # 配置图片上传路径
 app.config['UPLOAD_FOLDER'] = 'uploads/wallpapers'
 
-# 设置静态文件的 URL 路径
-app.static_url_path = '/static'
-
 # 初始化数据库
 db.init_app(app)
 migrate = Migrate(app, db)
 
+# 计数写回 (下载量/喜欢数/收藏数/浏览量)
+counters.init_app(app)
+# 用户 喜欢/收藏 关系缓存
+relation_cache.init_app(app)
+# 创作者排行榜
+leaderboard.init_app(app)
+# 话题字典缓存
+topic_cache.init_app(app)
+# 壁纸搜索索引
+search_index.init_app(app)
+# 感知哈希索引
+phash_index.init_app(app)
+# 按标签筛选的位图索引
+tag_index.init_app(app)
+# 公共读接口的响应缓存, 计数写回之后让相关的缓存失效
+response_cache.init_app(app)
+counters.on_flush(response_cache.invalidate_counted)
+
+
+# 响应缓存的命中率、请求合并率和重新计算耗时, 仅管理员可以查看
+@app.route('/metrics/response_cache', methods=['GET'])
+@jwt_required()
+def response_cache_metrics():
+    from model.index import User
+    # token 的 identity 是邮箱
+    user = User.query.filter_by(email=get_jwt_identity()).first()
+    if user is None or user.role != 'admin':
+        return jsonify({'message': '没有权限', 'code': 403}), 403
+    return jsonify({'code': 200, 'data': response_cache.metrics.snapshot()}), 200
+
+
+# 重建壁纸热度值: flask rebuild-hot
+@app.cli.command('rebuild-hot')
+def rebuild_hot():
+    from model.index import Image
+    updated = Image.rebuild_heat()
+    print(f'已重建 {updated} 张壁纸的热度值')
+
+
+# 清理已软删除的帖子: flask purge-posts
+@app.cli.command('purge-posts')
+def purge_posts():
+    from model.index import Post
+    purged = Post.purge_deleted()
+    print(f'已清理 {purged} 条帖子')
+
+
+# 为已有壁纸计算感知哈希: flask index-phash
+@app.cli.command('index-phash')
+def index_phash():
+    from utils.phash import backfill
+    indexed, failed = backfill()
+    print(f'已计算 {indexed} 张壁纸的感知哈希, {failed} 张失败')
+
+
+# 按关注关系重新计算用户的关注数和粉丝数: flask reconcile-follows
+@app.cli.command('reconcile-follows')
+def reconcile_follows():
+    from utils.follow_graph import reconcile_counts
+    updated = reconcile_counts()
+    print(f'已重新计算 {updated} 个用户的关注数和粉丝数')
+
+
+
+# 按实际数据重新计算用户的发帖/壁纸/喜欢/收藏数: flask reconcile-user-stats
+@app.cli.command('reconcile-user-stats')
+def reconcile_user_stats():
+    from model.index import User
+    updated = User.reconcile_stats()
+    print(f'已重新计算 {updated} 个用户的统计数据')
+
+
+
+# 按帖子绑定关系重新计算话题的帖子数: flask reconcile-topics
+@app.cli.command('reconcile-topics')
+def reconcile_topics():
+    from model.index import Topic
+    updated = Topic.reconcile_post_counts()
+    print(f'已重新计算 {updated} 个话题的帖子数')
+
+
 # 运行应用
 if __name__ == '__main__':
     app.run(debug=True)
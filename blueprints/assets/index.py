@@ -0,0 +1,13 @@
+# 静态资源 (壁纸、衍生图、头像、二维码) 的路由(蓝图)
+# 替代 Flask 默认的 static 处理, 地址保持 /static/<filename> 不变
+from flask import Blueprint
+
+from utils.assets import send_asset
+
+# 定义蓝图
+assets_bp = Blueprint('assets', __name__)
+
+
+@assets_bp.route('/static/<path:filename>', methods=['GET'])
+def get_static_file(filename):
+    return send_asset(filename)
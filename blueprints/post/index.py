@@ -3,10 +3,13 @@
 #  导入日期
 from datetime import datetime
 
-from flask import Blueprint, json, jsonify, request
+from flask import Blueprint, current_app, json, jsonify, request
 from flask_jwt_extended import jwt_required
 
 from model.index import Post_Comment, Post_Topic, Post_like, Post, Post_like
+from utils import timeline
+from utils.pagination import parse_limit
+from utils.response_cache import response_cache
 
 post_bp = Blueprint('post', __name__, url_prefix='/post')
 
@@ -30,9 +33,11 @@ def create_post():
 @jwt_required()
 def delete_post(post_id):
     post = Post.query.get(post_id)
-    if post is None:
+    if post is None or post.deleted_at is not None:
         return jsonify({'message': '帖子不存在', 'code': 404}), 404
-    Post.delete(post_id)
+    # ?soft=1 或配置 POST_SOFT_DELETE 开启时使用软删除, 后台清理评论和点赞
+    soft = request.args.get('soft', type=int, default=int(current_app.config.get('POST_SOFT_DELETE', False)))
+    Post.delete(post_id, soft=bool(soft))
     return jsonify({'message': '帖子删除成功', 'code': 200}), 200
 
 # 3. 用户点赞or 取消点赞帖子
@@ -53,14 +58,32 @@ def like_or_cancelLike_post():
 
 # 5. 获取所有帖子
 @post_bp.route('/all', methods=['GET'])
+@response_cache.cached(tags=['post:*'])
 def get_all_post():
-    posts = Post.getAll()
-    return jsonify({'code': 200, 'data': posts,'message': '获取成功'}), 200
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        posts, next_cursor = Post.getAll(after=request.args.get('after'), limit=limit)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'code': 400}), 400
+    return jsonify({'code': 200, 'data': posts, 'next_cursor': next_cursor, 'message': '获取成功'}), 200
+
+
+# 关注流: 我关注的人发的帖子, 通过 after 游标翻页
+@post_bp.route('/timeline/<int:user_id>', methods=['GET'])
+def get_timeline(user_id):
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        posts, next_cursor = timeline.read(user_id, after=request.args.get('after'), limit=limit)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'code': 400}), 400
+    return jsonify({'code': 200, 'data': posts, 'next_cursor': next_cursor, 'message': '获取成功'}), 200
 
 
 # 6. 增加帖子浏览量
 @post_bp.route('/view/<int:post_id>', methods=['PUT'])
 def view_post(post_id):
+    if Post.visible().filter(Post.id == post_id).with_entities(Post.id).first() is None:
+        return jsonify({'message': '帖子不存在', 'code': 404}), 404
     Post.add_view(post_id)
     return jsonify({'message': '浏览量增加成功', 'code': 200}), 200
 
@@ -94,11 +117,29 @@ def delete_comment(comment_id):
 
 
 # 9. 获取帖子的评论
+# 参数: after 游标, limit 顶层评论数量, max_depth 最大展开层数, reply_limit 每条评论展示的回复数量
 @post_bp.route('/comment/<int:post_id>', methods=['GET'])
 def get_comments(post_id):
-    comments = Post_Comment.getComments(post_id)
-    comments_data = [comment.to_dict() for comment in comments]
-    return jsonify({'message': '获取评论成功', 'code': 200, 'data': comments_data}), 200
+    return _comment_tree(post_id)
+
+
+# 9.1 加载更多回复: 获取某条评论下的回复
+@post_bp.route('/comment/<int:post_id>/replies/<int:comment_id>', methods=['GET'])
+def get_comment_replies(post_id, comment_id):
+    return _comment_tree(post_id, parent_id=comment_id)
+
+
+def _comment_tree(post_id, parent_id=None):
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        max_depth = parse_limit(request.args.get('max_depth'), default=3, maximum=10)
+        reply_limit = parse_limit(request.args.get('reply_limit'), default=3, maximum=50)
+        comments_data, next_cursor = Post_Comment.getCommentTree(post_id, parent_id=parent_id,
+                                                                 after=request.args.get('after'), limit=limit,
+                                                                 max_depth=max_depth, reply_limit=reply_limit)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'code': 400}), 400
+    return jsonify({'message': '获取评论成功', 'code': 200, 'data': comments_data, 'next_cursor': next_cursor}), 200
 
 
 # 10. 获取指定话题下的所有帖子
@@ -3,6 +3,8 @@ import uuid
 import qrcode
 from flask import Blueprint, request
 
+from utils.storage import public_url
+
 # 定义蓝图
 qr_image_bp = Blueprint('qrcode', __name__, url_prefix='/qrcode')
 
@@ -40,5 +42,5 @@ def generate_qr():
 
 	return {
 		'code':200,
-		'image_url':f"http://127.0.0.1:5000/static/qr_codes/{filename}"
+		'image_url': public_url(qr_code_path)
 	}
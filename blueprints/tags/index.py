@@ -2,6 +2,8 @@
 from flask import Blueprint
 
 from model.index import Tag
+from utils.conditional import conditional, table_watermark
+from utils.response_cache import response_cache
 
 # 定义一个蓝图
 tag_bp = Blueprint('tag', __name__,url_prefix='/tag')
@@ -10,6 +12,9 @@ tag_bp = Blueprint('tag', __name__,url_prefix='/tag')
 
 # 获取所有标签
 @tag_bp.route('/get_all_tags', methods=['GET'])
+@conditional(table_watermark(Tag))
+# 标签没有写接口 (只在数据库中直接维护), 没有可以触发失效的地方, 缓存只按 RESPONSE_CACHE_TTL 过期
+@response_cache.cached(tags=[])
 def get_tags():
     tags = Tag.query.all()
     if tags:
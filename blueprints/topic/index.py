@@ -1,23 +1,31 @@
 import os
 
 from flask import Blueprint, jsonify, request
-from model.index import Post_Topic, Topic
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from model.index import Post, Post_Topic, Topic
+from utils.conditional import conditional, row_watermark, table_watermark
+from utils.pagination import parse_limit
+from utils.response_cache import response_cache
+from utils.topic_cache import topic_cache
 
 
 # 定义蓝图
 topic_bp = Blueprint('topic', __name__, url_prefix='/topics')
 
+# 话题列表的水位, 用于条件请求 (304)
+TOPIC_WATERMARK = table_watermark(Topic, Topic.updated_at)
+
 
 # 1. 获取所有话题
 @topic_bp.route('', methods=['GET'])
+@conditional(TOPIC_WATERMARK, lag='TOPIC_CACHE_TTL')
+@response_cache.cached(tags=['topic:*'])
 def get_all_topics():
-    topics = Topic.getAll()
-    # 计算话题参与人数 也就是该话题下的帖子数量 可以在Post_topic表中查找
-    for topic in topics:
-        topic.join_nums = Post_Topic.getTopicPostsCount(topic.id)
-    # 序列化话题数据
-    if topics:
-        topics_list = [{'id': topic.id, 'name': topic.name, 'description': topic.description, 'views': topic.view_count, 'joins': topic.join_nums} for topic in topics]
+    # 话题的 名称/描述/浏览量/参与人数(帖子数) 都从缓存的话题字典中读取
+    topics_list = topic_cache.all()
+    if topics_list:
         return {'code': 200, 'msg': '获取成功', 'data': topics_list}
     else:
         return {'code': 404, 'msg': '话题不存在'}
@@ -43,16 +51,27 @@ def bind_topic_to_post():
     topic_id = request.json.get('topic_id')
     if post_id is None or topic_id is None:
         return jsonify({'message': 'post_id 和 topic_id 不能为空', 'code': 400}), 400
-    Post_Topic.create(post_id, topic_id)
+    if topic_cache.get(topic_id) is None:
+        return jsonify({'message': '话题不存在', 'code': 404}), 404
+    # 帖子不存在或已被 (软) 删除时不能绑定, 否则会在话题下留下看不到的记录
+    if not db.session.query(Post.visible().filter(Post.id == post_id).exists()).scalar():
+        return jsonify({'message': '帖子不存在', 'code': 404}), 404
+    try:
+        Post_Topic.create(post_id, topic_id)
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'message': '帖子已绑定该话题', 'code': 400}), 400
     return jsonify({'message': '话题绑定成功', 'code': 200}), 200
 
 # 4. 获取浏览量较高的话题
 @topic_bp.route('/hot', methods=['GET'])
+@conditional(TOPIC_WATERMARK, lag='TOPIC_CACHE_TTL')
+@response_cache.cached(tags=['topic:*'])
 def get_hot_topics():
-    topics = Topic.getHotTopics()
+    topics = topic_cache.hot(3)
     # 序列化话题数据
     if topics:
-        topics_list = [{'id': topic.id, 'name': topic.name, 'description': topic.description, 'views': topic.view_count} for topic in topics]
+        topics_list = [{'id': topic['id'], 'name': topic['name'], 'description': topic['description'], 'views': topic['views']} for topic in topics]
         return {'code': 200,'msg': '获取成功', 'data': topics_list}, 200
     else:
         return {'code': 404,'msg': '话题不存在'}, 404
@@ -61,11 +80,16 @@ def get_hot_topics():
 # 5. 获取话题下的帖子
 @topic_bp.route('/<int:topic_id>/posts', methods=['GET'])
 def get_topic_posts(topic_id):
-    posts = Post_Topic.getTopicPosts(topic_id)
-    return jsonify({'message': '获取帖子成功', 'code': 200, 'data': posts}), 200
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        posts, next_cursor = Post_Topic.getTopicPosts(topic_id, after=request.args.get('after'), limit=limit)
+    except ValueError as e:
+        return jsonify({'message': str(e), 'code': 400}), 400
+    return jsonify({'message': '获取帖子成功', 'code': 200, 'data': posts, 'next_cursor': next_cursor}), 200
 
 # 6. 根据话题id获取话题信息
 @topic_bp.route('/<int:topic_id>', methods=['GET'])
+@conditional(row_watermark(Topic, Topic.updated_at, 'topic_id'))
 def get_topic_by_id(topic_id):
     topic = Topic.query.get_or_404(topic_id)
     return jsonify({'message': '获取话题成功', 'code': 200, 'data': topic.to_dict()}), 200
\ No newline at end of file
@@ -1,17 +1,26 @@
-import os
 from datetime import datetime
 
 from flask import Blueprint, request, jsonify
-from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
 from flask_jwt_extended import create_access_token, jwt_required
 
 from extensions import db
 
 # 导入model
 
-from model.index import Post, User, Image, user_favorite_images, user_followers
+from model.index import Post, User, Image, user_collect_images, user_favorite_images
+from utils import follow_graph
+from utils.conditional import conditional, row_watermark
+from utils.counters import counters
+from utils.fields import column, parse_fields, project, render
+from utils.leaderboard import leaderboard
+from utils.loaders import get_user, load_users
+from utils.pagination import MAX_LIMIT, parse_limit
+from utils.relation_cache import relation_cache
+from utils.response_cache import response_cache
+from utils.storage import public_url, store_upload
+from utils.streaming import iter_batches, stream_json, wants_ndjson
 
 # 定义蓝图
 user_bp = Blueprint('user', __name__, url_prefix='/user')
@@ -68,12 +77,10 @@ def login():
     if not user:
         return jsonify({'error': '用户不存在'}), 404
     
-    # 计算用户的图片数量和帖子数量
-    images_count = Image.query.filter_by(create_by=user.id).count()
-    posts_count = Post.query.filter_by(user_id=user.id).count()
+    # 用户的图片数量和帖子数量
+    images_count = user.wallpapers_count
+    posts_count = user.posts_count
 
-	# 打印
-    print("213123123131", images_count, posts_count)
     # 验证密码
     if not check_password_hash(user.password, password):
         return jsonify({'error': '密码有误'}), 401
@@ -108,9 +115,6 @@ def login():
     return jsonify({'message': '登录成功', 'data': data, 'code': 200, 'access_token': access_token}), 200
 
 # 用户头像上传
-UPLOAD_FOLDER = 'static'
-
-
 @user_bp.route('/upload_avatar', methods=['POST'])
 def upload_avatar():
 	# 获取上传的文件
@@ -118,11 +122,12 @@ def upload_avatar():
 	print(file)
 	if not file:
 		return jsonify({'error': '没有上传文件'}), 400
-	filename = secure_filename(file.filename)  # 拿到上传图片的名字
-	# 保存文件
-	file_path = os.path.join(UPLOAD_FOLDER, filename)  # 拿到上传图片的路径
-	file.save(file_path)
-	image_url = f'http://127.0.0.1:5000/{file_path}'
+	# 按内容哈希保存文件, 相同的头像只存一份, 并且可以长期缓存
+	try:
+		stored = store_upload(file.stream)
+	except ValueError as e:
+		return jsonify({'error': str(e)}), 400
+	image_url = public_url(stored.path)
 
 	return jsonify({'message': '头像上传成功', 'code': 200, 'image_url': image_url}), 200
 
@@ -138,6 +143,8 @@ def bind_avatar():
 	user.image = image_url
 	db.session.commit()
 	db.session.close()
+	# 帖子列表中包含作者的头像
+	response_cache.invalidate('post:*')
 
 	return jsonify({'message': '头像绑定成功', 'code': 200, 'image_url': image_url}), 200
 
@@ -176,31 +183,44 @@ def update_userInfo():
 	user.description = description
 	db.session.commit()
 	db.session.close()
+	response_cache.invalidate('post:*')
 
 	return jsonify({'message': '用户信息更新成功', 'code': 200}), 200
 
 
 # 获取用户上传的图片列表
+# 用户图片列表可以返回的字段, 通过 ?fields=image_id,image_url 只返回其中一部分
+USER_IMAGE_FIELDS = {
+	'image_id': column(Image.id),
+	'image_url': column(Image.url),
+	'image_description': column(Image.alt),
+	'image_upload_time': column(Image.create_time, lambda t: t.strftime('%Y-%m-%d %H:%M:%S') if t else None),
+	'image_variants': column(Image.variants),
+}
+
+
+# 用户关联的图片 (喜欢/收藏), 直接连接中间表, 只查询所选字段需要的列
+def _related_images(table, user_id, names):
+	query = Image.query.join(table, table.c.image_id == Image.id).filter(table.c.user_id == user_id)
+	return project(query, USER_IMAGE_FIELDS, names).all()
+
+
 @user_bp.route('/get_user_images', methods=['GET'])
 def get_user_images():
+	try:
+		names = parse_fields(USER_IMAGE_FIELDS, request.args.get('fields'))
+	except ValueError as e:
+		return jsonify({'message': str(e), 'code': 400}), 400
 	# 获取用户的id
 	user_id = request.args.get('user_id')
 	# 通过id在Image表中查找
-	images = Image.query.filter_by(create_by=user_id).all()
-	# 将查找的图片的进行返回
-	if images:
-		image_list = []
-		for image in images:
-			create_time = image.create_time.strftime('%Y-%m-%d %H:%M:%S')
-			image_list.append({
-				'image_id': image.id,
-				'image_url': image.url,
-				'image_description': image.alt,
-				'image_upload_time': create_time
-			})
-		return jsonify({'data': image_list, 'code': 200}), 200
-	else:
+	query = Image.query.filter_by(create_by=user_id)
+	if query.with_entities(Image.id).first() is None:
 		return jsonify({'message': '该用户没有上传图片', 'code': 200}), 200
+	# 分批读取并流式返回
+	query = project(query, USER_IMAGE_FIELDS, names, Image.id)
+	items = (item for rows in iter_batches(query, Image.id) for item in render(rows, USER_IMAGE_FIELDS, names))
+	return stream_json(items, 'data', {'code': 200}, ndjson=wants_ndjson())
 
 
 # 定义了两个路由 /user/<int:user_id>/likes 和 /user/<int:user_id>/collects。
@@ -210,46 +230,36 @@ def get_user_images():
 
 @user_bp.route('/<int:user_id>/likes', methods=['GET'])
 def get_user_likes(user_id):
-	user = User.query.get_or_404(user_id)
-	likes = user.favorite_images
-	like_images = []
-	for like in likes:
-		like_images.append({
-			'image_id': like.id,
-			'image_url': like.url,
-			'image_description': like.alt,
-			'image_upload_time': like.create_time.strftime('%Y-%m-%d %H:%M:%S')
-		})
-	return jsonify({'data': like_images, 'code': 200}), 200
+	try:
+		names = parse_fields(USER_IMAGE_FIELDS, request.args.get('fields'))
+	except ValueError as e:
+		return jsonify({'message': str(e), 'code': 400}), 400
+	User.query.get_or_404(user_id)
+	rows = _related_images(user_favorite_images, user_id, names)
+	return jsonify({'data': render(rows, USER_IMAGE_FIELDS, names), 'code': 200}), 200
 
 
 @user_bp.route('/<int:user_id>/collects', methods=['GET'])
 def get_user_collects(user_id):
-	user = User.query.get_or_404(user_id)
-	collects = user.collect_images
-	collects_images = []
-	for item in collects:
-		collects_images.append({
-			'image_id': item.id,
-			'image_url': item.url,
-			'image_description': item.alt,
-			'image_upload_time': item.create_time.strftime('%Y-%m-%d %H:%M:%S')
-		})
-	return jsonify({'data': collects_images, 'code': 200}), 200
+	try:
+		names = parse_fields(USER_IMAGE_FIELDS, request.args.get('fields'))
+	except ValueError as e:
+		return jsonify({'message': str(e), 'code': 400}), 400
+	User.query.get_or_404(user_id)
+	rows = _related_images(user_collect_images, user_id, names)
+	return jsonify({'data': render(rows, USER_IMAGE_FIELDS, names), 'code': 200}), 200
 
 
 # 根据用户id 获取用户的信息
 @user_bp.route('/info/<int:user_id>', methods=['GET'])
+@conditional(row_watermark(User, User.update_time, 'user_id'))
 def get_user_info(user_id):
 	user = User.query.get_or_404(user_id)
-	# 获取用户喜欢的图片数量
-	like_count = len(user.favorite_images)
-	# 获取用户收藏的图片数量
-	collect_count = len(user.collect_images)
-	# 获取用户发帖的数量
-	post_count =  Post.query.filter_by(user_id=user_id).count()
-	# 获取用户上传的壁纸数量
-	wallpapers = Image.query.filter_by(create_by=user_id).count()
+	# 喜欢/收藏的图片数量、发帖数量、上传的壁纸数量, 都是写入时维护的统计字段
+	like_count = user.likes_given_count
+	collect_count = user.collects_count
+	post_count = user.posts_count
+	wallpapers = user.wallpapers_count
  
 	userInfo = {
 		'user_id': user.id,
@@ -280,23 +290,23 @@ def toggle_like_image():
     user = User.query.get_or_404(user_id)
     image = Image.query.get_or_404(image_id)
 
-    # 检查当前用户是否已经喜欢过该壁纸
-    if image in user.favorite_images:
-        # 如果已经喜欢，则取消喜欢
-        user.favorite_images.remove(image)
-        image.like_count -= 1
-        creator = User.query.get_or_404(image.create_by)
-        creator.like_count -= 1
-        message = '取消喜欢成功'
-    else:
-        # 如果没有喜欢，则添加喜欢
-        user.favorite_images.append(image)
-        image.like_count += 1
-        creator = User.query.get_or_404(image.create_by)
-        creator.like_count += 1
-        message = '喜欢成功'
-
-    db.session.commit()
+    # 已经喜欢则取消喜欢, 否则添加喜欢 (直接操作中间表, 不加载用户喜欢的全部壁纸)
+    try:
+        liked = User.toggle_image(user_favorite_images, user.id, image.id)
+        User.add_stats(user.id, likes_given_count=1 if liked else -1)
+        db.session.commit()
+    except IntegrityError:
+        # 同一用户的并发请求已经添加了喜欢
+        db.session.rollback()
+        return jsonify({'code': 409, 'message': '请勿重复操作'}), 409
+    relation_cache.update('is_liked', user.id, image.id, liked)
+    response_cache.invalidate(f'image:{image.id}')
+    delta = 1 if liked else -1
+    message = '喜欢成功' if liked else '取消喜欢成功'
+    # 作品和创建者的喜欢数由计数模块批量写回
+    counters.incr(Image, image.id, 'like_count', delta)
+    counters.incr(User, image.create_by, 'like_count', delta)
+    leaderboard.record('likes', image.create_by, delta)
 
     return jsonify({'code': 200, 'message': message}), 200
 
@@ -309,19 +319,19 @@ def toggle_collect_image():
     image_id = request.json.get('image_id')
     user = User.query.get_or_404(user_id)
     image = Image.query.get_or_404(image_id)
-    # 检查当前用户是否已经收藏过该壁纸
-    if image in user.collect_images:
-        # 如果已经收藏，则取消收藏
-        user.collect_images.remove(image)
-        image.favorite_count -= 1
-        message = '取消收藏成功'
-    else:
-        # 如果没有收藏，则添加收藏
-        user.collect_images.append(image)
-        image.favorite_count += 1
-        message = '收藏成功'
-        
-    db.session.commit()
+    # 已经收藏则取消收藏, 否则添加收藏
+    try:
+        collected = User.toggle_image(user_collect_images, user.id, image.id)
+        User.add_stats(user.id, collects_count=1 if collected else -1)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'code': 409, 'message': '请勿重复操作'}), 409
+    relation_cache.update('is_collected', user.id, image.id, collected)
+    response_cache.invalidate(f'image:{image.id}')
+    delta = 1 if collected else -1
+    message = '收藏成功' if collected else '取消收藏成功'
+    counters.incr(Image, image.id, 'favorite_count', delta)
 
     return jsonify({'code': 200, 'message': message}), 200
 
@@ -337,9 +347,8 @@ def download_image():
         # 拿到当前的图片信息
         image = Image.query.get_or_404(image_id)
         
-        # 增加当前的图片的下载数
-        image.download_count += 1
-        db.session.commit()  # 提交更改
+        # 增加当前的图片的下载数, 由计数模块批量写回 (同时更新热度值)
+        counters.incr(Image, image.id, 'download_count')
         
         # 返回图片的 URL
         return jsonify({'code': 200, 'data': image.url, 'message': '下载成功'}), 200
@@ -357,32 +366,19 @@ def follow_user():
 	follower_id = request.json.get('follower_id')  # 当前用户id
 	followed_id = request.json.get('followed_id')  # 被关注用户id
 
-	print(follower_id, followed_id)
-
 	if not follower_id or not followed_id:
 		return jsonify({'message': 'Follower ID and Followed ID are required.'}), 400
+	if int(follower_id) == int(followed_id):
+		return jsonify({'message': '不能关注自己.'}), 400
 
-	follower = User.query.get(follower_id)
-	followed = User.query.get(followed_id)
-
-	if not follower or not followed:
+	users = load_users([follower_id, followed_id])
+	if not all(users.values()):
 		return jsonify({'message': '用户找不到.'}), 404
 
-	# 判断是否已经关注
-	if follower.following.filter(user_followers.c.followed_id == followed_id).count() > 0:
-		return jsonify({'message': '已经关注了该作者.'}), 400
-
 	try:
-		# 插入中间表
-		follower.following.append(followed)
-
-		# 更新用户的关注数和粉丝数
-		follower.follow_count += 1
-		followed.followers_count += 1
-
-		# 提交事务
-		db.session.commit()
-
+		# 插入中间表, 同时原子更新关注数和粉丝数
+		if not follow_graph.follow(int(follower_id), int(followed_id)):
+			return jsonify({'message': '已经关注了该作者.'}), 400
 		return jsonify({'message': '成功关注.', 'code': 200}), 200
 	except Exception as e:
 		db.session.rollback()
@@ -398,27 +394,14 @@ def unfollow_user():
 	if not follower_id or not followed_id:
 		return jsonify({'message': 'Follower ID and Followed ID are required.'}), 400
 
-	follower = User.query.get(follower_id)
-	followed = User.query.get(followed_id)
-
-	if not follower or not followed:
+	users = load_users([follower_id, followed_id])
+	if not all(users.values()):
 		return jsonify({'message': '用户找不到.'}), 404
 
-	# 判断是否已经关注
-	if follower.following.filter(user_followers.c.followed_id == followed_id).count() == 0:
-		return jsonify({'message': '未关注该用户.'}), 400
-
 	try:
-		# 从中间表中移除记录
-		follower.following.remove(followed)
-
-		# 更新用户的关注数和粉丝数
-		follower.follow_count -= 1
-		followed.followers_count -= 1
-
-		# 提交事务
-		db.session.commit()
-
+		# 从中间表中移除记录, 同时原子更新关注数和粉丝数
+		if not follow_graph.unfollow(int(follower_id), int(followed_id)):
+			return jsonify({'message': '未关注该用户.'}), 400
 		return jsonify({'message': '取消关注成功.', 'code': 200}), 200
 	except Exception as e:
 		db.session.rollback()
@@ -433,31 +416,71 @@ def get_user_follows(user_id):
 	if not user:
 		return jsonify({'message': 'User not found.'}), 404
 
-	followers_count = user.followers.count()
-	following_count = user.following.count()
-
+	# 关注数和粉丝数在关注/取消关注时同步维护, 不再每次 count
 	return jsonify({
-		'followers_count': followers_count,
-		'following_count': following_count
+		'followers_count': user.followers_count or 0,
+		'following_count': user.follow_count or 0
 	}), 200
 
 
 # 用来返回一个bool值, 标识当前用户是否关注了另外一个用户
 @user_bp.route('/<int:user_id>/is_following/<int:author_id>', methods=['GET'])
 def is_following(user_id, author_id):
-	user = User.query.get(user_id)
-	author = User.query.get(author_id)
-	print(11)
-	print(user, author)
-	if not user or not author:
+	users = load_users([user_id, author_id])
+	if not all(users.values()):
 		return jsonify({'message': 'User not found.'}), 404
 
 	# 判断当前用户是否已经关注了该作者
-	is_following = user.following.filter(user_followers.c.followed_id == author_id).count() > 0
+	is_following = follow_graph.is_following_many(user_id, [author_id])[author_id]
 
 	return jsonify({'is_following': is_following}), 200
 
 
+# 批量判断当前用户是否关注了一组用户, 请求体: {"user_ids": [...]}
+@user_bp.route('/<int:user_id>/is_following', methods=['POST'])
+def is_following_batch(user_id):
+	target_ids = request.json.get('user_ids')
+	if not isinstance(target_ids, list):
+		return jsonify({'message': 'user_ids 必须是数组', 'code': 400}), 400
+	try:
+		target_ids = list(dict.fromkeys(int(target_id) for target_id in target_ids))
+	except (TypeError, ValueError):
+		return jsonify({'message': 'user_ids 必须是整数数组', 'code': 400}), 400
+	if len(target_ids) > MAX_LIMIT:
+		return jsonify({'message': f'user_ids 最多 {MAX_LIMIT} 个', 'code': 400}), 400
+
+	relations = follow_graph.is_following_many(user_id, target_ids)
+	data = [{'user_id': target_id, 'is_following': relations[target_id]} for target_id in target_ids]
+	return jsonify({'code': 200, 'data': data}), 200
+
+
+# 粉丝列表 / 关注列表 / 互相关注列表, 按关注时间倒序, 通过 after 游标翻页
+def _follow_list(user_id, lister):
+	if get_user(user_id) is None:
+		return jsonify({'message': 'User not found.', 'code': 404}), 404
+	try:
+		limit = parse_limit(request.args.get('limit'))
+		users, next_cursor = lister(user_id, after=request.args.get('after'), limit=limit)
+	except ValueError as e:
+		return jsonify({'message': str(e), 'code': 400}), 400
+	return jsonify({'code': 200, 'data': users, 'next_cursor': next_cursor, 'message': '获取成功'}), 200
+
+
+@user_bp.route('/<int:user_id>/followers', methods=['GET'])
+def get_followers(user_id):
+	return _follow_list(user_id, follow_graph.followers)
+
+
+@user_bp.route('/<int:user_id>/following', methods=['GET'])
+def get_following(user_id):
+	return _follow_list(user_id, follow_graph.following)
+
+
+@user_bp.route('/<int:user_id>/mutual_follows', methods=['GET'])
+def get_mutual_follows(user_id):
+	return _follow_list(user_id, follow_graph.mutual)
+
+
 # 修改个人中心页资料模块的后方背景
 # 接收图片url , 和 user_id.
 # 讲user_id 对应的user数据的 person_home_background_image 的值 指定为 接收图片url
@@ -479,6 +502,7 @@ def modify_background():
 	try:
 		user.person_home_background_image = background_image_url
 		db.session.commit()
+		response_cache.invalidate('post:*')
 		return jsonify({'message': '背景图片更新成功', 'code': 200}), 200
 	except Exception as e:
 		db.session.rollback()
@@ -489,15 +513,8 @@ def modify_background():
 # 获取发帖数量前三的用户
 @user_bp.route('/get_top_users', methods=['GET'])
 def get_top_users():
-    # 获取发帖数量前三的用户及其发帖数量
-    top_users = (
-        db.session.query(User, func.count(Post.id).label('post_count'))  # 获取用户和发帖数量
-        .join(Post)  # 连接 User 和 Post 表
-        .group_by(User.id)  # 按用户 ID 分组
-        .order_by(func.count(Post.id).desc())  # 按发帖数量降序排列
-        .limit(3)  # 限制结果为前3个用户
-        .all()
-    )
+    # 直接读取排行榜 (发帖数总榜), 不再对整个 post 表分组统计
+    top_users = leaderboard.top('posts', 'all', 3)
 
     # 构建返回数据
     result = [{'user': user.to_dict(), 'post_count': post_count} for user, post_count in top_users]
@@ -505,24 +522,37 @@ def get_top_users():
     return jsonify({'code': 200, 'message': '获取成功', 'data': result}), 200
 
 
+# 创作者排行榜
+# 参数: metric 指标 posts/wallpapers/likes, window 时间范围 all/7d/30d, limit 数量
+@user_bp.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    try:
+        limit = parse_limit(request.args.get('limit'), default=10)
+        ranking = leaderboard.top(request.args.get('metric', 'posts'), request.args.get('window', 'all'), limit)
+    except ValueError as e:
+        return jsonify({'code': 400, 'message': str(e)}), 400
+    data = [{'user': user.to_dict(), 'score': score} for user, score in ranking]
+    return jsonify({'code': 200, 'message': '获取成功', 'data': data}), 200
+
+
 
 
 #                                  admin - apis
 
 
-# 获取所有的用户 (没有被冻结的用户)
-@user_bp.route('/get_all_users', methods=['GET'])
-def get_all_users():
-	# 修正 SQLAlchemy 查询语句中的布尔逻辑
-	users = User.query.filter(User.role == 'user').all()
-	result = []
+# 管理后台用户列表需要的列
+ADMIN_USER_COLUMNS = (User.id, User.username, User.email, User.gender, User.country, User.province,
+	User.city, User.create_time, User.status, User.role)
+
 
-	if users:
-		# 去除不需要的字段并创建字典
-		for user in users:
+def _admin_user_rows(role):
+	# 分批读取某个角色的用户, 只查询需要的列
+	query = User.query.filter(User.role == role).with_entities(*ADMIN_USER_COLUMNS)
+	for rows in iter_batches(query, User.id):
+		for user in rows:
 			# 处理时间格式
 			create_time = user.create_time.strftime('%Y-%m-%d %H:%M:%S')
-			user_data = {
+			yield {
 				'id': user.id,
 				'username': user.username,
 				'email': user.email,
@@ -531,38 +561,22 @@ def get_all_users():
 				'create_time': create_time,
 				'status': user.status,
 				'role': user.role,
-
 			}
-			result.append(user_data)
 
-		return jsonify({'users': result}), 200
-	else:
+
+def _admin_user_list(role):
+	if User.query.filter(User.role == role).with_entities(User.id).first() is None:
 		return jsonify({'message': 'not found'}), 404
+	# 边查询边写出响应, 用户再多内存占用也不会增长
+	return stream_json(_admin_user_rows(role), 'users', ndjson=wants_ndjson())
+
+
+# 获取所有的用户 (没有被冻结的用户)
+@user_bp.route('/get_all_users', methods=['GET'])
+def get_all_users():
+	return _admin_user_list('user')
 
 # 获取所有管理员
 @user_bp.route('/get_all_administrators', methods=['GET'])
 def get_all_administrators():
-	users = User.query.filter( User.role == 'admin').all()
-	result = []
-
-	if users:
-		# 去除不需要的字段并创建字典
-		for user in users:
-			# 处理时间格式
-			create_time = user.create_time.strftime('%Y-%m-%d %H:%M:%S')
-			user_data = {
-				'id': user.id,
-				'username': user.username,
-				'email': user.email,
-				'gender': user.gender,
-				'address': f'{user.country,  user.province , user.city}',
-				'create_time': create_time,
-				'status': user.status,
-				'role': user.role,
-
-			}
-			result.append(user_data)
-
-		return jsonify({'users': result}), 200
-	else:
-		return jsonify({'message': 'not found'}), 404
+	return _admin_user_list('admin')
@@ -1,130 +1,209 @@
 #  编写关于壁纸的路由(蓝图)
-import datetime
 import os
 
 # 导入Flask类
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, redirect, request
 from flask_jwt_extended import jwt_required
 from sqlalchemy.exc import SQLAlchemyError
-from werkzeug.utils import secure_filename
-from PIL import Image as I  # 导入 Pillow 库来处理图像
 
 # 导入db数据库
 from extensions import db
 # 导入模型
 from model.index import Image, Tag, image_tags, User, user_collect_images, user_favorite_images
+from utils.assets import STATIC_FOLDER, send_asset
+from utils.conditional import conditional, row_watermark, table_watermark
+from utils.derivatives import SIZES, derivative_key, existing_variants, generate_derivatives, pick_format
+from utils.fields import Field, column, image_tags_field, parse_fields, project, render, select_columns
+from utils.leaderboard import leaderboard
+from utils.loaders import load_users
+from utils.pagination import MAX_LIMIT, decode_cursor, encode_cursor, keyset_paginate, parse_limit
+from utils.phash import dhash, phash_index, to_signed
+from utils.relation_cache import relation_cache
+from utils.response_cache import response_cache
+from utils.search_index import search_index
+from utils.storage import hash_from_url, local_path, public_url, store_upload, stored_object_path
+from utils.streaming import iter_batches, stream_json, wants_ndjson
+from utils.tag_index import tag_index
 
 # 定义蓝图
 wallpaper_bp = Blueprint('wallpaper', __name__, url_prefix='/wallpaper')
 
 
 
+# 壁纸列表依赖的整张表的水位, 用于条件请求 (304)
+IMAGE_WATERMARK = table_watermark(Image, Image.update_time)
+
+
+def _format_time(fmt):
+    return lambda value: value.strftime(fmt) if value else None
+
+
+# 各列表接口可以返回的字段, 通过 ?fields=id,url,like_count 只返回其中一部分 (只查询需要的列)
+HOT_FIELDS = {
+    'id': column(Image.id),
+    'url': column(Image.url),
+    'author': column(Image.create_by),  # 这可能需要转换成用户名
+    'type': column(Image.type),
+    'download_count': column(Image.download_count),
+    'like_count': column(Image.like_count),
+    'favorite_count': column(Image.favorite_count),
+    'variants': column(Image.variants),
+    'heat_value': column(Image.heat_score),  # 包含热度值
+}
+
+
 @wallpaper_bp.route('/get_hot20', methods=['GET'])
+@conditional(IMAGE_WATERMARK)
+@response_cache.cached(tags=['image:*'])
 def get_hot_wallpapers():
-    # 查询数据库并获取前20张图片，并计算热度值
-    images = (Image.query
-              .order_by((Image.download_count * 3) + (Image.like_count * 2) + (Image.favorite_count * 1).desc())
-              .limit(100).all())
-
-    # 构造返回的JSON数据
-    data = []
-    for image in images:
-        heat_value = (image.download_count * 3) + (image.like_count * 2) + (image.favorite_count * 1)
-        data.append({
-            'id': image.id,
-            'url': image.url,
-            'author': image.create_by,  # 这可能需要转换成用户名
-            'type': image.type,
-            'download_count': image.download_count,
-            'like_count': image.like_count,
-            'favorite_count': image.favorite_count,
-            'heat_value': heat_value  # 包含热度值
-        })
+    # 按预先维护的热度值取前20张图片
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        names = parse_fields(HOT_FIELDS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+    rows = Image.getHot(limit, select_columns(HOT_FIELDS, names))
 
     # 返回JSON数据
-    return jsonify(data)
+    return jsonify(render(rows, HOT_FIELDS, names))
+
+# 创建者用户信息
+def _author_info(row, authors):
+    author = authors.get(row.create_by)
+    if author is None:
+        return None
+    return {
+        'name': author.username,
+        'user_id': author.id,
+        'avatar': author.image
+    }
+
+
+ALL_FIELDS = {
+    'id': column(Image.id),
+    'name': column(Image.name),
+    'url': column(Image.url),
+    # 一页的创建者一次性批量加载
+    'author': Field([Image.create_by], _author_info,
+                    prefetch=lambda rows: load_users(row.create_by for row in rows)),
+    'type': column(Image.type),
+    'file_size_mb': column(Image.file_size, lambda size: round(size / 1024 / 1024, 2)),
+    'dimensions': column(Image.dimensions),
+    'download_count': column(Image.download_count),
+    'like_count': column(Image.like_count),
+    'favorite_count': column(Image.favorite_count),
+    'variants': column(Image.variants),
+    'create_time': column(Image.create_time, _format_time('%Y:%m:%d %H:%M')),
+    'status': column(Image.status),
+}
+
 
 # 获取所有壁纸
 @wallpaper_bp.route('/get_all', methods=['GET'])
+@conditional(IMAGE_WATERMARK, table_watermark(User, User.update_time))
 def get_all_wallpapers():
-    # 查询数据库并获取所有图片
-    images = Image.query.all()
-    if images:
-        # 构造返回的JSON数据
-        data = []
-        for image in images:
-            # 获取创建者用户信息
-            author = User.query.get(image.create_by)
-            if author:
-                author_info = {
-                    'name': author.username,
-                    'user_id': author.id,
-                    'avatar': author.image
-                }
-            else:
-                author_info = None
-            # 解析 create_time 并转换为所需格式
-            create_time = image.create_time.strftime('%Y:%m:%d %H:%M')
-            data.append({
-                'id': image.id,
-                'name': image.name,
-                'url': image.url,
-                'author': author_info,  # 这可能需要转换成用户名
-                'type': image.type,
-                'file_size_mb': round(image.file_size / 1024 / 1024, 2),
-                'dimensions': image.dimensions,
-                'download_count': image.download_count,
-                'like_count': image.like_count,
-                'favorite_count': image.favorite_count,
-                'create_time': create_time,
-                'status': image.status,
-            })
-        return jsonify({'code': 200, 'data': data, 'message': '成功获取'})
-    else:
+    try:
+        names = parse_fields(ALL_FIELDS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+    if Image.query.with_entities(Image.id).first() is None:
         return  jsonify({'message': '找不到壁纸.'})
+    # 查询数据库并分批读取所有图片 (只取所选字段需要的列), 边查询边写出响应
+    query = project(Image.query, ALL_FIELDS, names, Image.id)
+    items = (item for rows in iter_batches(query, Image.id) for item in render(rows, ALL_FIELDS, names))
+    return stream_json(items, 'data', {'code': 200, 'message': '成功获取'}, ndjson=wants_ndjson())
 
 
 # 下架壁纸
 
 
 
+TAG_FIELDS = {
+    'id': column(Image.id),
+    'name': column(Image.name),
+    'url': column(Image.url),
+    'alt': column(Image.alt),
+    'type': column(Image.type),
+    'file_size': column(Image.file_size),
+    'dimensions': column(Image.dimensions),
+    'create_by': column(Image.create_by),  # 假设 create_by 是一个 User ID，需要额外查询 User 表来获取用户名
+    'create_time': column(Image.create_time),
+    'update_time': column(Image.update_time),
+    'download_count': column(Image.download_count),
+    'like_count': column(Image.like_count),
+    'favorite_count': column(Image.favorite_count),
+    'variants': column(Image.variants),
+    'tags': image_tags_field(),  # 获取图片的标签名称列表
+}
+
+
 @wallpaper_bp.route('/tags/<string:tag>', methods=['GET'])
+@conditional(IMAGE_WATERMARK)
 def get_wallpapers_by_tag(tag):
+    try:
+        names = parse_fields(TAG_FIELDS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
     # 查询标签的 ID
     tag_obj = Tag.query.filter_by(name=tag).first_or_404()
     tag_id = tag_obj.id
 
-    # 查询 image_tags 关联表中的 image_id
-    image_ids = [image_tag.image_id for image_tag in db.session.query(image_tags).filter_by(tag_id=tag_id).all()]
+    # 通过 image_tags 关联表连接查询该标签下的图片
+    query = Image.query.join(image_tags, image_tags.c.image_id == Image.id).filter(image_tags.c.tag_id == tag_id)
+    rows = project(query, TAG_FIELDS, names).all()
 
-    # 根据 image_ids 查询图片信息
-    images = Image.query.filter(Image.id.in_(image_ids)).all()
+    return jsonify(render(rows, TAG_FIELDS, names))
 
-    # 构造返回的 JSON 数据
-    data = []
-    for image in images:
-        data.append({
-            'id': image.id,
-            'name': image.name,
-            'url': image.url,
-            'alt': image.alt,
-            'type': image.type,
-            'file_size': image.file_size,
-            'dimensions': image.dimensions,
-            'create_by': image.create_by,  # 假设 create_by 是一个 User ID，需要额外查询 User 表来获取用户名
-            'create_time': image.create_time,
-            'update_time': image.update_time,
-            'download_count': image.download_count,
-            'like_count': image.like_count,
-            'favorite_count': image.favorite_count,
-            'tags': [tag.name for tag in image.tags]  # 获取图片的标签名称列表
-        })
 
-    return jsonify(data)
+FILTER_FIELDS = {name: field for name, field in TAG_FIELDS.items() if name != 'update_time'}
+
+
+# 按 id 列表查询图片 (只取所选字段需要的列), 保持 id 列表的顺序
+def _rows_by_ids(image_ids, spec, names):
+    if not image_ids:
+        return []
+    rows = {row.id: row for row in project(Image.visible(), spec, names, Image.id).filter(Image.id.in_(image_ids))}
+    return [rows[image_id] for image_id in image_ids if image_id in rows]
+
+
+# 按标签组合筛选壁纸, 最新上传的在前
+# 参数 (多个标签用逗号分隔): all 同时带有这些标签, any 带有其中任意一个, not 不带这些标签;
+# limit 每页数量, after 上一页返回的 next_cursor
+# 同时返回筛选结果中其他标签的数量 (facets), 用于展示可以继续叠加的标签
+@wallpaper_bp.route('/filter', methods=['GET'])
+def filter_wallpapers_by_tags():
+    def tag_names(param):
+        return [name.strip() for name in request.args.get(param, '').split(',') if name.strip()]
+
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        after = request.args.get('after')
+        before = decode_cursor(after)[1] if after else None
+        names = parse_fields(FILTER_FIELDS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+
+    all_of = tag_index.resolve(tag_names('all'))
+    any_of = tag_index.resolve(tag_names('any'))
+    none_of = tag_index.resolve(tag_names('not'))
+    image_ids, total, has_more, facet_counts = tag_index.filter(all_of, any_of, none_of, before=before, limit=limit)
+
+    data = render(_rows_by_ids(image_ids, FILTER_FIELDS, names), FILTER_FIELDS, names)
+
+    tag_name_map = tag_index.tag_names()
+    facets = sorted(
+        ({'tag_id': tag_id, 'name': tag_name_map.get(tag_id), 'count': count}
+         for tag_id, count in facet_counts.items() if count and tag_id not in all_of),
+        key=lambda facet: (-facet['count'], facet['tag_id'])
+    )
+    next_cursor = encode_cursor(None, image_ids[-1]) if has_more else None
+    return jsonify({'code': 200, 'data': data, 'total': total, 'facets': facets, 'next_cursor': next_cursor}), 200
 
 
 # 根据图片id返回图片
 @wallpaper_bp.route('/<int:image_id>', methods=['GET'])
+@conditional(row_watermark(Image, Image.update_time, 'image_id'))
+@response_cache.cached(tags=lambda image_id: [f'image:{image_id}'])
 def get_wallpaper_by_id(image_id):
     image = Image.query.get(image_id)
     # 如果找不到,
@@ -143,6 +222,7 @@ def get_wallpaper_by_id(image_id):
             'download_count': image.download_count,
             'like_count': image.like_count,
             'favorite_count': image.favorite_count,
+            'variants': image.variants,
             #  图片的分辨率
             'dimensions' : image.dimensions,
             # 图片的上传时间
@@ -155,88 +235,84 @@ def get_wallpaper_by_id(image_id):
     return jsonify(data)
 
 
+# 获取图片的某一档衍生图 (thumb/preview/full), 根据请求头 Accept 选择 AVIF 或 WebP,
+# 客户端都不支持或还没有衍生图时重定向到原图
+@wallpaper_bp.route('/<int:image_id>/image/<string:size>', methods=['GET'])
+def get_wallpaper_image(image_id, size):
+    image = Image.query.get(image_id)
+    if image is None:
+        return jsonify({'error': '图片不存在', 'code': 404}), 404
+    if size not in SIZES:
+        return jsonify({'error': '尺寸不存在', 'code': 400}), 400
+
+    formats = (image.variants or {}).get(size, {})
+    fmt = pick_format(formats, request.accept_mimetypes)
+    path = local_path(formats[fmt]) if fmt is not None else None
+    if path is None:
+        response = redirect(image.url)
+    else:
+        # 按保存时记录的地址发送, 衍生图目录的命名规则变化后旧图片仍然可用
+        response = send_asset(os.path.relpath(path, STATIC_FOLDER))
+    response.vary.add('Accept')
+    return response
+
+
 
 #  排序模块
 
+SORTED_FIELDS = {
+    'id': column(Image.id),
+    'url': column(Image.url),
+    'alt': column(Image.alt),
+    'type': column(Image.type),
+    'author': column(Image.create_by),
+    'create_time': column(Image.create_time),
+    'download_count': column(Image.download_count),
+    'like_count': column(Image.like_count),
+    'favorite_count': column(Image.favorite_count),
+    'variants': column(Image.variants),
+}
+
+
+def _sorted_wallpapers(sort_column):
+    # 按 sort_column 降序, 在数据库中排序并进行游标分页
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        names = parse_fields(SORTED_FIELDS, request.args.get('fields'))
+        # 排序列和 id 用于生成下一页的游标, 总是查询
+        query = project(Image.query, SORTED_FIELDS, names, sort_column, Image.id)
+        rows, next_cursor = keyset_paginate(query, sort_column, Image.id,
+                                            after=request.args.get('after'), limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'code': 400}), 400
+
+    return jsonify({'code': 200, 'data': render(rows, SORTED_FIELDS, names), 'next_cursor': next_cursor})
+
+
 ## 根据发布时间进行排序 (最新)
 @wallpaper_bp.route('/new', methods=['GET'])
+@conditional(IMAGE_WATERMARK)
 def get_new_wallpapers():
-    # 获取所有图片
-    images = Image.query.all()
     # 按发布时间降序排序
-    sorted_images = sorted(images, key=lambda x: x.create_time, reverse=False)
-    # 构造返回的JSON数据
-    data = []
-    for image in sorted_images:
-        data.append({
-            'id': image.id,
-            'url': image.url,
-            'alt': image.alt,
-            'type': image.type,
-            'author': image.create_by,
-            'create_time': image.create_time,
-            'download_count': image.download_count,
-            'like_count': image.like_count,
-            'favorite_count': image.favorite_count
-        })
-
-    return jsonify(data)
-
+    return _sorted_wallpapers(Image.create_time)
 
 
 ## 根据点赞量排序返回
 @wallpaper_bp.route('/like', methods=['GET'])
+@conditional(IMAGE_WATERMARK)
 def get_liked_wallpapers():
-    # 获取所有图片
-    images = Image.query.all()
     # 按点赞量降序排序
-    sorted_images = sorted(images, key=lambda x: x.like_count, reverse=True)
-    # 构造返回的JSON数据
-    data = []
-    for image in sorted_images:
-        data.append({
-            'id': image.id,
-            'url': image.url,
-            'alt': image.alt,
-            'type': image.type,
-            'author': image.create_by,
-            'create_time': image.create_time,
-            'download_count': image.download_count,
-            'like_count': image.like_count,
-            'favorite_count': image.favorite_count
-        })
-
-
-    return jsonify(data)
+    return _sorted_wallpapers(Image.like_count)
 
 
 ## 根据下载量排序返回
 @wallpaper_bp.route('/download', methods=['GET'])
+@conditional(IMAGE_WATERMARK)
 def get_download_wallpapers():
-    # 获取所有图片
-    images = Image.query.all()
-    # 按点赞量降序排序
-    sorted_images = sorted(images, key=lambda x: x.download_count, reverse=True)
-    # 构造返回的JSON数据
-    data = []
-    for image in sorted_images:
-        data.append({
-            'id': image.id,
-            'url': image.url,
-            'alt': image.alt,
-            'type': image.type,
-            'author': image.create_by,
-            'create_time': image.create_time,
-            'download_count': image.download_count,
-            'like_count': image.like_count,
-            'favorite_count': image.favorite_count
-        })
-
-
-    return jsonify(data)
+    # 按下载量降序排序
+    return _sorted_wallpapers(Image.download_count)
 
 
-UPLOAD_FOLDER = 'static'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif','webp','blob'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -250,32 +326,56 @@ def upload_wallpaper():
     print(type(file))
     
     if file and allowed_file(file.filename):
-         # filename 使用时间戳命名
-        filename =  str(datetime.datetime.now().timestamp()) + secure_filename(file.filename)
-        file_path = os.path.join(UPLOAD_FOLDER, filename) # 拿到上传图片的路径
-        file.save(file_path) # 保存图片
-
-        # 获取图片的详细信息
-        with I.open(file_path) as img:
-            width, height = img.size # 获取分辨率
-            file_format = img.format
-            mode = img.mode
-
-        file_size = os.path.getsize(file_path)  # 文件大小
+        # 边写入边计算内容哈希并解析图片信息, 文件按哈希命名; 相同内容已存在时不会重复写入
+        try:
+            stored = store_upload(file.stream)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        file_path = stored.path
+        width, height = stored.width, stored.height # 获取分辨率
+        file_format = stored.format
+        mode = stored.mode
+
+        file_size = stored.size  # 文件大小
         file_type = file.mimetype  # 文件类型
         file_name = file.filename  # 文件名称
 
+        # 计算感知哈希, 提示与已有壁纸近似重复的情况; 图片损坏无法解码时跳过, 不影响上传本身
+        try:
+            phash = dhash(file_path)
+        except Exception:
+            current_app.logger.exception('计算感知哈希失败')
+            phash = None
+        near_duplicates = phash_index.near_duplicates(phash) if phash is not None else []
+
+        # 生成缩略图/预览图等衍生图, 失败时不影响上传本身
+        try:
+            variants = generate_derivatives(file_path)
+        except Exception:
+            current_app.logger.exception('生成衍生图失败')
+            variants = {}
+
         # 整合信息 进行return 返回
         data = {
-            'file_path': f'http://127.0.0.1:5000/{file_path}',
+            'file_path': public_url(file_path),
             'width': width,
             'height': height,
             'file_format': file_format,
             'mode': mode,
             'file_size': file_size,
             'file_type': file_type,
-            'file_name': file_name
+            'file_name': file_name,
+            'variants': variants,
+            'sha256': stored.sha256,
+            # 相同内容之前已经上传过
+            'duplicate': not stored.created,
+            'phash': format(phash, '016x') if phash is not None else None,
+            # 感知哈希相近的已有壁纸, 保存时会被拒绝
+            'near_duplicates': near_duplicates,
         }
+        if not stored.created:
+            existing = Image.query.filter_by(content_hash=stored.sha256).first()
+            data['image_id'] = existing.id if existing else None
         return jsonify(data)
     else:
         return jsonify({'error': 'Invalid file type'}), 400,
@@ -299,17 +399,43 @@ def save_wallpaper():
     tag_id = data.get('tag_id')
     dimensions = f"{width} x {height}"
 
+    # 上传者 id 可能以字符串传入, 统计字段和排行榜都按整数 id 记录
+    try:
+        creator = int(creator)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'create_by 无效'}), 400
+
     # 判断该图片是否已经在数据库存在. 如果存在就进行return返回
-    if Image.query.filter_by(url=url).first():
+    # 内容寻址的文件按哈希判断, 旧文件按 url 判断
+    content_hash = hash_from_url(url)
+    if content_hash:
+        exists = Image.query.filter_by(content_hash=content_hash).first()
+    else:
+        exists = Image.query.filter_by(url=url).first()
+    if exists:
         return jsonify({'error': '图片已存在'}), 400
 
+    # 近似重复检测: 与已有壁纸的感知哈希距离过近时拒绝保存, 传 force=true 可以强制保存
+    try:
+        phash = dhash(local_path(url))
+    except Exception:
+        phash = None
+    if phash is not None and not data.get('force'):
+        near_duplicates = phash_index.near_duplicates(phash)
+        if near_duplicates:
+            return jsonify({'error': '存在相似的图片', 'near_duplicates': near_duplicates}), 409
+
     # 开始事务
     try:
         # 保存图片对象到数据库
         wallpaper = Image(name=name, url=url, alt=alt, type=type, file_size=size,
-                          dimensions=dimensions, create_by=creator)
+                          dimensions=dimensions, create_by=creator, content_hash=content_hash,
+                          phash=to_signed(phash) if phash is not None else None,
+                          # 只有本服务保存的上传文件才有衍生图
+                          variants=(existing_variants(derivative_key(url)) or None) if stored_object_path(url) else None)
         db.session.add(wallpaper)
         db.session.flush()  # 刷新会话，以获取图片ID
+        User.add_stats(creator, wallpapers_count=1)
 
         # 获取刚插入的图片ID
         image_id = wallpaper.id
@@ -318,7 +444,15 @@ def save_wallpaper():
         tag = Tag.query.get(tag_id)
         if tag:
             wallpaper.tags.append(tag)
+            tag_name = tag.name
             db.session.commit()
+            # 增量更新搜索索引、感知哈希索引和排行榜
+            search_index.add(image_id, name, alt, [tag_name])
+            tag_index.add(image_id, [tag.id])
+            leaderboard.record('wallpapers', creator, 1)
+            if phash is not None:
+                phash_index.add(phash, image_id)
+            response_cache.invalidate(f'image:{image_id}')
             return jsonify({'message': '图片上传成功', 'code': 200}), 200
         else:
             db.session.rollback()  # 回滚事务
@@ -329,35 +463,42 @@ def save_wallpaper():
     finally:
         db.session.close()
 
-# 模糊查询, 查询wallpaper表name字段中包含关键词的图片
+SEARCH_FIELDS = {
+    'id': column(Image.id),
+    'name': column(Image.name),
+    'url': column(Image.url),
+    'alt': column(Image.alt),
+    'type': column(Image.type),
+    'file_size': column(Image.file_size),
+    'dimensions': column(Image.dimensions),
+    'create_by': column(Image.create_by),
+    'create_time': column(Image.create_time),
+    'variants': column(Image.variants),
+}
+
+
+# 搜索壁纸, 在名称、描述和标签中查找关键词, 按相关度和热度排序
+# 参数: keyword 关键词, page 页码 (从1开始), limit 每页数量
 @wallpaper_bp.route('/search', methods=['GET'])
 def search_images_by_keyword():
-    print(1)
     keyword = request.args.get('keyword', '')
-    print("ke",type(keyword))
-    print(2)
     if not keyword:
         return jsonify({'error': '请输入关键词'}), 400
-    images = Image.query.filter(Image.name.like(f'%{keyword}%').collate('utf8_general_ci')).all()
-    print(images)
-    if not images:
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        page = parse_limit(request.args.get('page'), default=1, maximum=10000)
+        names = parse_fields(SEARCH_FIELDS, request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    image_ids, total = search_index.search(keyword, offset=(page - 1) * limit, limit=limit)
+    if not image_ids:
         return jsonify({'error': '未找到相关图片'}), 404
-    image_list = []
-    for image in images:
-        image_list.append({
-            'id': image.id,
-            'name': image.name,
-            'url': image.url,
-            'alt': image.alt,
-            'type': image.type,
-            'file_size': image.file_size,
-            'dimensions': image.dimensions,
-            'create_by': image.create_by,
-            'create_time': image.create_time
-            })
 
+    # 按相关度顺序返回
+    image_list = render(_rows_by_ids(image_ids, SEARCH_FIELDS, names), SEARCH_FIELDS, names)
 
-    return jsonify({'images': image_list}), 200
+    return jsonify({'images': image_list, 'total': total, 'page': page}), 200
 
 
 
@@ -377,12 +518,11 @@ def get_image_relation():
             return jsonify({'error': '图片不存在'}), 404
 
         # 检查用户是否喜欢和收藏该图片
-        is_collected = image in user.collect_images
-        is_liked = image in user.favorite_images
+        relation = relation_cache.relations(user.id, [image.id])[image.id]
 
         return jsonify({
-            'is_collected': is_collected,
-            'is_liked': is_liked
+            'is_collected': relation['is_collected'],
+            'is_liked': relation['is_liked']
         }), 200
 
     except Exception as e:
@@ -390,6 +530,31 @@ def get_image_relation():
         return jsonify({'error': str(e)}), 500
 
 
+# 批量查询用户和一组图片的 喜欢/收藏 关系, 列表页一次请求取回整页的状态
+@wallpaper_bp.route('/user_image_relations', methods=['POST'])
+def get_image_relations():
+    user_id = request.json.get('user_id')
+    image_ids = request.json.get('image_ids')
+    if not isinstance(image_ids, list):
+        return jsonify({'error': 'image_ids 必须是数组', 'code': 400}), 400
+    try:
+        image_ids = list(dict.fromkeys(int(image_id) for image_id in image_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'image_ids 必须是整数数组', 'code': 400}), 400
+    if len(image_ids) > MAX_LIMIT:
+        return jsonify({'error': f'image_ids 最多 {MAX_LIMIT} 个', 'code': 400}), 400
+
+    try:
+        if User.query.get(user_id) is None:
+            return jsonify({'error': '用户不存在'}), 404
+        relations = relation_cache.relations(user_id, image_ids)
+    except SQLAlchemyError as e:
+        return jsonify({'error': str(e)}), 500
+
+    data = [dict(image_id=image_id, **relations[image_id]) for image_id in image_ids]
+    return jsonify({'code': 200, 'data': data}), 200
+
+
 @wallpaper_bp.route('/delete', methods=['POST'])
 def delete_image():
     user_id = request.json.get('user_id')
@@ -412,26 +577,28 @@ def delete_image():
         if image is None:
             return jsonify({'error': '图片不存在'}), 404
 
-        # 检查用户是否收藏或喜欢了图片
-        is_collected = image in user.collect_images
-        is_favorited = image in user.favorite_images
-
-        if is_collected:
-            user.collect_images.remove(image)
-        if is_favorited:
-            user.favorite_images.remove(image)
-
-        # 提交移除收藏和喜欢操作
-        if is_collected or is_favorited:
-            db.session.commit()
+        # 收藏/喜欢过该图片的用户, 以及上传者的统计数减一
+        User.add_stats(db.select(user_collect_images.c.user_id).where(user_collect_images.c.image_id == image.id),
+                       collects_count=-1)
+        User.add_stats(db.select(user_favorite_images.c.user_id).where(user_favorite_images.c.image_id == image.id),
+                       likes_given_count=-1)
+        User.add_stats(image.create_by, wallpapers_count=-1)
 
-        # 删除关联表中所有关于该图片的记录
+        # 删除关联表中所有关于该图片的记录 (按 image_id 索引删除, 包括当前用户的收藏和喜欢)
         db.session.execute(user_collect_images.delete().where(user_collect_images.c.image_id == image_id))
         db.session.execute(user_favorite_images.delete().where(user_favorite_images.c.image_id == image_id))
 
         # 删除图片本身
+        deleted_id = image.id
+        creator_id, create_time = image.create_by, image.create_time
         db.session.delete(image)
         db.session.commit()
+        leaderboard.record('wallpapers', creator_id, -1, create_time)
+        search_index.remove(deleted_id)
+        tag_index.remove(deleted_id)
+        phash_index.remove(deleted_id)
+        relation_cache.remove_image(deleted_id)
+        response_cache.invalidate(f'image:{deleted_id}')
 
         return jsonify({'message': '图片已删除', 'code': 200}), 200
 
@@ -8,6 +8,53 @@ password = '123456'
 DB_URL = 'mysql+pymysql://{}:{}@{}:{}/{}?charset=utf8'.format(username, password, hostname, port, database)
 
 SQLALCHEMY_DATABASE_URI = DB_URL
+
+# 删除帖子时是否默认使用软删除 (先隐藏, 再由后台线程清理评论/点赞/话题)
+POST_SOFT_DELETE = False
+
+# 计数 (下载量/喜欢数/收藏数/浏览量) 在内存中合并后写回数据库的间隔 (秒), 以及触发提前写回的待写行数
+COUNTER_FLUSH_INTERVAL = 2
+COUNTER_MAX_PENDING = 5000
+
+# 用户 喜欢/收藏 关系缓存: 进程内最多缓存的用户数, 缓存有效期 (秒);
+# 设置 RELATION_CACHE_REDIS_URL (如 'redis://127.0.0.1:6379/0', 需要安装 redis) 时多个进程共享缓存
+RELATION_CACHE_SIZE = 10000
+RELATION_CACHE_TTL = 60
+RELATION_CACHE_REDIS_URL = None
+
+# 关注流: 粉丝数超过该值的作者发帖不写入粉丝收件箱, 读取时合并; 每个收件箱保留的最大条数
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_INBOX_SIZE = 800
+
+# 创作者排行榜 近7天/近30天 榜单从数据库重新加载的间隔 (秒), 两次加载之间按写入增量更新
+LEADERBOARD_REBUILD_INTERVAL = 600
+
+# 话题字典缓存的有效期 (秒), 本进程内的修改会立即生效
+TOPIC_CACHE_TTL = 30
+
+# 壁纸搜索索引从数据库重建的间隔 (秒), 同步其他进程的上传/删除和最新的热度值
+SEARCH_INDEX_TTL = 300
+# 感知哈希 (近似重复检测) 索引从数据库重建的间隔 (秒)
+PHASH_INDEX_TTL = 300
+# 按标签筛选用的位图索引从数据库重建的间隔 (秒)
+TAG_INDEX_TTL = 60
+
+# 公共读接口的响应缓存: 进程内最多缓存的响应数, 有效期 (秒);
+# 设置 RESPONSE_CACHE_REDIS_URL (需要安装 redis) 时多个进程共享缓存和失效标记
+RESPONSE_CACHE_SIZE = 2000
+RESPONSE_CACHE_TTL = 60
+# 过期之后的这段时间 (秒) 内先返回旧值, 同时在后台刷新
+RESPONSE_CACHE_STALE_TTL = 30
+# 标签版本号在进程内缓存的时间 (秒), 其他进程的修改最多延迟这么久生效
+RESPONSE_CACHE_VERSION_TTL = 1
+RESPONSE_CACHE_REDIS_URL = None
+
+# 静态文件对外访问的地址前缀, 生成图片/头像/二维码的 url 时使用
+STATIC_BASE_URL = 'http://127.0.0.1:5000'
+# 前面有 nginx 时, 设置为 internal location 的前缀 (如 '/_static'), 文件由 nginx 通过 X-Accel-Redirect 发送
+ASSET_ACCEL_REDIRECT = None
+# 前面是 Apache / lighttpd 时可以开启, 由 Flask 返回 X-Sendfile 头
+USE_X_SENDFILE = False
  
 """ import secrets
 
@@ -1,9 +1,18 @@
+import threading
 from datetime import datetime
 
+from flask import current_app
 from sqlalchemy import JSON
 from sqlalchemy.orm import joinedload
 
 from extensions import db
+from utils import timeline
+from utils.counters import counters
+from utils.leaderboard import leaderboard
+from utils.loaders import get_user, load_users
+from utils.pagination import DEFAULT_LIMIT, decode_cursor, encode_cursor, keyset_paginate
+from utils.response_cache import response_cache
+from utils.topic_cache import topic_cache
 
 # 中间表，用于壁纸和标签的多对多关系
 image_tags = db.Table('image_tags',
@@ -12,21 +21,31 @@ image_tags = db.Table('image_tags',
 )
 
 # 中间表, 用于用户和喜欢的作品的多对多关系
+# 主键 (user_id, image_id) 用于判断某个用户是否喜欢了某张图片, image_id 索引用于删除图片时清理
+# created_at 用于统计一段时间内作者获得的喜欢数 (utils/leaderboard.py)
 user_favorite_images = db.Table('user_favorite_images',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('image_id', db.Integer, db.ForeignKey('image.id'), primary_key=True)
+    db.Column('image_id', db.Integer, db.ForeignKey('image.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False),
+    db.Index('ix_user_favorite_images_image_id', 'image_id'),
+    db.Index('ix_user_favorite_images_created_at', 'created_at')
 )
 
 # 中间表, 用于用户和收藏的作品的多对多关系
 user_collect_images = db.Table('user_collect_images',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('image_id', db.Integer, db.ForeignKey('image.id'), primary_key=True)
+    db.Column('image_id', db.Integer, db.ForeignKey('image.id'), primary_key=True),
+    db.Index('ix_user_collect_images_image_id', 'image_id')
 )
 
 # 中间表，用于用户和关注的用户的多对多关系
+# 两个联合索引分别用于 关注列表 和 粉丝列表 按关注时间的游标分页 (utils/follow_graph.py)
 user_followers = db.Table('user_followers',
     db.Column('follower_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    db.Column('followed_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
+    db.Column('created_at', db.DateTime, default=datetime.utcnow, server_default=db.func.now(), nullable=False),
+    db.Index('ix_user_followers_follower_id_created_at', 'follower_id', 'created_at', 'followed_id'),
+    db.Index('ix_user_followers_followed_id_created_at', 'followed_id', 'created_at', 'follower_id')
 )
 
 
@@ -36,6 +55,10 @@ class Image(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(255), nullable=False)
     url = db.Column(db.String(255), nullable=False)
+    # 文件内容的 SHA-256, 用于上传去重; 内容寻址之前上传的旧图片为空
+    content_hash = db.Column(db.String(64), nullable=True, unique=True)
+    # 感知哈希 (64 位 dHash, 按有符号整数存储), 用于发现缩放/重新压缩后的近似重复图片
+    phash = db.Column(db.BigInteger, nullable=True)
     alt = db.Column(db.String(255))
     type = db.Column(db.String(50), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)  # 将 size 拆分为 file_size 和 dimensions
@@ -46,14 +69,60 @@ class Image(db.Model):
     download_count = db.Column(db.Integer, default=0, nullable=True)
     like_count = db.Column(db.Integer, default=0, nullable=True)
     favorite_count = db.Column(db.Integer, default=0, nullable=True)
+    # 热度值 = 下载量*3 + 喜欢数*2 + 收藏数*1, 计数变化时同步维护, 热门榜直接按它取前K条
+    heat_score = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    # 衍生图地址 {尺寸: {格式: url}}, 尺寸为 thumb/preview/full, 格式为 webp/avif
+    variants = db.Column(JSON, nullable=True)
     # 壁纸的状态 审核中 or 审核通过, 默认审核中
     status = db.Column(db.String(50), default='审核中', nullable=True)
     # 0 false 1 ture
 
     # 关系字段，用于获取图片的标签
-    tags = db.relationship('Tag', secondary=image_tags, lazy='subquery',
+    # 按需加载, 列表接口需要标签时通过 utils/fields.py 批量查询
+    tags = db.relationship('Tag', secondary=image_tags, lazy='select',
         backref=db.backref('images', lazy=True))
 
+    # 联合索引, 用于 最新/点赞/下载 排序列表的游标分页
+    __table_args__ = (
+        db.Index('ix_image_create_time_id', 'create_time', 'id'),
+        db.Index('ix_image_like_count_id', 'like_count', 'id'),
+        db.Index('ix_image_download_count_id', 'download_count', 'id'),
+        db.Index('ix_image_heat_score_id', 'heat_score', 'id'),
+        # 条件请求的水位 max(update_time)
+        db.Index('ix_image_update_time', 'update_time'),
+    )
+
+    # 各计数在热度值中的权重
+    HEAT_WEIGHTS = {'download_count': 3, 'like_count': 2, 'favorite_count': 1}
+    # 计数写回 (utils/counters.py) 时同步更新的派生列
+    DERIVED_COUNTERS = {'heat_score': HEAT_WEIGHTS}
+    # 这些状态的壁纸不出现在筛选结果中
+    HIDDEN_STATUSES = ('下架',)
+
+    # 对外可见的壁纸 (未下架)
+    @classmethod
+    def visible(cls):
+        return cls.query.filter(db.or_(cls.status.is_(None), cls.status.not_in(cls.HIDDEN_STATUSES)))
+
+    # 热度值的 SQL 表达式
+    @classmethod
+    def heat_expr(cls):
+        return sum(db.func.coalesce(getattr(cls, column), 0) * weight
+                   for column, weight in cls.HEAT_WEIGHTS.items())
+
+    # 根据计数重新计算所有图片的热度值, 用于崩溃或手动改库后的恢复
+    @classmethod
+    def rebuild_heat(cls):
+        updated = cls.query.update({cls.heat_score: cls.heat_expr()}, synchronize_session=False)
+        db.session.commit()
+        return updated
+
+    # 热门榜: 直接走 (heat_score, id) 索引取前 limit 条; 传入 columns 时只查询这些列, 返回 Row
+    @classmethod
+    def getHot(cls, limit, columns=None):
+        query = cls.query.with_entities(*columns) if columns else cls.query
+        return query.order_by(cls.heat_score.desc(), cls.id.desc()).limit(limit).all()
+
 
 
 class Tag(db.Model):
@@ -76,6 +145,8 @@ class User(db.Model):
     province = db.Column(db.String(100), nullable=True,default='广东')
     city = db.Column(db.String(100), nullable=True,default='广州')
     create_time = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # 任意字段修改时更新 (包括统计字段的原子加减), 用作条件请求的水位
+    update_time = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
     last_login_time = db.Column(db.DateTime, nullable=True)
     role = db.Column(db.Enum('user', 'admin'), default='user', nullable=True)
     status = db.Column(db.Enum('active', 'inactive', 'banned'), default='active', nullable=True)
@@ -85,6 +156,19 @@ class User(db.Model):
     like_count = db.Column(db.Integer, default=0, nullable=True)
     favorite_count = db.Column(db.Integer, default=0, nullable=True)
     follow_count = db.Column(db.Integer, default=0, nullable=True)
+    # 统计数据, 在发帖/上传/喜欢/收藏的同一个事务中原子加减, 登录和个人中心直接读取
+    posts_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    wallpapers_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    likes_given_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    collects_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    # 排行榜总榜按统计字段取前K名
+    __table_args__ = (
+        db.Index('ix_user_posts_count', 'posts_count'),
+        db.Index('ix_user_wallpapers_count', 'wallpapers_count'),
+        db.Index('ix_user_like_count', 'like_count'),
+        db.Index('ix_user_update_time', 'update_time'),
+    )
 
     # 2024/5/24 add 字段, 个人中心页面的上方背景
     person_home_background_image = db.Column(db.String(255), nullable=True)
@@ -117,6 +201,59 @@ class User(db.Model):
             db.session.add(new_user)
             db.session.commit()
             return new_user
+
+    # 统计字段和对应的计数查询, 用于 reconcile_stats
+    @classmethod
+    def stats_queries(cls):
+        return {
+            'posts_count': db.select(db.func.count()).select_from(Post)
+                .where(Post.user_id == cls.id, Post.deleted_at.is_(None)),
+            'wallpapers_count': db.select(db.func.count()).select_from(Image)
+                .where(Image.create_by == cls.id),
+            'likes_given_count': db.select(db.func.count()).select_from(user_favorite_images)
+                .where(user_favorite_images.c.user_id == cls.id),
+            'collects_count': db.select(db.func.count()).select_from(user_collect_images)
+                .where(user_collect_images.c.user_id == cls.id),
+        }
+
+    # 原子加减用户的统计字段, 例如 add_stats(user_id, posts_count=1); 不提交, 与业务写入在同一个事务中
+    # user_ids 可以是单个 id, 也可以是 id 列表或子查询
+    @classmethod
+    def add_stats(cls, user_ids, **deltas):
+        condition = cls.id.in_(user_ids) if not isinstance(user_ids, int) else cls.id == user_ids
+        db.session.execute(
+            db.update(cls).where(condition)
+            .values({getattr(cls, column): getattr(cls, column) + delta for column, delta in deltas.items()})
+            .execution_options(synchronize_session=False)
+        )
+
+    # 按实际数据重新计算统计字段, 按 id 分批提交, 用于修复偏差: flask reconcile-user-stats
+    @classmethod
+    def reconcile_stats(cls, batch_size=1000):
+        values = {getattr(cls, column): query.scalar_subquery() for column, query in cls.stats_queries().items()}
+        total = 0
+        last_id = 0
+        while True:
+            ids = db.session.scalars(db.select(cls.id).where(cls.id > last_id)
+                                     .order_by(cls.id).limit(batch_size)).all()
+            if not ids:
+                return total
+            db.session.execute(db.update(cls).where(cls.id.in_(ids)).values(values)
+                               .execution_options(synchronize_session=False))
+            db.session.commit()
+            total += len(ids)
+            last_id = ids[-1]
+
+    # 切换用户和图片的 喜欢/收藏 关系, 返回切换后是否存在, 调用方负责提交
+    @staticmethod
+    def toggle_image(table, user_id, image_id):
+        deleted = db.session.execute(
+            table.delete().where(table.c.user_id == user_id, table.c.image_id == image_id)
+        ).rowcount
+        if deleted:
+            return False
+        db.session.execute(table.insert().values(user_id=user_id, image_id=image_id))
+        return True
         
     
 
@@ -133,66 +270,173 @@ class Post(db.Model):
     images = db.Column(db.Text)
     views = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, index=True)
+    # 软删除时间, 不为空表示帖子已删除, 等待后台清理
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
     user = db.relationship('User', backref=db.backref('posts', lazy='dynamic'))
+
+    # 帖子流按 (created_at, id) 游标分页; 关注流合并大V的帖子时按作者取
+    __table_args__ = (
+        db.Index('ix_post_created_at_id', 'created_at', 'id'),
+        db.Index('ix_post_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
+    # 浏览量每次打开帖子都会变化, 写回时不让帖子列表的响应缓存失效 (缓存有效期内显示旧的浏览量)
+    UNCACHED_COUNTERS = ('views',)
     
     @classmethod
     def create(cls, user_id, content, images, created_at):
         new_post = cls(user_id=user_id, content=content, images=images, created_at=created_at)
         db.session.add(new_post)
+        User.add_stats(int(user_id), posts_count=1)
         db.session.commit()
+        leaderboard.record('posts', user_id, 1, created_at)
+        response_cache.invalidate(f'post:{new_post.id}')
+        # 写入粉丝的关注流
+        timeline.publish(new_post)
         return new_post
     
   
     
+    # 删除帖子
+    # soft=True 时只标记 deleted_at, 帖子立即从列表中隐藏, 评论/点赞/话题等在后台线程中清理
     @classmethod
-    def delete(cls, post_id):
-        # 删除帖子的评论
-        Post_Comment.delete_comments(post_id)
+    def delete(cls, post_id, soft=False):
+        # 只有未删除的帖子计入发帖数, 软删除时就减掉, 后台清理时不再重复减
+        user_id, created_at = (db.session.query(cls.user_id, cls.created_at)
+                               .filter(cls.id == post_id, cls.deleted_at.is_(None)).first() or (None, None))
+        if soft:
+            cls.query.filter(cls.id == post_id, cls.deleted_at.is_(None)).update(
+                {cls.deleted_at: datetime.utcnow()}, synchronize_session=False)
+            if user_id is not None:
+                User.add_stats(user_id, posts_count=-1)
+            db.session.commit()
+            if user_id is not None:
+                leaderboard.record('posts', user_id, -1, created_at)
+            response_cache.invalidate(f'post:{post_id}')
+            app = current_app._get_current_object()
+            threading.Thread(target=cls._purge_in_background, args=(app, [post_id]), daemon=True).start()
+            return True
 
+        try:
+            cls._purge([post_id])
+            if user_id is not None:
+                User.add_stats(user_id, posts_count=-1)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        topic_cache.invalidate()
+        response_cache.invalidate(f'post:{post_id}')
+        if user_id is not None:
+            leaderboard.record('posts', user_id, -1, created_at)
+        return True
+
+    # 在同一个事务中按 post_id 批量删除帖子及其评论、点赞、话题绑定, 不提交
+    @classmethod
+    def _purge(cls, post_ids):
+        # 删除帖子的评论
+        Post_Comment.delete_comments(post_ids)
         # 删除帖子的点赞
-        Post_like.query.filter_by(post_id=post_id).delete()
-        # 删除帖子绑定的话题,如果存在的话
-        Post_Topic.query.filter_by(post_id=post_id).delete()
+        Post_like.query.filter(Post_like.post_id.in_(post_ids)).delete(synchronize_session=False)
+        # 删除帖子绑定的话题,如果存在的话, 并减少对应话题的帖子数
+        Post_Topic.unbind_posts(post_ids)
+        # 删除关注流中的帖子
+        Timeline_Entry.query.filter(Timeline_Entry.post_id.in_(post_ids)).delete(synchronize_session=False)
         # 删除帖子
-        db.session.delete(cls.query.get_or_404(post_id))
-        db.session.commit()
-        return True
-    
+        cls.query.filter(cls.id.in_(post_ids)).delete(synchronize_session=False)
+
+    @classmethod
+    def _purge_in_background(cls, app, post_ids):
+        with app.app_context():
+            cls.purge_deleted(post_ids)
+
+    # 清理已软删除的帖子, 后台线程异常退出时可以通过 flask purge-posts 补做
+    @classmethod
+    def purge_deleted(cls, post_ids=None, batch_size=500):
+        purged = 0
+        while True:
+            query = db.session.query(cls.id).filter(cls.deleted_at.isnot(None))
+            if post_ids is not None:
+                query = query.filter(cls.id.in_(post_ids))
+            ids = [row.id for row in query.limit(batch_size).all()]
+            if not ids:
+                return purged
+            try:
+                cls._purge(ids)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            topic_cache.invalidate()
+            purged += len(ids)
+
+    # 分页构建帖子流: 一页帖子的点赞、评论、话题和用户都用固定次数的批量查询取回
     @classmethod
-    def getAll(cls):
-        # 使用 joinedload 来预加载用户信息
-        posts = (
-            cls.query
-            .options(joinedload(cls.user)) 
-            .order_by(cls.created_at.desc())
+    def buildFeed(cls, query, after=None, limit=DEFAULT_LIMIT):
+        posts, next_cursor = keyset_paginate(query, cls.created_at, cls.id, after=after, limit=limit)
+        return cls.serializeFeed(posts), next_cursor
+
+    # 把一页帖子转换为帖子流的数据, 保持传入的顺序
+    @classmethod
+    def serializeFeed(cls, posts):
+        post_ids = [post.id for post in posts]
+        if not post_ids:
+            return []
+
+        likes = Post_like.query.filter(Post_like.post_id.in_(post_ids)).order_by(Post_like.id).all()
+        comments = Post_Comment.query.filter(Post_Comment.post_id.in_(post_ids)).order_by(Post_Comment.id).all()
+        topics = (
+            db.session.query(Post_Topic.post_id, Post_Topic.topic_id, Topic.name)
+            .join(Topic, Topic.id == Post_Topic.topic_id)
+            .filter(Post_Topic.post_id.in_(post_ids))
             .all()
         )
 
-        # 获取每个帖子的点赞数量和评论数据
-        post_likes = {post.id: [like.to_dict() for like in db.session.query(Post_like).filter_by(post_id=post.id).all()] for post in posts}
-        post_comments = {post.id: [comment.to_dict() for comment in db.session.query(Post_Comment).filter_by(post_id=post.id).all()] for post in posts}
-        
-        # 获取每个帖子的bind的话题
-        post_topics = {post.id: [topic.to_dict() for topic in db.session.query(Post_Topic).filter_by(post_id=post.id).all()] for post in posts}
+        # 帖子作者、点赞用户、评论用户一次性加载
+        load_users([post.user_id for post in posts]
+                   + [like.user_id for like in likes]
+                   + [comment.user_id for comment in comments])
+
+        post_likes = {}
+        for like in likes:
+            post_likes.setdefault(like.post_id, []).append(like.to_dict())
+        post_comments = {}
+        for comment in comments:
+            post_comments.setdefault(comment.post_id, []).append(comment)
+        post_topics = {}
+        for post_id, topic_id, topic_name in topics:
+            post_topics.setdefault(post_id, []).append(
+                {'post_id': post_id, 'topic_id': topic_id, 'topic_name': topic_name})
+
         return [
-            post.to_dict_with_user_and_likes(post_likes.get(post.id, []), post_comments.get(post.id, []), post_topics.get(post.id, {})) for post in posts
+            post.to_dict_with_user_and_likes(post_likes.get(post.id, []),
+                                             Post_Comment.serialize(post_comments.get(post.id, [])),
+                                             post_topics.get(post.id, []))
+            for post in posts
         ]
 
+    # 未被删除的帖子
+    @classmethod
+    def visible(cls):
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def getAll(cls, after=None, limit=DEFAULT_LIMIT):
+        return cls.buildFeed(cls.visible(), after=after, limit=limit)
+
     @classmethod
     # 增加帖子浏览量
     def add_view(cls, post_id):
-        post = cls.query.get_or_404(post_id)
-        post.views += 1
-        db.session.commit()
-        return post
+        # 浏览量先在内存中累加, 由后台线程批量写回
+        counters.incr(cls, post_id, 'views')
      
     # 方法：将模型转换为字典，包含用户信息和点赞数据和评论
     def to_dict_with_user_and_likes(self, likes, comments, topics):
-        # 从likes获取所有点赞的用户信息
+        # 从likes获取所有点赞的用户信息, 一次性批量加载
+        like_users = load_users(like['user_id'] for like in likes)
         likes_with_user = []
         for like in likes:
-            user = User.query.get(like['user_id'])
+            user = like_users.get(like['user_id'])
             if user:
                 likes_with_user.append({
                     'id': like['id'],
@@ -207,8 +451,7 @@ class Post(db.Model):
                     }
                 })
         
-        # 话题
-        
+        user = get_user(self.user_id)
 
         return {
             'id': self.id,
@@ -216,11 +459,11 @@ class Post(db.Model):
             'content': self.content,
             'images': self.images,
             'user': {
-                'id': self.user.id,
-                'username': self.user.username,
-                'description':self.user.description,
-                'image':self.user.image,
-                'email': self.user.email
+                'id': user.id,
+                'username': user.username,
+                'description':user.description,
+                'image':user.image,
+                'email': user.email
                 # 其他用户信息
             },
             'likes': likes_with_user,
@@ -236,7 +479,7 @@ class Post_like(db.Model):
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Add a to_dict method
@@ -254,13 +497,16 @@ class Post_like(db.Model):
         new_favor = cls(user_id=user_id, post_id=post_id)
         db.session.add(new_favor)
         db.session.commit()
+        response_cache.invalidate(f'post:{post_id}')
         return new_favor
     
     @classmethod
     def delete(cls, like_id):
         favor = cls.query.get_or_404(like_id)
+        post_id = favor.post_id
         db.session.delete(favor)
         db.session.commit()
+        response_cache.invalidate(f'post:{post_id}')
         return True
 
 
@@ -270,7 +516,7 @@ class Post_Comment(db.Model):
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False, index=True)
     content = db.Column(db.Text, nullable=False)
     parent_id = db.Column(db.Integer, db.ForeignKey('post_comment.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
@@ -283,7 +529,10 @@ class Post_Comment(db.Model):
     parent_comment = db.relationship('Post_Comment', remote_side=[id], backref=db.backref('replies', lazy='dynamic'))
 
     
-    def to_dict(self):
+    def to_dict(self, children=None):
+        # children: {parent_id: [子评论]}, 传入时在内存中构建回复树, 不再逐层查询 replies
+        user = get_user(self.user_id)
+        replies = children.get(self.id, []) if children is not None else self.replies
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -292,12 +541,21 @@ class Post_Comment(db.Model):
             'parent_id': self.parent_id,
             'created_at': self.created_at.isoformat(),
             'user': {
-                'id': self.user.id,
-                'username': self.user.username,
-                'image': self.user.image
+                'id': user.id,
+                'username': user.username,
+                'image': user.image
             },
-            'replies': [reply.to_dict() for reply in self.replies]
+            'replies': [reply.to_dict(children) for reply in replies]
         }
+
+    # 将同一批评论序列化, 每条评论带上其下的回复树
+    @staticmethod
+    def serialize(comments):
+        children = {}
+        for comment in comments:
+            if comment.parent_id is not None:
+                children.setdefault(comment.parent_id, []).append(comment)
+        return [comment.to_dict(children) for comment in comments]
         
     @classmethod
     def create(cls, user_id, post_id, content, parent_id):
@@ -305,6 +563,7 @@ class Post_Comment(db.Model):
             data = cls(user_id=user_id, post_id=post_id, content=content, parent_id=parent_id)
             db.session.add(data)
             db.session.commit()
+            response_cache.invalidate(f'post:{post_id}')
             return data
         except Exception as e:
             db.session.rollback()
@@ -314,40 +573,110 @@ class Post_Comment(db.Model):
     @classmethod
 
     def delete(cls, comment_id):
-        comment = cls.query.get_or_404(comment_id)
-        
-        # 递归删除所有子评论
-        def recursive_delete(cmt):
-            for reply in cmt.replies:
-                recursive_delete(reply)
-            db.session.delete(cmt)
-        
-        recursive_delete(comment)
-        db.session.commit()
+        post_id = cls.query.get_or_404(comment_id).post_id
+
+        # 用递归 CTE 一次取出这条评论及其下所有子评论的 id
+        tree = db.select(cls.id).where(cls.id == comment_id).cte('comment_tree', recursive=True)
+        tree = tree.union_all(db.select(cls.id).where(cls.parent_id == tree.c.id))
+        comment_ids = db.session.execute(db.select(tree.c.id)).scalars().all()
+
+        try:
+            cls._delete_where(cls.id.in_(comment_ids))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        response_cache.invalidate(f'post:{post_id}')
         return True
 
+    # 批量删除指定帖子下的所有评论, 不提交
     @classmethod
-    def delete_comments(cls, post_id):
-        comments = Post_Comment.query.filter_by(post_id=post_id).all()
-        for comment in comments:
-            if comment.replies:
-                cls.delete_comments(comment.id)
-            db.session.delete(comment)
-        db.session.commit()
-        
-        
-    # get comments of 指定的post
-    @classmethod 
-    def getComments(cls, post_id):
+    def delete_comments(cls, post_ids):
+        cls._delete_where(cls.post_id.in_(post_ids))
+
+    # 先断开父子引用再整体删除, 避免自引用外键按行检查时失败
+    @classmethod
+    def _delete_where(cls, condition):
+        cls.query.filter(condition).update({cls.parent_id: None}, synchronize_session=False)
+        cls.query.filter(condition).delete(synchronize_session=False)
+
+    # 获取帖子的评论树
+    # 帖子的所有评论只用一次查询取回, 在内存中构建树:
+    # 顶层评论按时间倒序分页, 回复按时间正序, 每个节点最多展示 reply_limit 条回复,
+    # 超过 max_depth 层或未展示完的回复通过 replies_cursor 调用"加载更多回复"继续获取
+    @classmethod
+    def getCommentTree(cls, post_id, parent_id=None, after=None, limit=DEFAULT_LIMIT,
+                       max_depth=3, reply_limit=3):
         comments = cls.query.filter_by(post_id=post_id).all()
-        # 根据 parent_id  获取 子评论
+        children = {}
         for comment in comments:
-            comment.replies = cls.query.filter_by(parent_id=comment.id).all()
-        
-        return comments
- 
-      
-            
+            children.setdefault(comment.parent_id, []).append(comment)
+        for replies in children.values():
+            replies.sort(key=cls._tree_key)
+
+        if parent_id is None:
+            # 顶层评论: 最新的在前
+            page, next_cursor = cls._slice(children.get(None, [])[::-1], after, limit, newest_first=True)
+        else:
+            page, next_cursor = cls._slice(children.get(parent_id, []), after, limit)
+
+        # 先确定要展示的评论, 再一次性加载这些评论的用户
+        visible = []
+        def collect(nodes, depth):
+            for node in nodes:
+                visible.append(node)
+                if depth < max_depth:
+                    collect(children.get(node.id, [])[:reply_limit], depth + 1)
+        collect(page, 1)
+        load_users(comment.user_id for comment in visible)
+
+        return [comment._to_tree_dict(children, 1, max_depth, reply_limit) for comment in page], next_cursor
+
+    @staticmethod
+    def _tree_key(comment):
+        return (comment.created_at or datetime.min, comment.id)
+
+    # 在排好序的评论列表中, 从游标之后取 limit 条
+    @classmethod
+    def _slice(cls, nodes, after, limit, newest_first=False):
+        if after:
+            value, comment_id = decode_cursor(after)
+            position = (value, comment_id)
+            if newest_first:
+                nodes = [node for node in nodes if cls._tree_key(node) < position]
+            else:
+                nodes = [node for node in nodes if cls._tree_key(node) > position]
+        page = nodes[:limit]
+        next_cursor = None
+        if len(nodes) > limit:
+            last = page[-1]
+            next_cursor = encode_cursor(*cls._tree_key(last))
+        return page, next_cursor
+
+    def _to_tree_dict(self, children, depth, max_depth, reply_limit):
+        user = get_user(self.user_id)
+        replies = children.get(self.id, [])
+        shown = replies[:reply_limit] if depth < max_depth else []
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'post_id': self.post_id,
+            'content': self.content,
+            'parent_id': self.parent_id,
+            'created_at': self.created_at.isoformat(),
+            'user': {
+                'id': user.id,
+                'username': user.username,
+                'image': user.image
+            },
+            'reply_count': len(replies),
+            'replies': [reply._to_tree_dict(children, depth + 1, max_depth, reply_limit) for reply in shown],
+            # 还有未展示的回复时, 用 replies_cursor 调用 /post/comment/<post_id>/replies/<comment_id> 继续加载
+            'has_more_replies': len(replies) > len(shown),
+            'replies_cursor': encode_cursor(*self._tree_key(shown[-1])) if shown else None,
+        }
+
+
 # 话题表
 class Topic(db.Model):
     __tablename__ = 'topic'
@@ -356,6 +685,8 @@ class Topic(db.Model):
     name = db.Column(db.String(100), nullable=False)  
     description = db.Column(db.Text, nullable=True)
     view_count = db.Column(db.Integer, default=0)
+    # 话题下的帖子数, 绑定话题和删除帖子时原子加减
+    post_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     
@@ -364,7 +695,8 @@ class Topic(db.Model):
             'id': self.id,
             'name': self.name,
             'description': self.description,
-            'view_count': self.view_count
+            'view_count': self.view_count,
+            'post_count': self.post_count
         }
     @classmethod
     def getAll(cls):    
@@ -375,7 +707,20 @@ class Topic(db.Model):
         new_topic = cls(name=name, description=description)
         db.session.add(new_topic)
         db.session.commit()
+        topic_cache.invalidate()
         return new_topic
+
+    # 按 post_topic 重新计算所有话题的帖子数: flask reconcile-topics
+    @classmethod
+    def reconcile_post_counts(cls):
+        counts = dict(db.session.query(Post_Topic.topic_id, db.func.count())
+                      .group_by(Post_Topic.topic_id).all())
+        updates = [{'id': topic_id, 'post_count': counts.get(topic_id, 0)}
+                   for topic_id, in db.session.query(cls.id)]
+        db.session.bulk_update_mappings(cls, updates)
+        db.session.commit()
+        topic_cache.invalidate()
+        return len(updates)
     
     @classmethod
     def getByName(cls, name):
@@ -389,18 +734,39 @@ class Topic(db.Model):
     
 
 
+# 关注流收件箱, 作者发帖时写入每个粉丝的收件箱 (utils/timeline.py)
+class Timeline_Entry(db.Model):
+    __tablename__ = 'timeline_entry'
+
+    # 收件箱的主人
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True, nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # 帖子的发布时间, 与 Post.created_at 相同
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    # 按 (created_at, post_id) 游标分页读取某个用户的收件箱
+    __table_args__ = (
+        db.Index('ix_timeline_entry_user_id_created_at_post_id', 'user_id', 'created_at', 'post_id'),
+    )
+
+
 # 话题中间表, 帖子 和 话题 post_id 和 topic_id
 class Post_Topic(db.Model):
     __tablename__ = 'post_topic'
     
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True, nullable=False)
     topic_id = db.Column(db.Integer, db.ForeignKey('topic.id'), primary_key=True, nullable=False)
+
+    # 按话题查帖子时使用
+    __table_args__ = (
+        db.Index('ix_post_topic_topic_id_post_id', 'topic_id', 'post_id'),
+    )
     
-    # 定义一个方法,根据topic_id 从 topic table 拿到name
+    # 定义一个方法,根据topic_id 从缓存的话题字典拿到name
     @property
     def topic_name(self):
-        topic = Topic.query.get(self.topic_id)
-        return topic.name
+        return topic_cache.name(self.topic_id)
 
     def to_dict(self):
         return {
@@ -413,35 +779,42 @@ class Post_Topic(db.Model):
     def create(cls, post_id, topic_id):
         new_topic = cls(post_id=post_id, topic_id=topic_id)
         db.session.add(new_topic)
+        Topic.query.filter_by(id=topic_id).update({Topic.post_count: Topic.post_count + 1},
+                                                  synchronize_session=False)
         db.session.commit()
+        topic_cache.invalidate()
+        response_cache.invalidate(f'post:{post_id}')
         return new_topic
     
     # 获取指定话题下的帖子数量
     @classmethod
     def getTopicPostsCount(cls, topic_id):
-        return cls.query.filter_by(topic_id=topic_id).count()
+        topic = topic_cache.get(topic_id)
+        return topic['joins'] if topic else 0
+
+    # 删除帖子时解除话题绑定, 在同一个事务中减少话题的帖子数, 不提交
+    @classmethod
+    def unbind_posts(cls, post_ids):
+        counts = (db.session.query(cls.topic_id, db.func.count())
+                  .filter(cls.post_id.in_(post_ids))
+                  .group_by(cls.topic_id)
+                  .all())
+        if not counts:
+            return
+        table = Topic.__table__
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('_id'))
+            .values(post_count=table.c.post_count - db.bindparam('_count')),
+            [{'_id': topic_id, '_count': count} for topic_id, count in counts]
+        )
+        cls.query.filter(cls.post_id.in_(post_ids)).delete(synchronize_session=False)
     
-    # 获取指定话题下的所有帖子
+    # 获取指定话题下的帖子 (分页)
     @classmethod
-    def getTopicPosts(cls, topic_id):
-        # 查询指定话题下的所有帖子
-        posts = (
-            db.session.query(Post)
-            .join(cls)
+    def getTopicPosts(cls, topic_id, after=None, limit=DEFAULT_LIMIT):
+        query = (
+            Post.visible()
+            .join(cls, cls.post_id == Post.id)
             .filter(cls.topic_id == topic_id)
-            .options(joinedload(Post.user))  # 预加载用户信息
-            .order_by(Post.created_at.desc())
-            .all()
-        )     
-         # 获取每个帖子的点赞数量和评论数据
-        post_likes = {post.id: [like.to_dict() for like in db.session.query(Post_like).filter_by(post_id=post.id).all()] for post in posts}
-        post_comments = {post.id: [comment.to_dict() for comment in db.session.query(Post_Comment).filter_by(post_id=post.id).all()] for post in posts}
-        
-        # 获取每个帖子的bind的话题
-        post_topics = {post.id: [topic.to_dict() for topic in db.session.query(Post_Topic).filter_by(post_id=post.id).all()] for post in posts}
-        
-        return [
-            post.to_dict_with_user_and_likes(post_likes.get(post.id, []), post_comments.get(post.id, []), post_topics.get(post.id, {})) for post in posts
-        ]
-        
-        
+        )
+        return Post.buildFeed(query, after=after, limit=limit)
@@ -0,0 +1,85 @@
+# conftest.py
+# 测试使用临时的 SQLite 数据库, 每个测试前重建所有表, 并清空各个进程内缓存/索引的状态
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('JWT_SECRET_KEY', 'test-secret-key-' + '0' * 32)
+
+import config  # noqa: E402
+
+config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+# 计数只在测试中显式调用 counters.flush() 时写回
+config.COUNTER_FLUSH_INTERVAL = 3600
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+
+    app.config['TESTING'] = True
+    return app
+
+
+def _reset_singletons(app):
+    from utils.counters import counters
+    from utils.leaderboard import leaderboard
+    from utils.relation_cache import relation_cache
+    from utils.response_cache import response_cache
+    from utils.search_index import search_index
+    from utils.tag_index import tag_index
+
+    counters._take_pending()
+    for singleton in (leaderboard, search_index, tag_index):
+        singleton.__init__()
+        singleton.init_app(app)
+    relation_cache.init_app(app)
+    response_cache.init_app(app)
+
+
+@pytest.fixture()
+def db(app):
+    from extensions import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        _reset_singletons(app)
+        yield db
+        db.session.remove()
+
+
+@pytest.fixture()
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture()
+def make_user(db):
+    from werkzeug.security import generate_password_hash
+    from model.index import User
+
+    def make_user(name):
+        user = User(username=name, password=generate_password_hash('password'), email=f'{name}@example.com')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture()
+def make_image(db):
+    from model.index import Image
+
+    def make_image(user, name, **fields):
+        values = dict(name=name, url=f'http://127.0.0.1:5000/{name}.jpg', type='jpg', file_size=1,
+                      dimensions='1x1', create_by=user.id, status='审核通过')
+        values.update(fields)
+        image = Image(**values)
+        db.session.add(image)
+        db.session.commit()
+        return image
+    return make_image
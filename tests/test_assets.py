@@ -0,0 +1,61 @@
+import pytest
+
+from utils import assets
+
+DIGEST = 'ab' * 32
+
+
+@pytest.fixture()
+def static(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, 'STATIC_FOLDER', str(tmp_path))
+
+    def write(filename, data=b'data'):
+        path = tmp_path / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        return filename
+    return write
+
+
+@pytest.mark.parametrize('filename', [
+    f'objects/ab/ab/{DIGEST}.jpg',
+    f'derivatives/ab/{DIGEST}/thumb.webp',
+])
+def test_content_addressed_files_are_immutable(client, static, filename):
+    static(filename)
+    response = client.get('/static/' + filename)
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == assets.IMMUTABLE_MAX_AGE
+    assert DIGEST in response.headers['ETag']
+
+
+@pytest.mark.parametrize('filename', [
+    'derivatives/1_/1_jpg/thumb.webp',
+    'avatars/user.png',
+])
+def test_other_files_revalidate(client, static, filename):
+    static(filename)
+    response = client.get('/static/' + filename)
+    assert response.status_code == 200
+    assert not response.cache_control.immutable
+    assert response.cache_control.max_age == assets.DEFAULT_MAX_AGE
+
+    # 原地重新生成后 ETag 随内容变化
+    etag = response.headers['ETag']
+    assert client.get('/static/' + filename, headers={'If-None-Match': etag}).status_code == 304
+    static(filename, b'regenerated')
+    response = client.get('/static/' + filename, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_derivative_etags_differ_per_size(client, static):
+    etags = {client.get('/static/' + static(f'derivatives/ab/{DIGEST}/{size}.webp')).headers['ETag']
+             for size in ('thumb', 'preview', 'full')}
+    assert len(etags) == 3
+
+
+def test_missing_and_escaping_paths(client, static):
+    assert client.get('/static/objects/missing.jpg').status_code == 404
+    assert client.get('/static/../config.py').status_code == 404
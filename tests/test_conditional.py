@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.response_cache import response_cache
+
+
+@pytest.fixture()
+def image(db, make_user, make_image):
+    image = make_image(make_user('author'), 'image')
+    _age(db)
+    return image
+
+
+def _age(db):
+    # 修改时间在 RECENT 之外才返回验证器
+    from model.index import Image
+
+    db.session.execute(Image.__table__.update().values(update_time=datetime.utcnow() - timedelta(minutes=5)))
+    db.session.commit()
+
+
+def _rename(db, name):
+    # 直接改库, 不让缓存失效 (如其他进程使用进程内缓存时的修改)
+    from model.index import Image
+
+    db.session.execute(Image.__table__.update().values(name=name))
+    db.session.commit()
+    _age(db)
+
+
+def test_not_modified(client, image):
+    url = f'/wallpaper/{image.id}'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'MISS'
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert client.get(url, headers={'If-None-Match': 'W/"other"'}).status_code == 200
+
+
+def test_recently_modified_has_no_validators(client, make_user, make_image):
+    image = make_image(make_user('author'), 'image')
+    response = client.get(f'/wallpaper/{image.id}')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    # 这段时间内缓存的内容也不带 ETag
+    assert 'ETag' not in client.get(f'/wallpaper/{image.id}').headers
+
+
+def test_cached_body_keeps_its_own_etag(db, client, image):
+    url = f'/wallpaper/{image.id}'
+    first = client.get(url)
+    etag = first.headers['ETag']
+
+    _rename(db, 'changed')
+    response = client.get(url)
+    # 旧的缓存内容带着计算时的 ETag 返回, 而不是当前水位的 ETag
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.json['name'] == 'image'
+    assert response.headers['ETag'] == etag
+    assert 'Last-Modified' not in response.headers
+    revalidated = client.get(url, headers={'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+
+    response_cache.invalidate(f'image:{image.id}')
+    response = client.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.json['name'] == 'changed'
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    assert client.get(url, headers={'If-None-Match': new_etag}).status_code == 304
+
+
+def test_cached_body_matching_watermark(db, client, image):
+    url = f'/wallpaper/{image.id}'
+    etag = client.get(url).headers['ETag']
+    response = client.get(url)
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.headers['ETag'] == etag
+    assert 'Last-Modified' in response.headers
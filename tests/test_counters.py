@@ -0,0 +1,110 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from utils.counters import counters
+
+
+@pytest.fixture()
+def images(db, make_user, make_image):
+    user = make_user('author')
+    return make_image(user, 'first'), make_image(user, 'second')
+
+
+def _reload(db, model, row_id):
+    db.session.expire_all()
+    return db.session.get(model, row_id)
+
+
+def _outage(*args, **kwargs):
+    raise OperationalError('UPDATE image', {}, Exception('MySQL server has gone away'))
+
+
+def test_flush_merges_increments(db, images):
+    from model.index import Image
+
+    first, second = images
+    for _ in range(3):
+        counters.incr(Image, first.id, 'download_count')
+    counters.incr(Image, second.id, 'like_count', 2)
+    counters.incr(Image, second.id, 'like_count', -1)
+
+    assert counters.flush() == 2
+    assert counters.flush() == 0
+    first, second = _reload(db, Image, first.id), _reload(db, Image, second.id)
+    assert first.download_count == 3
+    assert second.like_count == 1
+    # 派生列随计数一起更新
+    assert second.heat_score == Image.HEAT_WEIGHTS['like_count']
+
+
+def test_flush_notifies_listeners(db, images, monkeypatch):
+    from model.index import Image
+
+    flushed = []
+    monkeypatch.setattr(counters, '_listeners', counters._listeners + [flushed.append])
+    counters.incr(Image, images[0].id, 'favorite_count')
+    counters.flush()
+    assert flushed == [{(Image, images[0].id): {'favorite_count': 1}}]
+
+
+def test_transient_error_keeps_counts(db, images, monkeypatch):
+    from model.index import Image
+
+    first = images[0]
+    counters.incr(Image, first.id, 'download_count', 2)
+    monkeypatch.setattr(counters, '_write', _outage)
+    for _ in range(5):
+        with pytest.raises(OperationalError):
+            counters.flush()
+    # 故障期间的新增量也保留
+    counters.incr(Image, first.id, 'download_count')
+    monkeypatch.undo()
+
+    assert counters.flush() == 1
+    assert _reload(db, Image, first.id).download_count == 3
+
+
+def test_failing_row_is_isolated(db, images, caplog):
+    from model.index import Image
+
+    first, second = images
+    counters.incr(Image, first.id, 'download_count', 4)
+    counters.incr(Image, second.id, 'no_such_column')
+    counters.incr(Image, second.id, 'like_count')
+
+    assert counters.flush() == 1
+    assert 'no_such_column' in caplog.text
+    assert _reload(db, Image, first.id).download_count == 4
+    # 同一行的其他列一起丢弃, 不影响其他行
+    assert _reload(db, Image, second.id).like_count == 0
+    assert counters.flush() == 0
+
+
+def test_transient_error_while_retrying_rows(db, images, monkeypatch):
+    from model.index import Image
+
+    first, second = images
+    write = counters._write
+    calls = []
+
+    def flaky(taken):
+        calls.append(taken)
+        if len(calls) == 1:
+            raise ValueError('bad batch')
+        if len(calls) == 3:
+            _outage()
+        write(taken)
+
+    counters.incr(Image, first.id, 'download_count')
+    counters.incr(Image, second.id, 'download_count', 5)
+    monkeypatch.setattr(counters, '_write', flaky)
+    with pytest.raises(OperationalError):
+        counters.flush()
+    monkeypatch.undo()
+
+    # 第一行已经写回, 第二行放回内存, 下次写回
+    written = set(calls[1])
+    assert len(written) == 1
+    assert counters.flush() == 1
+    assert _reload(db, Image, first.id).download_count == 1
+    assert _reload(db, Image, second.id).download_count == 5
@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.leaderboard import leaderboard
+
+
+@pytest.fixture()
+def author(db, make_user, monkeypatch):
+    from utils import timeline
+
+    monkeypatch.setattr(timeline, 'publish', lambda post: None)
+    return make_user('author')
+
+
+def _scores(metric='posts', window='7d'):
+    return [(user.id, score) for user, score in leaderboard.top(metric, window)]
+
+
+def _add_post(db, user, created_at=None):
+    from model.index import Post
+
+    post = Post(user_id=user.id, content='hello', created_at=created_at or datetime.now())
+    db.session.add(post)
+    db.session.commit()
+    return post
+
+
+def test_windows_use_local_post_times(db, author):
+    from model.index import Post
+
+    _add_post(db, author)
+    _add_post(db, author, datetime.now() - timedelta(days=10))
+    assert _scores('posts', '7d') == [(author.id, 1)]
+    assert _scores('posts', '30d') == [(author.id, 2)]
+
+    # 增量: 发帖按本地时间传入, 删除时传原来的发布时间
+    post = Post.create(user_id=author.id, content='new', images=None, created_at=datetime.now())
+    assert _scores('posts', '7d') == [(author.id, 2)]
+    leaderboard.record('posts', author.id, -1, post.created_at)
+    leaderboard.record('posts', author.id, -1, datetime.now() - timedelta(days=10))
+    assert _scores('posts', '7d') == [(author.id, 1)]
+    assert _scores('posts', '30d') == [(author.id, 1)]
+
+
+def test_invalid_board():
+    with pytest.raises(ValueError):
+        leaderboard.top('posts', '1d')
+    with pytest.raises(ValueError):
+        leaderboard.top('followers', '7d')
+
+
+def test_reload_does_not_double_count_committed_delta(db, author, monkeypatch):
+    # 加载开始之后, 数据库快照之前提交并记录的增量已经包含在快照中
+    window_queries = leaderboard._window_queries
+
+    def queries(starts):
+        post = _add_post(db, author)
+        leaderboard.record('posts', author.id, 1, post.created_at)
+        return window_queries(starts)
+
+    monkeypatch.setattr(leaderboard, '_window_queries', queries)
+    assert _scores() == [(author.id, 1)]
+
+
+def test_reload_replays_delta_after_snapshot(db, author, monkeypatch):
+    _add_post(db, author)
+    assert _scores() == [(author.id, 1)]
+
+    # 快照开始之后记录的增量 (快照中看不到) 在加载完成后叠加
+    engine = db.engine
+    connect = engine.connect
+
+    class Connection(object):
+        def __init__(self):
+            self.connection = connect()
+            self.recorded = False
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self.connection.close()
+
+        def execute(self, query):
+            rows = list(self.connection.execute(query))
+            if not self.recorded:
+                self.recorded = True
+                leaderboard.record('posts', author.id, 1)
+            return rows
+
+    monkeypatch.setattr(engine, 'connect', Connection)
+    monkeypatch.setattr(leaderboard, '_loaded_at', 0)
+    assert _scores() == [(author.id, 2)]
+
+
+def test_reload_corrects_drift(db, author):
+    _add_post(db, author)
+    assert _scores() == [(author.id, 1)]
+    # 其他进程写入, 本进程没有记录增量
+    _add_post(db, author)
+    assert _scores() == [(author.id, 1)]
+    leaderboard._loaded_at = 0
+    assert _scores() == [(author.id, 2)]
@@ -0,0 +1,113 @@
+import base64
+from datetime import datetime
+
+import pytest
+
+from utils.pagination import MAX_CURSOR_INT, decode_cursor, encode_cursor, keyset_paginate, parse_limit
+
+
+def test_cursor_round_trip():
+    now = datetime(2024, 5, 1, 12, 30)
+    assert decode_cursor(encode_cursor(now, 7), datetime) == (now, 7)
+    assert decode_cursor(encode_cursor(None, 7), int) == (None, 7)
+    assert decode_cursor(encode_cursor(3, 7), int) == (3, 7)
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    '!!!!',
+    base64.urlsafe_b64encode(b'[1]').decode(),
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    encode_cursor(1, 'x'),
+    encode_cursor(1, True),
+    encode_cursor(1, 1.5),
+    'A' * 5000,
+])
+def test_malformed_cursor(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('row_id', [0, -1, -10 ** 30, MAX_CURSOR_INT + 1, 10 ** 30])
+def test_cursor_id_out_of_range(row_id):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(1, row_id))
+
+
+@pytest.mark.parametrize('value', [MAX_CURSOR_INT + 1, -MAX_CURSOR_INT - 1, 10 ** 30])
+def test_cursor_value_out_of_range(value):
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(value, 1), int)
+
+
+def test_cursor_value_type():
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor('x', 1), int)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(True, 1), int)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor(1, 1), datetime)
+
+
+def test_parse_limit():
+    assert parse_limit(None) == 20
+    assert parse_limit('0') == 1
+    assert parse_limit('100000') == 100
+    with pytest.raises(ValueError):
+        parse_limit('ten')
+
+
+def test_keyset_paginate_walks_null_sort_values(db, make_user, make_image):
+    from model.index import Image
+
+    user = make_user('author')
+    for n in range(7):
+        image = make_image(user, f'image{n}')
+        # like_count 有默认值, 创建之后再改为 NULL
+        image.like_count = None if n % 3 == 0 else n % 2
+    db.session.commit()
+
+    seen, after = [], None
+    while True:
+        rows, after = keyset_paginate(Image.query, Image.like_count, Image.id, after=after, limit=2)
+        seen += [(row.like_count, row.id) for row in rows]
+        if not after:
+            break
+
+    assert len(seen) == 7
+    assert len({row_id for _, row_id in seen}) == 7
+    counted = [item for item in seen if item[0] is not None]
+    assert counted == sorted(counted, reverse=True)
+    # NULL 排在最后, 按 id 降序
+    nulls = [row_id for like_count, row_id in seen if like_count is None]
+    assert seen[-len(nulls):] == [(None, row_id) for row_id in sorted(nulls, reverse=True)]
+
+
+@pytest.mark.parametrize('cursor', [
+    'garbage',
+    encode_cursor('x', 3),
+    encode_cursor(datetime(2024, 1, 1), 3),
+    encode_cursor(5, -3),
+    encode_cursor(5, 10 ** 30),
+    encode_cursor(10 ** 30, 3),
+])
+def test_sorted_wallpapers_reject_bad_cursor(client, make_user, make_image, cursor):
+    make_image(make_user('author'), 'image')
+    response = client.get('/wallpaper/like?after=' + cursor)
+    assert response.status_code == 400
+    assert response.json['error'] == '无效的游标'
+
+
+def test_new_wallpapers_pages(client, make_user, make_image):
+    user = make_user('author')
+    ids = [make_image(user, f'image{n}').id for n in range(5)]
+
+    seen, after = [], ''
+    while True:
+        response = client.get(f'/wallpaper/new?limit=2&fields=id&after={after}')
+        assert response.status_code == 200
+        seen += [row['id'] for row in response.json['data']]
+        after = response.json['next_cursor']
+        if not after:
+            break
+    assert sorted(seen) == ids
@@ -0,0 +1,65 @@
+from urllib.parse import urlencode
+
+import pytest
+
+from utils.pagination import encode_cursor
+
+
+@pytest.fixture()
+def tagged(db, make_user, make_image):
+    from model.index import Tag
+
+    user = make_user('author')
+    tags = {name: Tag(name=name) for name in ('风景', '动漫', '城市')}
+    db.session.add_all(tags.values())
+    db.session.commit()
+    images = {}
+    for n in range(12):
+        image = make_image(user, f'image{n}')
+        names = [name for i, name in enumerate(tags) if n >> i & 1]
+        image.tags.extend(tags[name] for name in names)
+        images[image.id] = set(names)
+    db.session.commit()
+    return images
+
+
+def _filter(client, **params):
+    return client.get('/wallpaper/filter?' + urlencode(params))
+
+
+def test_filter_pages_through_all_of(client, tagged):
+    expected = sorted((image_id for image_id, names in tagged.items() if {'风景', '动漫'} <= names), reverse=True)
+
+    body = _filter(client, all='风景,动漫', limit=1).json
+    assert body['total'] == len(expected)
+    ids = [row['id'] for row in body['data']]
+    while body['next_cursor']:
+        body = _filter(client, all='风景,动漫', limit=1, after=body['next_cursor']).json
+        ids += [row['id'] for row in body['data']]
+    assert ids == expected
+
+
+def test_filter_any_and_not(client, tagged):
+    expected = sorted((image_id for image_id, names in tagged.items()
+                       if names & {'风景', '城市'} and '动漫' not in names), reverse=True)
+    body = _filter(client, **{'any': '风景,城市', 'not': '动漫'}).json
+    assert [row['id'] for row in body['data']] == expected
+
+
+def test_filter_unknown_tag_matches_nothing(client, tagged):
+    assert _filter(client, all='不存在').json['total'] == 0
+
+
+@pytest.mark.parametrize('cursor', ['zz', encode_cursor(None, 0), encode_cursor(None, -5),
+                                    encode_cursor(None, 10 ** 30)])
+def test_filter_rejects_bad_cursor(client, tagged, cursor):
+    response = _filter(client, after=cursor)
+    assert response.status_code == 400
+
+
+def test_filter_cursor_past_the_end(client, tagged):
+    # 比所有壁纸都大的游标从最新的开始, 游标之后没有壁纸时返回空页
+    body = _filter(client, after=encode_cursor(None, 10 ** 12), limit=3).json
+    assert [row['id'] for row in body['data']] == sorted(tagged, reverse=True)[:3]
+    body = _filter(client, after=encode_cursor(None, min(tagged))).json
+    assert body['data'] == [] and body['next_cursor'] is None
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import follow_graph, timeline
+
+
+@pytest.fixture()
+def held(monkeypatch):
+    # 不启动后台线程, 记录待写扩散的帖子, 由测试决定写扩散的时机
+    posts = []
+    monkeypatch.setattr(timeline, 'publish', lambda post: posts.append(post.id))
+    return posts
+
+
+def _entries(db):
+    from model.index import Timeline_Entry
+
+    db.session.expire_all()
+    return sorted((entry.user_id, entry.post_id) for entry in Timeline_Entry.query)
+
+
+def _post(user, content='hello', created_at=None):
+    from model.index import Post
+
+    return Post.create(user_id=user.id, content=content, images=None, created_at=created_at or datetime.now())
+
+
+def test_fan_out_to_author_and_followers(db, make_user, held):
+    author, reader, other = make_user('author'), make_user('reader'), make_user('other')
+    follow_graph.follow(reader.id, author.id)
+
+    post = _post(author)
+    timeline.fan_out(held.pop())
+
+    assert _entries(db) == [(author.id, post.id), (reader.id, post.id)]
+    posts, next_cursor = timeline.read(reader.id)
+    assert [row['id'] for row in posts] == [post.id] and next_cursor is None
+    assert timeline.read(other.id)[0] == []
+
+
+def test_fan_out_after_intervening_follow(db, make_user, held):
+    author, early, late = make_user('author'), make_user('early'), make_user('late')
+    follow_graph.follow(early.id, author.id)
+
+    post = _post(author)
+    # 写扩散之前有人关注了作者, 关注时已经补写了这条帖子
+    assert follow_graph.follow(late.id, author.id)
+    assert _entries(db) == [(late.id, post.id)]
+
+    timeline.fan_out(held.pop())
+    assert _entries(db) == sorted([(author.id, post.id), (early.id, post.id), (late.id, post.id)])
+    # 再次写扩散 (如重试) 不会重复写入
+    timeline.fan_out(post.id)
+    assert len(_entries(db)) == 3
+
+
+def test_fan_out_in_background_logs_failures(app, db, make_user, held, monkeypatch, caplog):
+    author = make_user('author')
+    post = _post(author)
+
+    def broken(post_id):
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(timeline, 'fan_out', broken)
+    timeline._fan_out_in_background(app, post.id)
+    assert '关注流写扩散失败' in caplog.text
+
+
+def test_unfollow_removes_entries_and_read_pages(db, make_user, held):
+    author, reader = make_user('author'), make_user('reader')
+    follow_graph.follow(reader.id, author.id)
+    start = datetime.now() - timedelta(hours=1)
+    post_ids = []
+    for n in range(5):
+        post_ids.append(_post(author, f'post {n}', start + timedelta(minutes=n)).id)
+        timeline.fan_out(held.pop())
+
+    seen, after = [], None
+    while True:
+        posts, after = timeline.read(reader.id, after=after, limit=2)
+        seen += [row['id'] for row in posts]
+        if not after:
+            break
+    assert seen == post_ids[::-1]
+
+    follow_graph.unfollow(reader.id, author.id)
+    assert timeline.read(reader.id)[0] == []
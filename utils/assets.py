@@ -0,0 +1,97 @@
+# assets.py
+# static 目录下文件 (壁纸原图、衍生图、头像、二维码) 的发送
+# - 强 ETag: 内容寻址的文件直接用文件名里的哈希, 其他文件计算一次 SHA-256 后按 (mtime, size) 缓存
+# - 内容寻址的文件 (按内容哈希命名的原图, 以及哈希目录下的衍生图) 永远不会变, 返回 Cache-Control: immutable
+#   和一年的 max-age; 旧文件的衍生图 (目录名如 1_jpg) 会被原地重新生成, 和其他文件一样按普通 max-age 重新验证
+# - 通过 send_file(conditional=True) 支持 If-None-Match (304) 和 Range (206)
+# - 配置 ASSET_ACCEL_REDIRECT 时, 只返回 X-Accel-Redirect 头, 由前面的 nginx 直接发送文件;
+#   配置 USE_X_SENDFILE 时由 Flask 返回 X-Sendfile 头 (Apache / lighttpd);
+#   都不配置时 send_file 使用 WSGI 服务器的 wsgi.file_wrapper (gunicorn 下为 sendfile 零拷贝)
+import hashlib
+import os
+import threading
+
+from flask import abort, current_app, request, send_file
+from werkzeug.security import safe_join
+
+from utils.storage import hash_from_url
+
+STATIC_FOLDER = 'static'
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+DEFAULT_MAX_AGE = 3600
+
+_etag_lock = threading.Lock()
+# 文件路径 -> (mtime_ns, size, etag)
+_etag_cache = {}
+
+
+def _content_hash(filename):
+    # 内容寻址文件的哈希: objects/ab/cd/<hash>.jpg 或 derivatives/ab/<hash>/thumb.webp, 其他文件返回 None
+    parts = filename.replace('\\', '/').split('/')
+    if parts[0] == 'objects':
+        return hash_from_url(parts[-1])
+    if parts[0] == 'derivatives' and len(parts) >= 2:
+        return hash_from_url(parts[-2])
+    return None
+
+
+def _is_immutable(filename):
+    return _content_hash(filename) is not None
+
+
+def _file_etag(full_path, filename, stat):
+    digest = _content_hash(filename)
+    if digest:
+        # 同一张图片的各个衍生图共用一个哈希, 加上文件名区分
+        folder, _, rest = filename.replace('\\', '/').partition('/')
+        return f'{digest}-{rest.rsplit("/", 1)[-1]}' if folder == 'derivatives' else digest
+
+    with _etag_lock:
+        cached = _etag_cache.get(full_path)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    sha256 = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            sha256.update(chunk)
+    etag = sha256.hexdigest()
+    with _etag_lock:
+        _etag_cache[full_path] = (stat.st_mtime_ns, stat.st_size, etag)
+    return etag
+
+
+def send_asset(filename):
+    """
+    发送 static 目录下的文件。
+
+    :param filename: 相对 static 目录的路径
+    """
+    full_path = safe_join(STATIC_FOLDER, filename)
+    if full_path is None or not os.path.isfile(full_path):
+        abort(404)
+    stat = os.stat(full_path)
+    etag = _file_etag(full_path, filename, stat)
+    immutable = _is_immutable(filename)
+    max_age = IMMUTABLE_MAX_AGE if immutable else DEFAULT_MAX_AGE
+
+    accel_prefix = current_app.config.get('ASSET_ACCEL_REDIRECT')
+    if accel_prefix:
+        # 交给 nginx 的 internal location 发送文件 (nginx 自己处理 Range), 这里只处理 304
+        response = current_app.response_class()
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        if request.if_none_match.contains(etag):
+            response.status_code = 304
+        else:
+            response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename.replace('\\', '/')
+            # 不带 Content-Type, 由 nginx 按文件扩展名决定
+            del response.headers['Content-Type']
+    else:
+        response = send_file(full_path, etag=etag, conditional=True, max_age=max_age)
+
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    if immutable:
+        response.cache_control.immutable = True
+    return response
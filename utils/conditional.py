@@ -0,0 +1,111 @@
+# conditional.py
+# 条件请求 (ETag / Last-Modified -> 304)
+# ETag 不对响应内容做哈希, 而是由接口依赖的表的 "水位" 计算: 最后修改时间 + 行数 + 最大 id,
+# 走索引的一条聚合查询就能得到; 新增、修改 (update_time 由 onupdate 维护, 计数写回等 core UPDATE 也会更新)
+# 和删除都会改变水位。客户端带着 If-None-Match / If-Modified-Since 请求且水位没有变化时,
+# 直接返回 304, 不执行接口本身的查询和序列化。
+# 接口的响应来自 response_cache 时, 使用缓存项计算时保存的 ETag (见 utils/response_cache.py),
+# 旧的缓存内容不会带着当前水位的 ETag 返回, 客户端之后也就不会一直收到 304
+import functools
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, g, make_response, request
+from sqlalchemy import func
+
+from extensions import db
+
+# 修改时间只精确到秒 (MySQL DATETIME), 最近这段时间内有修改时不返回验证器,
+# 否则同一秒内的第二次修改不会改变水位
+RECENT = timedelta(seconds=2)
+# response_cache 返回缓存内容时的 X-Cache
+CACHED_STATES = ('HIT', 'STALE', 'COALESCED')
+
+
+def table_watermark(model, time_column=None):
+    """
+    返回一个计算整张表水位的函数: (最后修改时间, 行数, 最大 id)。
+
+    :param time_column: 维护修改时间的列, 没有时只用 行数 和 最大 id (适用于只增删不修改的表)
+    """
+    def watermark(**kwargs):
+        columns = [func.count(), func.max(model.id)]
+        if time_column is not None:
+            columns.insert(0, func.max(time_column))
+        return tuple(db.session.query(*columns).one())
+    return watermark
+
+
+def row_watermark(model, time_column, arg):
+    """
+    返回一个计算单行水位的函数: (修改时间, ), arg 为路由中 id 参数的名称。
+    行不存在时返回 None, 交给接口本身返回 404。
+    """
+    def watermark(**kwargs):
+        row = db.session.query(time_column).filter(model.id == kwargs[arg]).first()
+        return tuple(row) if row is not None else None
+    return watermark
+
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def _set_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 每次都向服务端确认, 避免客户端根据 Last-Modified 自行推测缓存时间
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def conditional(*watermarks, lag=None):
+    """
+    为 GET 接口加上 ETag / Last-Modified, 水位没有变化时返回 304。
+
+    :param watermarks: table_watermark / row_watermark 返回的函数, 接口依赖多张表时传多个
+    :param lag: 响应来自会延迟刷新的缓存时, 缓存有效期的配置项名称 (如 'TOPIC_CACHE_TTL');
+                修改后的这段时间内不返回验证器, 避免把旧内容和新水位的 ETag 一起返回给客户端
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            marks = [watermark(**kwargs) for watermark in watermarks]
+            if any(mark is None for mark in marks):
+                return view(*args, **kwargs)
+            times = [value for mark in marks for value in mark if isinstance(value, datetime)]
+            # 修改时间按 UTC 存储
+            last_modified = max(times).replace(tzinfo=timezone.utc) if times else None
+            recent = max(RECENT, timedelta(seconds=current_app.config.get(lag, 0))) if lag else RECENT
+            if last_modified is not None and last_modified >= datetime.now(timezone.utc) - recent:
+                # 这段时间内计算的响应不保存 ETag
+                g.conditional_etag = None
+                return view(*args, **kwargs)
+
+            etag = hashlib.sha1(repr((request.full_path, marks)).encode('utf-8')).hexdigest()
+            if _not_modified(etag, last_modified):
+                return _set_validators(make_response('', 304), etag, last_modified)
+
+            g.conditional_etag = etag
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            if response.headers.get('X-Cache') in CACHED_STATES:
+                # 缓存内容: 只使用缓存项保存的 ETag, 与当前水位不同时也不返回 Last-Modified
+                cached_etag = response.get_etag()[0]
+                if cached_etag:
+                    last_modified = last_modified if cached_etag == etag else None
+                    # 客户端已有的正是这份缓存内容
+                    if request.if_none_match.contains_weak(cached_etag):
+                        return _set_validators(make_response('', 304), cached_etag, last_modified)
+                    _set_validators(response, cached_etag, last_modified)
+            else:
+                _set_validators(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,171 @@
+# counters.py
+# 计数的写后合并 (write-behind)
+# 下载量、喜欢数、收藏数、浏览量等计数不再 "读一行 -> Python 里加一 -> 提交",
+# 而是先在内存中按 (模型, id) 分片累加, 由后台线程定期合并写回:
+#   UPDATE image SET like_count = like_count + :n, heat_score = heat_score + 2 * :n WHERE id = :id
+# 写回是原子自增, 并发请求之间不会丢失更新; 最多延迟 COUNTER_FLUSH_INTERVAL 秒, 进程退出时会再写回一次。
+# 写回失败时:
+# - 数据库连接/锁等暂时性错误 (OperationalError 等): 计数全部放回内存, 下次重试, 不丢弃
+# - 其他错误: 逐行重新写回, 只丢弃自身写不进去的行 (记录错误日志), 其他行正常写回
+import atexit
+import threading
+import time
+
+from sqlalchemy import bindparam, func
+from sqlalchemy.exc import DisconnectionError, InterfaceError, OperationalError
+
+from extensions import db
+
+
+class CounterBuffer(object):
+    SHARDS = 16
+
+    def __init__(self):
+        self._shards = [({}, threading.Lock()) for _ in range(self.SHARDS)]
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+        self.flush_interval = 2.0
+        self.max_pending = 5000
+        # 写回提交之后调用的回调, 参数为写回的 {(模型, id): {列: 增量}}
+        self._listeners = []
+
+    def init_app(self, app):
+        self._app = app
+        self.flush_interval = app.config.get('COUNTER_FLUSH_INTERVAL', self.flush_interval)
+        self.max_pending = app.config.get('COUNTER_MAX_PENDING', self.max_pending)
+        atexit.register(self.flush)
+
+    def on_flush(self, listener):
+        # 注册写回之后的回调, 例如让依赖这些行的缓存失效
+        self._listeners.append(listener)
+
+    def incr(self, model, row_id, column, delta=1):
+        """
+        给 model 表中 id 为 row_id 的行的 column 列加上 delta (可以为负), 稍后批量写回。
+        """
+        key = (model, int(row_id))
+        pending, lock = self._shards[hash(key) % self.SHARDS]
+        with lock:
+            counts = pending.setdefault(key, {})
+            counts[column] = counts.get(column, 0) + delta
+            full = len(pending) * self.SHARDS >= self.max_pending
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        failures = 0
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                failures = 0
+            except Exception:
+                failures += 1
+                self._app.logger.exception('计数写回失败')
+                # 连续失败时逐渐拉长重试间隔, 最长 1 分钟
+                time.sleep(min(self.flush_interval * 2 ** failures, 60))
+
+    def _take_pending(self):
+        taken = {}
+        for pending, lock in self._shards:
+            with lock:
+                if pending:
+                    taken.update(pending)
+                    pending.clear()
+        return taken
+
+    def _restore_pending(self, taken):
+        # 放回内存等待下次重试
+        for key, counts in taken.items():
+            for column, delta in counts.items():
+                self.incr(key[0], key[1], column, delta)
+
+    @staticmethod
+    def _is_transient(error):
+        # 连接断开、锁等待超时、死锁等, 重试可能成功
+        return (isinstance(error, (OperationalError, InterfaceError, DisconnectionError))
+                or getattr(error, 'connection_invalidated', False))
+
+    def _write(self, taken):
+        # 在一个事务中写回, 相同列组合的行用一条 executemany 的 UPDATE 完成
+        groups = {}
+        for (model, row_id), counts in taken.items():
+            counts = {column: delta for column, delta in counts.items() if delta}
+            if not counts:
+                continue
+            params = {'_id': row_id}
+            params.update({f'_d_{column}': delta for column, delta in counts.items()})
+            groups.setdefault((model, tuple(sorted(counts))), []).append(params)
+        try:
+            for (model, columns), params in groups.items():
+                db.session.execute(self._update_statement(model, columns), params)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def _write_rows(self, taken):
+        # 整批写回失败 (非暂时性错误) 时逐行写回, 返回写回成功的行; 遇到暂时性错误时剩下的行放回内存并抛出
+        written = {}
+        items = list(taken.items())
+        for index, (key, counts) in enumerate(items):
+            try:
+                self._write({key: counts})
+            except Exception as e:
+                if self._is_transient(e):
+                    self._restore_pending(dict(items[index:]))
+                    raise
+                self._app.logger.exception('计数写回失败, 已丢弃: %s id=%s %s',
+                                           key[0].__tablename__, key[1], counts)
+                continue
+            written[key] = counts
+        return written
+
+    def flush(self):
+        """
+        把内存中累加的计数写回数据库。
+
+        :return: 写回的行数
+        """
+        with self._flush_lock:
+            taken = self._take_pending()
+            if not taken:
+                return 0
+            with self._app.app_context():
+                try:
+                    self._write(taken)
+                except Exception as e:
+                    if self._is_transient(e):
+                        self._restore_pending(taken)
+                        raise
+                    taken = self._write_rows(taken)
+        for listener in self._listeners:
+            listener(taken)
+        return len(taken)
+
+    @staticmethod
+    def _update_statement(model, columns):
+        table = model.__table__
+        values = {column: func.coalesce(table.c[column], 0) + bindparam(f'_d_{column}') for column in columns}
+        # 派生列, 例如 Image.heat_score 按权重随计数一起变化
+        for derived, weights in getattr(model, 'DERIVED_COUNTERS', {}).items():
+            deltas = [weight * bindparam(f'_d_{column}') for column, weight in weights.items() if column in columns]
+            if deltas:
+                values[derived] = table.c[derived] + sum(deltas)
+        return table.update().where(table.c.id == bindparam('_id')).values(values)
+
+
+counters = CounterBuffer()
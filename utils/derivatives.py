@@ -0,0 +1,109 @@
+# derivatives.py
+# 上传壁纸的多分辨率衍生图
+# 每张原图生成 缩略图(thumb) / 预览图(preview) / 原尺寸(full) 三档, 格式为 WebP,
+# Pillow 支持 AVIF 时 (Pillow 11.3+ 或安装了 pillow-avif-plugin) 同时生成 AVIF,
+# 编码放在进程池中并行执行, 列表页只需要加载缩略图
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image as I
+
+from utils.storage import hash_from_url, public_url
+
+try:
+    import pillow_avif  # noqa: F401  可选插件, 为旧版本 Pillow 注册 AVIF 编码器
+except ImportError:
+    pass
+
+DERIVATIVE_FOLDER = os.path.join('static', 'derivatives')
+# 各档的最长边像素, None 表示保持原尺寸
+SIZES = {'thumb': 480, 'preview': 1280, 'full': None}
+# 格式 -> (文件扩展名, MIME 类型), 按优先级从高到低排列
+FORMATS = {'avif': ('avif', 'image/avif'), 'webp': ('webp', 'image/webp')}
+QUALITY = 80
+MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+_executor = None
+
+
+def _available_formats():
+    I.init()
+    return [fmt for fmt in FORMATS if fmt.upper() in I.SAVE]
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def derivative_key(url_or_path):
+    # 衍生图目录名: 按内容寻址的文件用内容哈希; 旧文件用带扩展名的文件名 (1.jpg -> 1_jpg),
+    # 避免 1.jpg 和 1.png 共用同一个目录
+    digest = hash_from_url(url_or_path)
+    if digest:
+        return digest
+    return os.path.basename(url_or_path or '').replace('.', '_')
+
+
+def derivative_dir(key):
+    # 按 key 的前两个字符分一级子目录, 避免 derivatives 目录下文件夹过多
+    return os.path.join(DERIVATIVE_FOLDER, key[:2], key)
+
+
+def derivative_path(key, size, fmt):
+    return os.path.join(derivative_dir(key), f'{size}.{FORMATS[fmt][0]}')
+
+
+# 在子进程中执行: 生成一张衍生图
+def _render(src_path, dest_path, max_side, fmt):
+    with I.open(src_path) as img:
+        img.seek(0)  # 动图只取第一帧
+        img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        if max_side:
+            img.thumbnail((max_side, max_side), I.LANCZOS)
+        tmp_path = dest_path + '.tmp'
+        img.save(tmp_path, format=fmt.upper(), quality=QUALITY)
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def generate_derivatives(src_path):
+    """
+    为原图生成所有尺寸和格式的衍生图, 已经存在的跳过。
+
+    :return: {尺寸: {格式: url}}
+    """
+    key = derivative_key(src_path)
+    os.makedirs(derivative_dir(key), exist_ok=True)
+
+    jobs = []
+    for size, max_side in SIZES.items():
+        for fmt in _available_formats():
+            dest_path = derivative_path(key, size, fmt)
+            if not os.path.exists(dest_path):
+                jobs.append(_get_executor().submit(_render, src_path, dest_path, max_side, fmt))
+    for job in jobs:
+        job.result()
+    return existing_variants(key)
+
+
+def existing_variants(key):
+    # 查看磁盘上已经生成的衍生图, 用于写入 Image.variants
+    variants = {}
+    for size in SIZES:
+        for fmt in FORMATS:
+            path = derivative_path(key, size, fmt)
+            if os.path.exists(path):
+                variants.setdefault(size, {})[fmt] = public_url(path)
+    return variants
+
+
+def pick_format(formats, accept_mimetypes):
+    # 根据请求头 Accept 选择客户端明确声明支持的最优格式 (不认 */*), 都不支持时返回 None
+    accepted = {mimetype for mimetype, quality in accept_mimetypes if quality > 0}
+    for fmt, (_, mimetype) in FORMATS.items():
+        if fmt in formats and mimetype in accepted:
+            return fmt
+    return None
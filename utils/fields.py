@@ -0,0 +1,86 @@
+# fields.py
+# 列表接口的字段选择 (?fields=id,url,like_count)
+# 每个接口用 {输出字段名: Field} 描述返回的数据, 查询时只取所选字段需要的列 (query.with_entities),
+# 得到的是轻量的 Row 元组而不是完整的 ORM 对象; 标签、作者这类需要额外查询的字段,
+# 只有被选中时才批量加载一次
+from extensions import db
+
+
+class Field(object):
+    """
+    一个输出字段。
+
+    :param columns: 需要查询的列
+    :param render: render(row, prefetched) 返回字段值; prefetched 为 prefetch 的结果
+    :param prefetch: prefetch(rows) 一页数据只调用一次, 用于批量加载关联数据
+    """
+
+    __slots__ = ('columns', 'render', 'prefetch')
+
+    def __init__(self, columns, render, prefetch=None):
+        self.columns = columns
+        self.render = render
+        self.prefetch = prefetch
+
+
+def column(col, convert=None):
+    # 直接输出某一列的值
+    key = col.key
+    if convert is None:
+        return Field([col], lambda row, _: getattr(row, key))
+    return Field([col], lambda row, _: convert(getattr(row, key)))
+
+
+def parse_fields(spec, fields=None):
+    """
+    解析 fields 参数, 为空时返回全部字段。
+
+    :raises ValueError: 包含不支持的字段
+    """
+    if not fields:
+        return list(spec)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in spec]
+    if unknown:
+        raise ValueError('不支持的字段: ' + ', '.join(unknown))
+    return list(dict.fromkeys(names))
+
+
+def select_columns(spec, names, *required):
+    # 所选字段需要的列, 加上分页/排序必须的列, 去重并保持顺序
+    columns = {}
+    for col in list(required) + [col for name in names for col in spec[name].columns]:
+        columns.setdefault(col.key, col)
+    return list(columns.values())
+
+
+def render(rows, spec, names):
+    # 把查询到的 Row 转换为字典列表
+    prefetched = {name: spec[name].prefetch(rows) for name in names if spec[name].prefetch}
+    return [{name: spec[name].render(row, prefetched.get(name)) for name in names} for row in rows]
+
+
+def project(query, spec, names, *required):
+    # 只查询所选字段需要的列
+    return query.with_entities(*select_columns(spec, names, *required))
+
+
+def tag_names(image_ids):
+    # 批量加载一组图片的标签名称, 返回 {image_id: [标签名]}
+    from model.index import Tag, image_tags
+
+    tags = {image_id: [] for image_id in image_ids}
+    if image_ids:
+        for image_id, name in (db.session.query(image_tags.c.image_id, Tag.name)
+                               .join(Tag, Tag.id == image_tags.c.tag_id)
+                               .filter(image_tags.c.image_id.in_(image_ids))):
+            tags[image_id].append(name)
+    return tags
+
+
+def image_tags_field():
+    # 图片的标签名称列表, 一页只查询一次
+    from model.index import Image
+
+    return Field([Image.id], lambda row, tags: tags.get(row.id, []),
+                 prefetch=lambda rows: tag_names([row.id for row in rows]))
@@ -0,0 +1,157 @@
+# follow_graph.py
+# 用户关注关系
+# 关注/取消关注直接操作 user_followers 中间表, 不经过 dynamic relationship;
+# 粉丝列表和关注列表按关注时间倒序做游标分页, 分别走 (followed_id, created_at, follower_id)
+# 和 (follower_id, created_at, followed_id) 索引, 粉丝再多翻页代价也一样;
+# User.follow_count / followers_count 在同一个事务中原子加减, 与中间表保持一致
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from utils import timeline
+from utils.loaders import load_users
+from utils.pagination import DEFAULT_LIMIT, keyset_paginate
+
+
+def _tables():
+    from model.index import User, user_followers
+    return User, user_followers
+
+
+def _add_counts(follower_id, followed_id, delta):
+    User, _ = _tables()
+    table = User.__table__
+    db.session.execute(table.update().where(table.c.id == follower_id)
+                       .values(follow_count=func.coalesce(table.c.follow_count, 0) + delta))
+    db.session.execute(table.update().where(table.c.id == followed_id)
+                       .values(followers_count=func.coalesce(table.c.followers_count, 0) + delta))
+
+
+def follow(follower_id, followed_id):
+    """
+    关注用户并提交。
+
+    :return: True 表示新关注, False 表示之前已经关注
+    """
+    _, user_followers = _tables()
+    try:
+        db.session.execute(user_followers.insert().values(follower_id=follower_id, followed_id=followed_id))
+        _add_counts(follower_id, followed_id, 1)
+        timeline.on_follow(follower_id, followed_id)
+        db.session.commit()
+    except IntegrityError:
+        # 主键 (follower_id, followed_id) 冲突: 已经关注
+        db.session.rollback()
+        return False
+    return True
+
+
+def unfollow(follower_id, followed_id):
+    """
+    取消关注并提交。
+
+    :return: True 表示取消成功, False 表示之前没有关注
+    """
+    _, user_followers = _tables()
+    deleted = db.session.execute(
+        user_followers.delete().where(user_followers.c.follower_id == follower_id,
+                                      user_followers.c.followed_id == followed_id)
+    ).rowcount
+    if not deleted:
+        db.session.rollback()
+        return False
+    _add_counts(follower_id, followed_id, -1)
+    timeline.on_unfollow(follower_id, followed_id)
+    db.session.commit()
+    timeline.on_followers_decreased(followed_id)
+    return True
+
+
+def is_following_many(user_id, target_ids):
+    """
+    批量判断 user_id 是否关注了 target_ids 中的用户, 一次按主键的 IN 查询。
+
+    :return: {target_id: bool}
+    """
+    _, user_followers = _tables()
+    target_ids = [int(target_id) for target_id in target_ids]
+    following = set()
+    if target_ids:
+        following = set(db.session.scalars(
+            db.select(user_followers.c.followed_id)
+            .where(user_followers.c.follower_id == user_id, user_followers.c.followed_id.in_(target_ids))
+        ))
+    return {target_id: target_id in following for target_id in target_ids}
+
+
+def _page_users(rows, user_column, next_cursor):
+    # 把 (用户 id, 关注时间) 的一页结果转成用户信息, 用户批量加载
+    users = load_users(getattr(row, user_column) for row in rows)
+    data = []
+    for row in rows:
+        user = users.get(getattr(row, user_column))
+        if user is not None:
+            item = user.to_dict()
+            item['followed_at'] = row.created_at
+            data.append(item)
+    return data, next_cursor
+
+
+def followers(user_id, after=None, limit=DEFAULT_LIMIT):
+    # 关注了 user_id 的用户, 最近关注的在前
+    _, user_followers = _tables()
+    query = (db.session.query(user_followers.c.follower_id, user_followers.c.created_at)
+             .filter(user_followers.c.followed_id == user_id))
+    rows, next_cursor = keyset_paginate(query, user_followers.c.created_at, user_followers.c.follower_id,
+                                        after=after, limit=limit)
+    return _page_users(rows, 'follower_id', next_cursor)
+
+
+def following(user_id, after=None, limit=DEFAULT_LIMIT):
+    # user_id 关注的用户, 最近关注的在前
+    _, user_followers = _tables()
+    query = (db.session.query(user_followers.c.followed_id, user_followers.c.created_at)
+             .filter(user_followers.c.follower_id == user_id))
+    rows, next_cursor = keyset_paginate(query, user_followers.c.created_at, user_followers.c.followed_id,
+                                        after=after, limit=limit)
+    return _page_users(rows, 'followed_id', next_cursor)
+
+
+def mutual(user_id, after=None, limit=DEFAULT_LIMIT):
+    # 互相关注的用户: user_id 关注了对方, 对方也关注了 user_id; 按 user_id 关注对方的时间倒序
+    _, user_followers = _tables()
+    back = user_followers.alias('back')
+    query = (db.session.query(user_followers.c.followed_id, user_followers.c.created_at)
+             .join(back, db.and_(back.c.follower_id == user_followers.c.followed_id,
+                                 back.c.followed_id == user_followers.c.follower_id))
+             .filter(user_followers.c.follower_id == user_id))
+    rows, next_cursor = keyset_paginate(query, user_followers.c.created_at, user_followers.c.followed_id,
+                                        after=after, limit=limit)
+    return _page_users(rows, 'followed_id', next_cursor)
+
+
+def reconcile_counts(batch_size=1000):
+    """
+    按中间表重新计算所有用户的 follow_count / followers_count, 按 id 分批提交,
+    用于手动改库或历史数据不一致时的修复。
+
+    :return: 处理的用户数
+    """
+    User, user_followers = _tables()
+    table = User.__table__
+    follow_count = (db.select(func.count()).select_from(user_followers)
+                    .where(user_followers.c.follower_id == table.c.id).scalar_subquery())
+    followers_count = (db.select(func.count()).select_from(user_followers)
+                       .where(user_followers.c.followed_id == table.c.id).scalar_subquery())
+    total = 0
+    last_id = 0
+    while True:
+        ids = db.session.scalars(db.select(table.c.id).where(table.c.id > last_id)
+                                 .order_by(table.c.id).limit(batch_size)).all()
+        if not ids:
+            return total
+        db.session.execute(table.update().where(table.c.id.in_(ids))
+                           .values(follow_count=follow_count, followers_count=followers_count))
+        db.session.commit()
+        total += len(ids)
+        last_id = ids[-1]
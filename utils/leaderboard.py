@@ -0,0 +1,176 @@
+# leaderboard.py
+# 创作者排行榜: 发帖最多 / 上传壁纸最多 / 获得喜欢最多, 分为 总榜 / 近7天 / 近30天
+# - 总榜直接按 User 上维护的统计字段 (posts_count / wallpapers_count / like_count) 走索引取前K名
+# - 近7天/近30天 的分数保存在内存中: 第一次使用时按窗口分组从数据库加载一次,
+#   之后发帖/上传/喜欢 时增量加减, 读取时只需在窗口内有分数的用户中取前K名
+# - 每天第一次读取, 以及距上次加载超过 LEADERBOARD_REBUILD_INTERVAL 秒时重新加载,
+#   修正多进程之间的差异和取消喜欢等近似处理带来的偏差; 加载期间记录的增量只叠加在数据库快照之后发生的部分
+# - 窗口按 UTC 的自然日划分; 帖子的 created_at 按服务器本地时间记录, 其他时间列按 UTC 记录,
+#   查询帖子时把窗口起点换算为本地时间, 增量记录时把帖子的发布时间换算为 UTC
+import heapq
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from extensions import db
+
+METRICS = ('posts', 'wallpapers', 'likes')
+# 窗口 -> 天数, None 表示总榜
+WINDOWS = {'all': None, '7d': 7, '30d': 30}
+# 总榜使用的 User 统计字段
+ALL_TIME_COLUMNS = {'posts': 'posts_count', 'wallpapers': 'wallpapers_count', 'likes': 'like_count'}
+# 时间列按服务器本地时间记录的指标
+LOCAL_TIME_METRICS = ('posts',)
+
+
+def _local_to_utc(value):
+    # 不带时区的本地时间 -> 不带时区的 UTC 时间
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _utc_to_local(value):
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+class Leaderboard(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 同一时间只有一个线程从数据库加载
+        self._load_lock = threading.Lock()
+        # 指标 -> 窗口 -> Counter(user_id -> 分数)
+        self._scores = None
+        # 每次 record 加一, 用于区分增量发生在数据库快照之前还是之后
+        self._seq = 0
+        # 正在加载时为 [(序号, 指标, user_id, 增量, UTC 时间)], 否则为 None
+        self._pending = None
+        self._loaded_day = None
+        self._loaded_at = 0
+        self.rebuild_interval = 600
+
+    def init_app(self, app):
+        self.rebuild_interval = app.config.get('LEADERBOARD_REBUILD_INTERVAL', self.rebuild_interval)
+
+    @staticmethod
+    def _window_start(days, today):
+        # 窗口起点 (UTC)
+        return datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+
+    @staticmethod
+    def _window_queries(starts):
+        # 返回 {指标: {窗口: 查询 (user_id, 数量)}}, starts 为 {窗口: UTC 起点}
+        from model.index import Image, Post, user_favorite_images
+
+        count = db.func.count()
+        queries = {'posts': {}, 'wallpapers': {}, 'likes': {}}
+        for window, start in starts.items():
+            queries['posts'][window] = (
+                db.select(Post.user_id, count)
+                .where(Post.created_at >= _utc_to_local(start), Post.deleted_at.is_(None))
+                .group_by(Post.user_id))
+            queries['wallpapers'][window] = (
+                db.select(Image.create_by, count)
+                .where(Image.create_time >= start)
+                .group_by(Image.create_by))
+            queries['likes'][window] = (
+                db.select(Image.create_by, count)
+                .select_from(user_favorite_images)
+                .join(Image, Image.id == user_favorite_images.c.image_id)
+                .where(user_favorite_images.c.created_at >= start)
+                .group_by(Image.create_by))
+        return queries
+
+    def _is_fresh(self, today):
+        return (self._scores is not None and self._loaded_day == today
+                and time.monotonic() - self._loaded_at < self.rebuild_interval)
+
+    def _ensure_loaded(self):
+        today = datetime.utcnow().date()
+        if self._is_fresh(today):
+            return
+
+        with self._load_lock:
+            if self._is_fresh(today):
+                return
+            with self._lock:
+                self._pending = []
+            try:
+                starts = {window: self._window_start(days, today) for window, days in WINDOWS.items() if days}
+                queries = self._window_queries(starts)
+                scores = {metric: {window: Counter() for window in starts} for metric in METRICS}
+                # 用新的连接 (新的事务) 查询, 快照从第一条查询开始, 不受当前请求中之前的查询影响;
+                # 序号不大于 marker 的增量在快照之前已经提交, 快照中已经包含
+                with db.engine.connect() as connection:
+                    with self._lock:
+                        marker = self._seq
+                    for metric, windows in queries.items():
+                        for window, query in windows.items():
+                            for user_id, count in connection.execute(query):
+                                scores[metric][window][user_id] += count
+
+                with self._lock:
+                    for seq, metric, user_id, delta, when in self._pending:
+                        if seq > marker:
+                            self._apply(scores, today, metric, user_id, delta, when)
+                    self._scores = scores
+                    self._loaded_day = today
+                    self._loaded_at = time.monotonic()
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    @classmethod
+    def _apply(cls, scores, loaded_day, metric, user_id, delta, when):
+        for window, counter in scores[metric].items():
+            if when >= cls._window_start(WINDOWS[window], loaded_day):
+                counter[user_id] += delta
+                if counter[user_id] <= 0:
+                    del counter[user_id]
+
+    def record(self, metric, user_id, delta=1, when=None):
+        """
+        发帖/上传/喜欢 提交成功后调用, 增量更新窗口榜单。
+
+        :param when: 被计数的事件发生的时间 (删除时传原来的发布时间), 与该指标的时间列同一时区, 默认为现在
+        """
+        if when is None:
+            when = datetime.utcnow()
+        elif metric in LOCAL_TIME_METRICS:
+            when = _local_to_utc(when)
+        with self._lock:
+            self._seq += 1
+            if self._pending is not None:
+                # 正在重新加载, 加载的查询可能看不到这次修改, 加载完成后再叠加一次
+                self._pending.append((self._seq, metric, int(user_id), delta, when))
+            if self._scores is not None:
+                self._apply(self._scores, self._loaded_day, metric, int(user_id), delta, when)
+
+    def top(self, metric, window='all', limit=10):
+        """
+        取排行榜前 limit 名。
+
+        :return: [(User, 分数)]
+        :raises ValueError: 指标或窗口不存在
+        """
+        from model.index import User
+        from utils.loaders import load_users
+
+        if metric not in METRICS or window not in WINDOWS:
+            raise ValueError('无效的排行榜')
+
+        if WINDOWS[window] is None:
+            column = getattr(User, ALL_TIME_COLUMNS[metric])
+            users = (User.query.filter(column > 0)
+                     .order_by(column.desc(), User.id).limit(limit).all())
+            return [(user, getattr(user, ALL_TIME_COLUMNS[metric])) for user in users]
+
+        self._ensure_loaded()
+        with self._lock:
+            ranking = heapq.nlargest(limit, self._scores[metric][window].items(),
+                                     key=lambda item: (item[1], -item[0]))
+        users = load_users(user_id for user_id, _ in ranking)
+        return [(users[user_id], score) for user_id, score in ranking if users.get(user_id)]
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,46 @@
+# loaders.py
+# 请求级别的用户批量加载器
+# 列表接口先把本次需要的所有用户 id 收集起来, 用一次 IN 查询取回,
+# 结果缓存在 flask.g 上, 同一个请求内再取同一个用户不会再查数据库
+from flask import g
+
+from extensions import db
+
+
+def _user_cache():
+    if 'user_cache' not in g:
+        g.user_cache = {}
+    return g.user_cache
+
+
+def load_users(user_ids):
+    """
+    批量获取用户, 返回 {user_id: User 或 None}。
+
+    :param user_ids: 用户 id 的可迭代对象, 可以有重复和 None
+    """
+    from model.index import User
+
+    cache = _user_cache()
+    # 前端传来的 id 可能是字符串, 统一转成 int 作为缓存的 key
+    user_ids = {int(user_id) for user_id in user_ids if user_id is not None}
+    missing = [user_id for user_id in user_ids if user_id not in cache]
+    if missing:
+        for user in db.session.query(User).filter(User.id.in_(missing)).all():
+            cache[user.id] = user
+        # 不存在的用户也记下来, 避免重复查询
+        for user_id in missing:
+            cache.setdefault(user_id, None)
+    return {user_id: cache[user_id] for user_id in user_ids}
+
+
+def clear_user_cache():
+    # 丢弃本次请求中已经加载的用户, 用于流式响应分批处理时控制内存
+    g.pop('user_cache', None)
+
+
+def get_user(user_id):
+    # 获取单个用户, 优先使用本次请求中已经加载过的结果
+    if user_id is None:
+        return None
+    return load_users([user_id])[int(user_id)]
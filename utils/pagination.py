@@ -0,0 +1,95 @@
+# pagination.py
+# 基于游标 (keyset) 的分页工具
+# 游标里保存上一页最后一行的 (排序值, id), 下一页直接从该位置继续往后取,
+# 配合 (排序列, id) 的联合索引, 无论翻到多深, 每一页的代价都是一样的
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# 游标中的整数超出 BIGINT 范围时数据库驱动会报错, 解析时直接拒绝
+MAX_CURSOR_INT = 2 ** 63 - 1
+
+
+def encode_cursor(value, row_id):
+    # datetime 无法直接 json 序列化, 转成 isoformat 并做标记
+    if isinstance(value, datetime):
+        value = {'dt': value.isoformat()}
+    raw = json.dumps([value, row_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, value_type=None):
+    """
+    解析游标, 失败时抛出 ValueError, 由路由返回 400。
+
+    :param value_type: 排序值应有的 Python 类型 (如 int / datetime), 为 None 时不检查;
+                       排序值为 None 表示上一页停在了排序列为 NULL 的行上
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(value, dict) and 'dt' in value:
+            value = datetime.fromisoformat(value['dt'])
+    except Exception:
+        raise ValueError('无效的游标')
+    # id 从 1 开始
+    if not isinstance(row_id, int) or isinstance(row_id, bool) or not 1 <= row_id <= MAX_CURSOR_INT:
+        raise ValueError('无效的游标')
+    if isinstance(value, int) and not isinstance(value, bool) and abs(value) > MAX_CURSOR_INT:
+        raise ValueError('无效的游标')
+    if value_type is not None and value is not None:
+        if not isinstance(value, value_type) or (isinstance(value, bool) and value_type is not bool):
+            raise ValueError('无效的游标')
+    return value, row_id
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def parse_limit(limit, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    try:
+        limit = int(limit) if limit is not None else default
+    except (TypeError, ValueError):
+        raise ValueError('limit 必须是整数')
+    return max(1, min(limit, maximum))
+
+
+def keyset_paginate(query, sort_column, id_column, after=None, limit=DEFAULT_LIMIT):
+    """
+    按 (sort_column DESC, id_column DESC) 对查询结果进行游标分页。
+    sort_column 可以为 NULL: MySQL 和 SQLite 降序时都把 NULL 排在最后, 这些行按 id 降序排在末尾,
+    不使用 coalesce, 以免用不上 (排序列, id) 索引
+
+    :param after: 上一页返回的 next_cursor, 为空时从第一页开始
+    :return: (当前页的数据, 下一页的游标 或 None)
+    """
+    if after:
+        value, row_id = decode_cursor(after, _python_type(sort_column))
+        if value is None:
+            # 已经翻到排序列为 NULL 的部分
+            query = query.filter(sort_column.is_(None), id_column < row_id)
+        else:
+            query = query.filter(or_(sort_column < value,
+                                     and_(sort_column == value, id_column < row_id),
+                                     sort_column.is_(None)))
+
+    # 多取一行, 用来判断是否还有下一页
+    rows = (query
+            .order_by(sort_column.desc(), id_column.desc())
+            .limit(limit + 1)
+            .all())
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+    return rows, next_cursor
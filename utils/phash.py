@@ -0,0 +1,191 @@
+# phash.py
+# 感知哈希 (dHash) 近似重复检测
+# 同一张壁纸被缩放或重新压缩后, 文件哈希会变, 但 dHash 基本不变 (汉明距离很小);
+# 所有壁纸的 dHash 放在一棵 BK 树中, 按汉明距离查询时只需访问树的一小部分;
+# 每隔 PHASH_INDEX_TTL 秒从数据库重建, 同步其他进程保存/删除的壁纸;
+# 同一时间只有一个请求重建, 其他请求继续使用旧的索引
+import threading
+import time
+
+from PIL import Image as I
+
+from extensions import db
+
+HASH_SIZE = 8
+# 汉明距离不超过该值视为近似重复
+MAX_DISTANCE = 6
+
+
+def dhash(path):
+    """
+    计算图片的 64 位 dHash: 缩放为 9x8 灰度图, 比较每行相邻像素的明暗。
+    """
+    with I.open(path) as img:
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))  # JPEG 直接按缩小的尺寸解码
+        img = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), I.LANCZOS)
+        pixels = list(img.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+# 数据库 BIGINT 是有符号的, 64 位哈希存取时做一次转换
+def to_signed(value):
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+class BKTree(object):
+    # 节点: [哈希值, 该哈希对应的图片 id 列表, {距离: 子节点}]
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, image_id):
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [image_id], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(image_id)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [image_id], {}]
+                return
+            node = child
+
+    def search(self, value, radius):
+        # 返回 [(image_id, 距离)], 利用三角不等式只访问距离在 [d-r, d+r] 范围内的子树
+        result = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                result.extend((image_id, distance) for image_id in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return result
+
+
+class PhashIndex(object):
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 同一时间只有一个线程重建
+        self._load_lock = threading.Lock()
+        self._tree = None
+        self._loaded_at = 0
+        # 每次增量修改加一, 重建期间有修改时不替换, 下次查询再重建
+        self._version = 0
+        # BK 树不便删除节点, 已删除的图片记录在这里, 查询时过滤
+        self._removed = set()
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PHASH_INDEX_TTL', self.ttl)
+
+    def _is_fresh(self):
+        return self._tree is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def ensure_loaded(self):
+        if self._is_fresh():
+            return
+        # 第一次加载时需要等待; 已有旧索引时正在重建就直接使用旧索引
+        if not self._load_lock.acquire(blocking=self._tree is None):
+            return
+        try:
+            if not self._is_fresh():
+                self._rebuild()
+        finally:
+            self._load_lock.release()
+
+    def _rebuild(self):
+        from model.index import Image
+
+        version = self._version
+        tree = BKTree()
+        for image_id, phash in db.session.query(Image.id, Image.phash).filter(Image.phash.isnot(None)):
+            tree.add(to_unsigned(phash), image_id)
+        with self._lock:
+            if version == self._version or self._tree is None:
+                self._tree = tree
+                self._removed = set()
+                self._loaded_at = time.monotonic()
+
+    def add(self, value, image_id):
+        with self._lock:
+            self._version += 1
+            if self._tree is not None:
+                self._tree.add(value, image_id)
+            self._removed.discard(image_id)
+
+    def remove(self, image_id):
+        with self._lock:
+            self._version += 1
+            self._removed.add(image_id)
+
+    def near_duplicates(self, value, radius=MAX_DISTANCE):
+        # 返回 [{'image_id', 'distance'}], 按距离从小到大排序
+        self.ensure_loaded()
+        with self._lock:
+            matches = [(image_id, distance) for image_id, distance in self._tree.search(value, radius)
+                       if image_id not in self._removed]
+        matches.sort(key=lambda item: (item[1], item[0]))
+        return [{'image_id': image_id, 'distance': distance} for image_id, distance in matches]
+
+
+# 每个进程一份
+phash_index = PhashIndex()
+
+
+def backfill(batch_size=200):
+    """
+    为还没有感知哈希的已有壁纸计算并保存 dHash, 按 id 分批提交。
+
+    :return: (成功计算的数量, 找不到文件或无法解析的数量)
+    """
+    from model.index import Image
+    from utils.storage import local_path
+
+    indexed = failed = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(Image.id, Image.url)
+                .filter(Image.phash.is_(None), Image.id > last_id)
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            return indexed, failed
+        updates = []
+        for image_id, url in rows:
+            path = local_path(url)
+            try:
+                updates.append({'id': image_id, 'phash': to_signed(dhash(path))})
+            except Exception:
+                failed += 1
+        if updates:
+            db.session.bulk_update_mappings(Image, updates)
+            db.session.commit()
+            for update in updates:
+                phash_index.add(to_unsigned(update['phash']), update['id'])
+        indexed += len(updates)
+        last_id = rows[-1].id
@@ -0,0 +1,237 @@
+# relation_cache.py
+# 用户 喜欢/收藏 壁纸关系的缓存
+# 判断 "当前用户是否喜欢/收藏了这些壁纸" 是访问量最大的读请求, 这里把每个用户喜欢和收藏的壁纸 id
+# 整体加载一次, 之后的判断都在内存中完成:
+# - 默认在进程内按用户做 LRU 缓存, id 集合用压缩位图存储 (安装了 pyroaring 时使用 Roaring Bitmap,
+#   否则使用有序的 array('I') + 二分查找), 每个用户只占几 KB
+# - 配置 RELATION_CACHE_REDIS_URL 时改用 Redis 集合, 多个进程共享同一份缓存
+# 喜欢/收藏 切换成功后写穿 (write-through) 更新缓存; 多进程且不使用 Redis 时,
+# 其他进程的缓存最多延迟 RELATION_CACHE_TTL 秒
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from extensions import db
+
+try:
+    from pyroaring import BitMap  # 可选依赖
+except ImportError:
+    BitMap = None
+
+try:
+    import redis  # 可选依赖, 仅在配置了 RELATION_CACHE_REDIS_URL 时使用
+except ImportError:
+    redis = None
+
+# 关系类型, 也是接口返回的字段名
+KINDS = ('is_liked', 'is_collected')
+
+
+class SortedIds(object):
+    # 没有 pyroaring 时使用的有序 id 数组, 每个 id 占 4 字节
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, ids=()):
+        self._ids = array('I', sorted(set(ids)))
+
+    def __contains__(self, image_id):
+        i = bisect_left(self._ids, image_id)
+        return i < len(self._ids) and self._ids[i] == image_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def add(self, image_id):
+        i = bisect_left(self._ids, image_id)
+        if i == len(self._ids) or self._ids[i] != image_id:
+            self._ids.insert(i, image_id)
+
+    def discard(self, image_id):
+        i = bisect_left(self._ids, image_id)
+        if i < len(self._ids) and self._ids[i] == image_id:
+            del self._ids[i]
+
+
+def _id_set(ids):
+    return BitMap(ids) if BitMap is not None else SortedIds(ids)
+
+
+def _load_from_db(user_id):
+    # 一次查询取回用户喜欢和收藏的全部壁纸 id, 返回 {关系类型: [image_id]}
+    from model.index import user_collect_images, user_favorite_images
+
+    liked = (db.select(user_favorite_images.c.image_id, db.literal('is_liked').label('relation'))
+             .where(user_favorite_images.c.user_id == user_id))
+    collected = (db.select(user_collect_images.c.image_id, db.literal('is_collected').label('relation'))
+                 .where(user_collect_images.c.user_id == user_id))
+    ids = {kind: [] for kind in KINDS}
+    for image_id, relation in db.session.execute(db.union_all(liked, collected)):
+        ids[relation].append(image_id)
+    return ids
+
+
+class LocalBackend(object):
+
+    def __init__(self, max_users, ttl):
+        self._lock = threading.Lock()
+        # user_id -> (过期时间, {关系类型: id 集合}), 按最近使用排序
+        self._users = OrderedDict()
+        self.max_users = max_users
+        self.ttl = ttl
+        # user_id -> 该用户最近一次写穿更新的序号; 加载期间该用户有更新时不缓存本次加载的结果 (可能已经过期),
+        # 其他用户的更新不影响。序号只增不减, 超过 max_users 个用户时清空并增加 _epoch
+        self._versions = {}
+        self._sequence = 0
+        self._epoch = 0
+        # 已删除的壁纸 id -> 删除时间; 读取时过滤, 不需要遍历所有缓存的用户,
+        # 超过 ttl 之后缓存项都已重新加载, 不再需要记录
+        self._removed = OrderedDict()
+
+    def _user_version(self, user_id):
+        return self._epoch, self._versions.get(user_id)
+
+    def _get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                return entry[1]
+            version = self._user_version(user_id)
+
+        sets = {kind: _id_set(ids) for kind, ids in _load_from_db(user_id).items()}
+        with self._lock:
+            if version != self._user_version(user_id):
+                return sets
+            self._users[user_id] = (now + self.ttl, sets)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return sets
+
+    def relations(self, user_id, image_ids):
+        sets = self._get(user_id)
+        with self._lock:
+            self._prune_removed()
+            return {image_id: {kind: image_id not in self._removed and image_id in sets[kind] for kind in KINDS}
+                    for image_id in image_ids}
+
+    def update(self, kind, user_id, image_id, present):
+        # 只更新已经缓存的用户, 没有缓存的等下次读取时再从数据库加载
+        with self._lock:
+            if len(self._versions) >= self.max_users:
+                self._versions.clear()
+                self._epoch += 1
+            self._sequence += 1
+            self._versions[user_id] = self._sequence
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            if present:
+                entry[1][kind].add(image_id)
+            else:
+                entry[1][kind].discard(image_id)
+
+    def _prune_removed(self):
+        # 调用方持有锁
+        deadline = time.monotonic() - self.ttl
+        while self._removed and next(iter(self._removed.values())) < deadline:
+            self._removed.popitem(last=False)
+
+    def remove_image(self, image_id):
+        with self._lock:
+            self._removed[image_id] = time.monotonic()
+            self._removed.move_to_end(image_id)
+
+
+class RedisBackend(object):
+    # 每个用户每种关系一个 Redis 集合; 集合中固定放一个成员 0 (壁纸 id 从 1 开始),
+    # 用来区分 "已加载但为空" 和 "还没有加载"
+
+    LOADED = 0
+
+    def __init__(self, url, ttl):
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(kind, user_id):
+        return f'relations:{kind}:{user_id}'
+
+    def _load(self, user_id):
+        ids = _load_from_db(user_id)
+        pipe = self._redis.pipeline()
+        for kind in KINDS:
+            key = self._key(kind, user_id)
+            pipe.sadd(key, self.LOADED, *ids[kind])
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+        return ids
+
+    def relations(self, user_id, image_ids):
+        image_ids = list(image_ids)
+        pipe = self._redis.pipeline()
+        for kind in KINDS:
+            pipe.smismember(self._key(kind, user_id), [self.LOADED] + image_ids)
+        flags = dict(zip(KINDS, pipe.execute()))
+        if not all(flags[kind][0] for kind in KINDS):
+            ids = {kind: set(values) for kind, values in self._load(user_id).items()}
+            flags = {kind: [True] + [image_id in ids[kind] for image_id in image_ids] for kind in KINDS}
+        return {image_id: {kind: bool(flags[kind][i + 1]) for kind in KINDS}
+                for i, image_id in enumerate(image_ids)}
+
+    def update(self, kind, user_id, image_id, present):
+        key = self._key(kind, user_id)
+        # 集合还没有加载时不写入, 否则会留下一个缺少其他成员的集合
+        if not self._redis.sismember(key, self.LOADED):
+            return
+        if present:
+            self._redis.sadd(key, image_id)
+        else:
+            self._redis.srem(key, image_id)
+
+    def remove_image(self, image_id):
+        # 已删除的壁纸不会再出现在列表中, Redis 中残留的成员随过期时间清除
+        pass
+
+
+class RelationCache(object):
+
+    def __init__(self):
+        self._backend = None
+        self._config = {}
+
+    def init_app(self, app):
+        self._config = app.config
+        self._backend = None
+
+    def _get_backend(self):
+        if self._backend is None:
+            ttl = self._config.get('RELATION_CACHE_TTL', 60)
+            url = self._config.get('RELATION_CACHE_REDIS_URL')
+            if url and redis is not None:
+                self._backend = RedisBackend(url, ttl)
+            else:
+                self._backend = LocalBackend(self._config.get('RELATION_CACHE_SIZE', 10000), ttl)
+        return self._backend
+
+    def relations(self, user_id, image_ids):
+        """
+        查询用户和一组壁纸的关系。
+
+        :return: {image_id: {'is_liked': bool, 'is_collected': bool}}
+        """
+        return self._get_backend().relations(int(user_id), [int(image_id) for image_id in image_ids])
+
+    def update(self, kind, user_id, image_id, present):
+        # 喜欢/收藏 切换提交成功后调用, kind 为 'is_liked' 或 'is_collected'
+        self._get_backend().update(kind, int(user_id), int(image_id), present)
+
+    def remove_image(self, image_id):
+        self._get_backend().remove_image(int(image_id))
+
+
+relation_cache = RelationCache()
@@ -0,0 +1,375 @@
+# response_cache.py
+# 公共读接口的响应缓存
+# 两级缓存:
+# - 进程内 LRU, 标签版本号也在进程内缓存 RESPONSE_CACHE_VERSION_TTL 秒, 此期间内命中时不需要任何网络请求
+# - 共享后端: 配置 RESPONSE_CACHE_REDIS_URL 时使用 Redis (多个进程共享), 否则使用进程内的 LocalStore
+# 每个缓存项带有依赖标签, 如 'image:42' / 'topic:*'; 每个标签在共享后端中有一个版本号,
+# 缓存项保存写入时各标签的版本号, 读取时版本号不一致就视为失效; 本进程的修改立即生效,
+# 其他进程的修改最多延迟 RESPONSE_CACHE_VERSION_TTL 秒。
+# 写接口调用 invalidate('image:42') 只会让依赖该图片的缓存项失效, 同时会让 'image:*'
+# (依赖任意图片的列表) 失效; 不需要遍历或删除缓存项, 过期的缓存项由 LRU 和 TTL 自然淘汰。
+# 缓存过期时不让所有并发请求同时重新计算: 同一个缓存键只有一个请求执行视图 (其他请求等待结果),
+# 刚过期的缓存项先返回旧值并在后台刷新; 命中率、合并率和重新计算耗时通过 metrics 查看。
+# 与 conditional (utils/conditional.py) 一起使用时, 缓存项同时保存计算时的 ETag, 返回缓存内容时带上这个 ETag,
+# 不会把旧内容和数据库当前水位的 ETag 一起返回
+import functools
+import json
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+
+from flask import copy_current_request_context, current_app, g, make_response, request
+
+try:
+    import redis  # 可选依赖, 仅在配置了 RESPONSE_CACHE_REDIS_URL 时使用
+except ImportError:
+    redis = None
+
+# 等待其他请求重新计算的最长时间 (秒), 超时后自己计算
+WAIT_TIMEOUT = 10
+# 进程内缓存的标签版本号超过这个数量时清空
+MAX_VERSION_ENTRIES = 10000
+
+
+class LocalStore(object):
+    # 进程内的共享后端, 接口与 RedisStore 相同, 未配置 Redis 时使用, 也可以在测试中替代 Redis
+
+    def __init__(self, max_entries=10000):
+        self._lock = threading.Lock()
+        # 标签 -> 版本号, 不淘汰 (淘汰后版本号回到 0, 旧的缓存项会重新生效)
+        self._versions = {}
+        # key -> (过期时间, 值), 按写入顺序淘汰
+        self._values = OrderedDict()
+        self.max_entries = max_entries
+
+    def get_versions(self, tags):
+        with self._lock:
+            return [self._versions.get(tag, 0) for tag in tags]
+
+    def incr_versions(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._versions[tag] = self._versions.get(tag, 0) + 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+            return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._values[key] = (time.monotonic() + ttl, value)
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+
+class RedisStore(object):
+
+    def __init__(self, url):
+        self._redis = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _version_key(tag):
+        return 'response_cache:tag:' + tag
+
+    def get_versions(self, tags):
+        if not tags:
+            return []
+        return [int(value) if value is not None else 0
+                for value in self._redis.mget([self._version_key(tag) for tag in tags])]
+
+    def incr_versions(self, tags):
+        pipe = self._redis.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(self._version_key(tag))
+        pipe.execute()
+
+    def get(self, key):
+        return self._redis.get('response_cache:' + key)
+
+    def set(self, key, value, ttl):
+        self._redis.set('response_cache:' + key, value, ex=ttl)
+
+
+def _expand(tags):
+    # 'image:42' 同时让 'image:*' 失效
+    expanded = set()
+    for tag in tags:
+        expanded.add(tag)
+        if ':' in tag:
+            expanded.add(tag.split(':', 1)[0] + ':*')
+    return expanded
+
+
+def _encode(entry):
+    expires, versions, mimetype, body, etag = entry
+    return json.dumps([expires, versions, mimetype, etag]).encode('utf-8') + b'\n' + body
+
+
+def _decode(value):
+    head, body = value.split(b'\n', 1)
+    expires, versions, mimetype, *etag = json.loads(head)
+    return expires, versions, mimetype, body, etag[0] if etag else None
+
+
+def _respond(mimetype, body, state, status=200, etag=None):
+    response = make_response(body, status)
+    response.mimetype = mimetype
+    response.headers['X-Cache'] = state
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+class Flight(object):
+    # 一次正在进行的重新计算, 同一个缓存键的并发请求等待它的结果 (single-flight)
+
+    __slots__ = ('done', 'result')
+
+    def __init__(self):
+        self.done = threading.Event()
+        # (状态码, mimetype, body, ETag), 计算失败时为 None
+        self.result = None
+
+
+class Metrics(object):
+    # 命中/合并/重新计算的次数, 以及最近若干次重新计算的耗时
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+        self._latencies = deque(maxlen=window)
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            counts = Counter(self._counts)
+            latencies = sorted(self._latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        served = counts['hits'] + counts['stale_hits'] + counts['coalesced']
+        computed = counts['misses'] + counts['coalesced']
+        return {
+            'hits': counts['hits'],
+            'stale_hits': counts['stale_hits'],
+            'misses': counts['misses'],
+            'coalesced': counts['coalesced'],
+            'refreshes': counts['refreshes'],
+            'refresh_errors': counts['refresh_errors'],
+            # 不需要自己执行视图的请求占比
+            'hit_rate': round(served / (served + counts['misses']), 4) if served + counts['misses'] else None,
+            # 缓存未命中时, 等待其他请求的计算结果而不是自己计算的占比
+            'coalesce_rate': round(counts['coalesced'] / computed, 4) if computed else None,
+            'refresh_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                           'max': round(latencies[-1] * 1000, 2) if latencies else None},
+        }
+
+
+class ResponseCache(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> (过期时间, 标签版本号, mimetype, body, ETag), 按最近使用排序
+        self._local = OrderedDict()
+        # (key, 标签版本号) -> 正在进行的重新计算
+        self._flights = {}
+        # 标签 -> (读取时间, 版本号)
+        self._versions = {}
+        self._store = None
+        self.metrics = Metrics()
+        self.max_entries = 2000
+        self.ttl = 60
+        self.stale_ttl = 30
+        self.version_ttl = 1
+
+    def init_app(self, app, store=None):
+        """
+        :param store: 共享后端, 默认按 RESPONSE_CACHE_REDIS_URL 选择 RedisStore 或 LocalStore
+        """
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', self.max_entries)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', self.ttl)
+        self.stale_ttl = app.config.get('RESPONSE_CACHE_STALE_TTL', self.stale_ttl)
+        self.version_ttl = app.config.get('RESPONSE_CACHE_VERSION_TTL', self.version_ttl)
+        url = app.config.get('RESPONSE_CACHE_REDIS_URL')
+        if store is None:
+            store = RedisStore(url) if url and redis is not None else LocalStore()
+        self._store = store
+        with self._lock:
+            self._local.clear()
+            self._versions.clear()
+
+    def _get_store(self):
+        if self._store is None:
+            self._store = LocalStore()
+        return self._store
+
+    def _get_versions(self, tags):
+        # 优先使用进程内缓存的标签版本号, 过期后再从共享后端读取
+        now = time.monotonic()
+        with self._lock:
+            cached = [self._versions.get(tag) for tag in tags]
+        if all(entry is not None and now - entry[0] < self.version_ttl for entry in cached):
+            return [entry[1] for entry in cached]
+        versions = self._get_store().get_versions(tags)
+        with self._lock:
+            if len(self._versions) > MAX_VERSION_ENTRIES:
+                self._versions.clear()
+            for tag, version in zip(tags, versions):
+                self._versions[tag] = (now, version)
+        return versions
+
+    def _lookup(self, key):
+        # 先查进程内, 再查共享后端; 返回的缓存项可能已经过期或失效, 由调用方判断
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None:
+                self._local.move_to_end(key)
+                return entry
+        value = self._get_store().get(key)
+        if value is None:
+            return None
+        entry = _decode(value)
+        self._put_local(key, entry)
+        return entry
+
+    def _put_local(self, key, entry):
+        with self._lock:
+            self._local[key] = entry
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def _compute(self, view, args, kwargs, key, versions, etag):
+        # 执行视图, 成功的响应写入缓存 (过期之后 stale_ttl 秒内仍可作为旧值返回)
+        started = time.monotonic()
+        response = make_response(view(*args, **kwargs))
+        self.metrics.observe(time.monotonic() - started)
+        if response.status_code == 200 and not response.is_streamed:
+            entry = (time.time() + self.ttl, versions, response.mimetype, response.get_data(), etag)
+            self._put_local(key, entry)
+            self._get_store().set(key, _encode(entry), self.ttl + self.stale_ttl)
+        return response
+
+    def _take_off(self, flight_key):
+        # 返回 (flight, 是否由当前请求负责计算)
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[flight_key] = Flight()
+            return flight, True
+
+    def _land(self, flight_key, flight, response, etag):
+        if response is not None and not response.is_streamed:
+            flight.result = (response.status_code, response.mimetype, response.get_data(), etag)
+        with self._lock:
+            self._flights.pop(flight_key, None)
+        flight.done.set()
+
+    def _refresh_in_background(self, view, args, kwargs, key, versions, etag):
+        flight_key = (key, tuple(versions))
+        flight, leader = self._take_off(flight_key)
+        if not leader:
+            # 已经有请求在刷新
+            return
+        self.metrics.incr('refreshes')
+
+        @copy_current_request_context
+        def refresh():
+            response = None
+            try:
+                response = self._compute(view, args, kwargs, key, versions, etag)
+            except Exception:
+                self.metrics.incr('refresh_errors')
+                current_app.logger.exception('响应缓存刷新失败')
+            finally:
+                self._land(flight_key, flight, response, etag)
+
+        threading.Thread(target=refresh, name='response-cache-refresh', daemon=True).start()
+
+    def invalidate(self, *tags, expand=True):
+        """
+        让依赖这些标签的缓存项失效, 写操作提交成功后调用。
+
+        :param expand: 为 False 时 'image:42' 不同时让 'image:*' 失效
+        """
+        if tags:
+            expanded = sorted(_expand(tags) if expand else set(tags))
+            self._get_store().incr_versions(expanded)
+            with self._lock:
+                for tag in expanded:
+                    self._versions.pop(tag, None)
+
+    def cached(self, tags):
+        """
+        缓存 GET 接口的响应, 缓存键为完整路径 (包含查询参数), 只缓存状态码为 200 的响应。
+        - 过期不超过 stale_ttl 秒的缓存项直接返回旧值, 同时在后台线程中刷新 (stale-while-revalidate)
+        - 缓存未命中或已失效时, 同一个缓存键只有一个请求执行视图, 并发的请求等待它的结果 (single-flight)
+        响应头 X-Cache 为 HIT / STALE / COALESCED / MISS; 返回缓存内容时 ETag 为缓存项计算时的 ETag。
+
+        :param tags: 依赖标签的列表, 或者接收路由参数、返回标签列表的函数
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                entry_tags = sorted(tags(**kwargs) if callable(tags) else tags)
+                key = request.full_path
+                # conditional 根据执行视图之前的数据库水位计算的 ETag, 和响应内容一起缓存
+                etag = g.get('conditional_etag')
+                # 在执行视图之前读取版本号: 执行期间发生的修改会让本次写入的缓存项立即失效
+                versions = self._get_versions(entry_tags)
+                entry = self._lookup(key)
+                now = time.time()
+                # 标签版本号变化 (数据被修改) 的缓存项不能作为旧值返回
+                if entry is not None and entry[1] == versions:
+                    if now < entry[0]:
+                        self.metrics.incr('hits')
+                        return _respond(entry[2], entry[3], 'HIT', etag=entry[4])
+                    if now < entry[0] + self.stale_ttl:
+                        self._refresh_in_background(view, args, kwargs, key, versions, etag)
+                        self.metrics.incr('stale_hits')
+                        return _respond(entry[2], entry[3], 'STALE', etag=entry[4])
+
+                flight_key = (key, tuple(versions))
+                flight, leader = self._take_off(flight_key)
+                if not leader:
+                    if flight.done.wait(WAIT_TIMEOUT) and flight.result is not None:
+                        self.metrics.incr('coalesced')
+                        status, mimetype, body, flight_etag = flight.result
+                        return _respond(mimetype, body, 'COALESCED', status, flight_etag)
+                    # 等待超时或计算失败时自己计算
+                    self.metrics.incr('misses')
+                    response = self._compute(view, args, kwargs, key, versions, etag)
+                else:
+                    self.metrics.incr('misses')
+                    response = None
+                    try:
+                        response = self._compute(view, args, kwargs, key, versions, etag)
+                    finally:
+                        self._land(flight_key, flight, response, etag)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+    def invalidate_counted(self, counted):
+        # 计数写回之后调用, counted 为 {(模型, id): {列: 增量}}, 依赖这些行的缓存项失效;
+        # 只有模型的 UNCACHED_COUNTERS 变化时不失效, 这些计数在缓存有效期内允许是旧值。
+        # 计数每隔几秒就会写回一次, 只让单行的缓存项失效, 热门榜等列表 ('image:*') 按缓存有效期刷新
+        self.invalidate(*(f'{model.__tablename__}:{row_id}' for (model, row_id), counts in counted.items()
+                          if set(counts) - set(getattr(model, 'UNCACHED_COUNTERS', ()))), expand=False)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,165 @@
+# search_index.py
+# 壁纸搜索用的进程内倒排索引
+# 对 名称 / 描述(alt) / 标签名 建索引, 中文按二元组 (bigram) 和单字切分, 英文和数字按单词切分,
+# 查询时只访问命中词项的倒排表, 耗时与命中数量相关, 与壁纸总量无关。
+# 每隔 SEARCH_INDEX_TTL 秒从数据库重建一次, 同步其他进程的上传/删除和最新的热度值;
+# 同一时间只有一个请求重建, 其他请求继续使用旧的索引。只索引可见 (未下架) 的壁纸
+import math
+import re
+import threading
+import time
+
+from extensions import db
+
+# 中文字符 (含中日韩统一表意文字扩展A) 和 英文/数字 的连续片段
+_TOKEN_RE = re.compile(r'[㐀-䶿一-鿿]+|[0-9a-z]+')
+_CJK_RE = re.compile(r'[㐀-䶿一-鿿]')
+
+
+def tokenize(text, unigrams=False):
+    """
+    将文本切分为词项: 中文片段切为二元组 (单个汉字保留为一元), 其余按单词。
+
+    :param unigrams: 建索引时为 True, 中文片段的每个汉字也作为词项, 单字查询才能命中较长的词
+    """
+    tokens = []
+    for chunk in _TOKEN_RE.findall((text or '').lower()):
+        if _CJK_RE.match(chunk):
+            if len(chunk) == 1 or unigrams:
+                tokens.extend(chunk)
+            if len(chunk) > 1:
+                tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+        else:
+            tokens.append(chunk)
+    return tokens
+
+
+class SearchIndex(object):
+    # 各字段命中时的权重
+    FIELD_WEIGHTS = {'name': 3.0, 'alt': 2.0, 'tags': 1.5}
+    # 热度对排序的影响系数
+    POPULARITY_WEIGHT = 0.1
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 同一时间只有一个线程重建
+        self._load_lock = threading.Lock()
+        self._loaded_at = None
+        # 每次增量修改加一, 重建期间有修改时不替换 (重建的结果可能缺少这次修改), 下次查询再重建
+        self._version = 0
+        # 词项 -> {image_id: 权重}
+        self._postings = {}
+        # image_id -> (该图片的词项集合, 热度值)
+        self._docs = {}
+        self.ttl = 300
+
+    def init_app(self, app):
+        self.ttl = app.config.get('SEARCH_INDEX_TTL', self.ttl)
+
+    def _is_fresh(self):
+        loaded_at = self._loaded_at
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    # 第一次使用时, 以及距上次构建超过 ttl 秒时从数据库全量构建
+    def ensure_loaded(self):
+        if self._is_fresh():
+            return
+        # 第一次构建时需要等待; 已有旧索引时正在重建就直接使用旧索引
+        if not self._load_lock.acquire(blocking=self._loaded_at is None):
+            return
+        try:
+            if self._is_fresh():
+                return
+            self._rebuild()
+        finally:
+            self._load_lock.release()
+
+    def _rebuild(self):
+        from model.index import Image, Tag, image_tags
+
+        version = self._version
+        postings, docs = {}, {}
+        tags = {}
+        for image_id, tag_name in (db.session.query(image_tags.c.image_id, Tag.name)
+                                   .join(Tag, Tag.id == image_tags.c.tag_id)):
+            tags.setdefault(image_id, []).append(tag_name)
+        visible = Image.visible().with_entities(Image.id, Image.name, Image.alt, Image.heat_score)
+        for image_id, name, alt, heat_score in visible:
+            self._add(postings, docs, image_id, name, alt, tags.get(image_id, []), heat_score)
+        with self._lock:
+            if version == self._version or self._loaded_at is None:
+                self._postings, self._docs = postings, docs
+                self._loaded_at = time.monotonic()
+
+    # 新增或更新一张图片; 索引还未构建时忽略, 构建时会从数据库读到它
+    def add(self, image_id, name, alt, tags=(), popularity=0):
+        with self._lock:
+            self._version += 1
+            if self._loaded_at is not None:
+                self._add(self._postings, self._docs, image_id, name, alt, tags, popularity)
+
+    def remove(self, image_id):
+        with self._lock:
+            self._version += 1
+            self._remove(self._postings, self._docs, image_id)
+
+    @classmethod
+    def _add(cls, postings, docs, image_id, name, alt, tags, popularity):
+        cls._remove(postings, docs, image_id)
+        weights = {}
+        for field, text in (('name', name), ('alt', alt), ('tags', ' '.join(tags))):
+            for token in tokenize(text, unigrams=True):
+                weights[token] = weights.get(token, 0) + cls.FIELD_WEIGHTS[field]
+        for token, weight in weights.items():
+            postings.setdefault(token, {})[image_id] = weight
+        docs[image_id] = (set(weights), popularity or 0)
+
+    @staticmethod
+    def _remove(postings, docs, image_id):
+        doc = docs.pop(image_id, None)
+        if doc is None:
+            return
+        for token in doc[0]:
+            posting = postings.get(token)
+            if posting is not None:
+                posting.pop(image_id, None)
+                if not posting:
+                    del postings[token]
+
+    def search(self, keyword, offset=0, limit=20):
+        """
+        按相关度 (命中字段权重 * idf, 并按命中词项比例加权) 结合热度排序。
+
+        :return: (当前页的图片 id 列表, 命中总数)
+        """
+        self.ensure_loaded()
+        query_tokens = set(tokenize(keyword))
+        if not query_tokens:
+            return [], 0
+
+        with self._lock:
+            total_docs = max(len(self._docs), 1)
+            scores = {}
+            matched = {}
+            for token in query_tokens:
+                posting = self._postings.get(token)
+                if not posting:
+                    continue
+                idf = math.log(1 + total_docs / len(posting))
+                for image_id, weight in posting.items():
+                    scores[image_id] = scores.get(image_id, 0) + weight * idf
+                    matched[image_id] = matched.get(image_id, 0) + 1
+
+            ranked = []
+            for image_id, score in scores.items():
+                coverage = matched[image_id] / len(query_tokens)
+                popularity = self._docs[image_id][1]
+                boost = 1 + self.POPULARITY_WEIGHT * math.log1p(max(popularity, 0))
+                ranked.append((score * coverage * coverage * boost, image_id))
+
+        ranked.sort(reverse=True)
+        return [image_id for _, image_id in ranked[offset:offset + limit]], len(ranked)
+
+
+# 每个进程一份
+search_index = SearchIndex()
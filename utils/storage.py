@@ -0,0 +1,112 @@
+# storage.py
+# 按内容寻址的上传文件存储
+# 上传的数据流一边写入临时文件一边计算 SHA-256, 同时把开头的数据交给 Pillow 解析出尺寸和格式,
+# 整个文件只读一遍; 最终文件名就是内容哈希, 并按哈希前缀分成两级子目录:
+#   static/objects/ab/cd/abcd....jpg
+# 相同内容的文件只会存一份, 重复上传时直接返回已有的文件
+import hashlib
+import os
+import re
+import tempfile
+from collections import namedtuple
+from urllib.parse import unquote, urlparse
+
+from flask import current_app
+from PIL import ImageFile
+from werkzeug.security import safe_join
+
+STATIC_FOLDER = 'static'
+OBJECT_FOLDER = os.path.join(STATIC_FOLDER, 'objects')
+CHUNK_SIZE = 64 * 1024
+# 读到这么多数据还解析不出图片头, 就不再交给 Pillow, 避免把整个文件缓存在内存里
+MAX_HEADER_BYTES = 1024 * 1024
+# Pillow 格式名 -> 文件扩展名
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif', 'WEBP': 'webp'}
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+
+StoredFile = namedtuple('StoredFile', ['path', 'sha256', 'size', 'width', 'height', 'format', 'mode', 'created'])
+
+
+def store_upload(stream):
+    """
+    保存上传的图片数据流。
+
+    :param stream: 可读的二进制流, 如 FileStorage.stream
+    :return: StoredFile, created 为 False 表示相同内容已经存在, 本次没有写入
+    :raises ValueError: 数据不是支持的图片格式
+    """
+    os.makedirs(OBJECT_FOLDER, exist_ok=True)
+    sha256 = hashlib.sha256()
+    parser = ImageFile.Parser()
+    size = 0
+
+    fd, tmp_path = tempfile.mkstemp(dir=OBJECT_FOLDER, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+                out.write(chunk)
+                # 只需要图片头: 解析出来之后不再继续喂数据 (否则 Pillow 会开始解码像素)
+                if parser.image is None and size < MAX_HEADER_BYTES:
+                    parser.feed(chunk)
+                size += len(chunk)
+
+        image = parser.image
+        if image is None or image.format not in EXTENSIONS:
+            raise ValueError('无法识别的图片格式')
+
+        digest = sha256.hexdigest()
+        path = object_path(digest, EXTENSIONS[image.format])
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        else:
+            os.remove(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    width, height = image.size
+    return StoredFile(path, digest, size, width, height, image.format, image.mode, created)
+
+
+def object_path(digest, extension):
+    return os.path.join(OBJECT_FOLDER, digest[:2], digest[2:4], f'{digest}.{extension}')
+
+
+def hash_from_url(url):
+    # 从内容寻址文件的地址中取回哈希, 旧的 时间戳+文件名 地址返回 None
+    stem = os.path.splitext(os.path.basename(url or ''))[0]
+    return stem if _HASH_RE.match(stem) else None
+
+
+def stored_object_path(url):
+    # url 指向本服务保存的上传文件 (static/objects 下按内容哈希命名) 时返回本地路径, 否则返回 None
+    digest = hash_from_url(url)
+    if digest is None:
+        return None
+    extension = os.path.splitext(urlparse(url).path)[1].lstrip('.')
+    path = object_path(digest, extension)
+    return path if local_path(url) == path and os.path.exists(path) else None
+
+
+def public_url(path):
+    # 本地文件路径 (static/...) 对外访问的地址
+    return current_app.config['STATIC_BASE_URL'].rstrip('/') + '/' + path.replace(os.sep, '/')
+
+
+def local_path(url):
+    # 把 public_url 生成的地址转换为本地文件路径; 只接受 static 目录下的文件,
+    # 其他地址 (包括用 ../ 跳出 static 目录的) 返回 None
+    path = unquote(urlparse(url or '').path).lstrip('/')
+    prefix = STATIC_FOLDER + '/'
+    if not path.startswith(prefix):
+        return None
+    full_path = safe_join(STATIC_FOLDER, path[len(prefix):])
+    return os.path.join(*full_path.split('/')) if full_path else None
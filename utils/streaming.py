@@ -0,0 +1,104 @@
+# streaming.py
+# 大列表的流式 JSON 响应
+# 查询按主键分批读取 (id > 上一批最后的 id ORDER BY id LIMIT n), 每批完整取回后再处理,
+# 批与批之间可以在同一个连接上执行其他查询 (如批量加载作者); 每一行编码后立即写出, 不在内存中拼出完整的列表,
+# 处理下一批之前丢弃请求级的用户缓存, 内存占用与结果的总行数无关, 客户端也能更早收到第一个字节。
+# 安装了 orjson 时用它编码, 否则退回标准库 json; 日期等类型的格式与 jsonify 一致
+import json
+
+from flask import Response, request, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+from utils.loaders import clear_user_cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 每次从数据库读取的行数
+BATCH_SIZE = 500
+# 攒够这么多字节再写出一次, 避免每一行都是一次很小的写操作
+CHUNK_SIZE = 64 * 1024
+
+_default = DefaultJSONProvider.default
+
+
+def dumps(obj):
+    # 编码为 bytes
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def iter_batches(query, key, batch_size=BATCH_SIZE):
+    """
+    按主键从小到大分批读取查询结果, 每批是一个 list, 便于按批预加载关联数据。
+
+    :param key: 主键列 (如 Image.id), 必须包含在查询的列中
+    """
+    last = None
+    while True:
+        batch_query = query.order_by(None).order_by(key)
+        if last is not None:
+            batch_query = batch_query.filter(key > last)
+        batch = batch_query.limit(batch_size).all()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last = getattr(batch[-1], key.key)
+        clear_user_cache()
+
+
+def _chunks(parts):
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _json_parts(items, key, envelope):
+    # {"...envelope", "key": [item, item, ...]}
+    head = dumps(envelope or {})
+    yield head[:-1] + (b',' if len(head) > 2 else b'') + dumps(key) + b':['
+    first = True
+    for item in items:
+        yield dumps(item) if first else b',' + dumps(item)
+        first = False
+    yield b']}'
+
+
+def _ndjson_parts(items):
+    for item in items:
+        yield dumps(item) + b'\n'
+
+
+def stream_json(items, key, envelope=None, ndjson=False, status=200):
+    """
+    流式返回 JSON 响应。
+
+    :param items: 字典的可迭代对象 (通常是生成器), 在写出响应的过程中才逐个生成,
+                  查询需要放在生成器里执行, 请求上下文由 stream_with_context 保持
+    :param key: 列表在响应中的字段名
+    :param envelope: 响应中的其他字段, 写在列表之前
+    :param ndjson: 为 True 时每行一个 JSON 对象 (application/x-ndjson), 不包含 envelope
+    """
+    if ndjson:
+        parts, mimetype = _ndjson_parts(items), 'application/x-ndjson'
+    else:
+        parts, mimetype = _json_parts(items, key, envelope), 'application/json'
+    return Response(stream_with_context(_chunks(parts)), status=status, mimetype=mimetype)
+
+
+def wants_ndjson():
+    # ?format=ndjson
+    return request.args.get('format') == 'ndjson'
@@ -0,0 +1,168 @@
+# tag_index.py
+# 按标签组合筛选壁纸用的位图索引
+# 每个标签一个位图 (Python 的 int 当作位集合, 第 i 位为 1 表示 id 为 i 的壁纸带有该标签),
+# 壁纸 id 是自增的、分布紧凑, 一万张壁纸每个标签只占约 1.2KB;
+# AND / OR / NOT 就是位运算, 统计其他标签的数量 (facet) 是一次按位与加 bit_count,
+# 耗时与壁纸总数的位数成正比, 不需要访问数据库。
+# 只包含可见 (未下架) 的壁纸; 每隔 TAG_INDEX_TTL 秒从数据库重建, 同步其他进程的保存/删除和状态变化,
+# 同一时间只有一个请求重建, 其他请求继续使用旧的索引
+import threading
+import time
+
+from extensions import db
+
+
+def _ids_desc(bits, limit):
+    # 从大到小取出位集合中的前 limit 个 id
+    ids = []
+    while bits and len(ids) < limit:
+        image_id = bits.bit_length() - 1
+        ids.append(image_id)
+        bits ^= 1 << image_id
+    return ids
+
+
+class TagIndex(object):
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 同一时间只有一个线程重建
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._loaded_at = 0
+        # 每次增量修改加一, 重建期间有修改时不替换, 下次查询再重建
+        self._version = 0
+        self.ttl = 60
+        # tag_id -> 位集合
+        self._bitmaps = {}
+        # 所有壁纸, 用于 NOT
+        self._all = 0
+        # 标签名 -> tag_id
+        self._tag_ids = {}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('TAG_INDEX_TTL', self.ttl)
+
+    def _is_fresh(self):
+        return self._loaded and time.monotonic() - self._loaded_at < self.ttl
+
+    def ensure_loaded(self):
+        if self._is_fresh():
+            return
+        # 第一次加载时需要等待; 已有旧索引时正在重建就直接使用旧索引
+        if not self._load_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if not self._is_fresh():
+                self._rebuild()
+        finally:
+            self._load_lock.release()
+
+    def _rebuild(self):
+        from model.index import Image, Tag, image_tags
+
+        version = self._version
+        tag_ids = {}
+        bitmaps = {}
+        for tag_id, name in db.session.query(Tag.id, Tag.name):
+            tag_ids[name] = tag_id
+            bitmaps[tag_id] = 0
+        visible = Image.visible().with_entities(Image.id).subquery()
+        for image_id, tag_id in (db.session.query(image_tags.c.image_id, image_tags.c.tag_id)
+                                 .join(visible, visible.c.id == image_tags.c.image_id)):
+            bitmaps[tag_id] = bitmaps.get(tag_id, 0) | (1 << image_id)
+        universe = 0
+        for image_id, in db.session.query(visible.c.id):
+            universe |= 1 << image_id
+        with self._lock:
+            if version == self._version or not self._loaded:
+                self._tag_ids = tag_ids
+                self._bitmaps = bitmaps
+                self._all = universe
+                self._loaded = True
+                self._loaded_at = time.monotonic()
+
+    def add(self, image_id, tag_ids):
+        # 保存壁纸后调用
+        with self._lock:
+            self._version += 1
+            if not self._loaded:
+                return
+            self._all |= 1 << image_id
+            for tag_id in tag_ids:
+                self._bitmaps[tag_id] = self._bitmaps.get(tag_id, 0) | (1 << image_id)
+
+    def remove(self, image_id):
+        # 删除壁纸后调用
+        with self._lock:
+            self._version += 1
+            if not self._loaded:
+                return
+            mask = ~(1 << image_id)
+            self._all &= mask
+            for tag_id, bits in self._bitmaps.items():
+                if bits >> image_id & 1:
+                    self._bitmaps[tag_id] = bits & mask
+
+    def resolve(self, names):
+        """
+        标签名转换为 tag_id, 不存在的标签返回 None。
+        """
+        from model.index import Tag
+
+        self.ensure_loaded()
+        tag_ids = []
+        for name in names:
+            tag_id = self._tag_ids.get(name)
+            if tag_id is None:
+                # 索引加载之后新建的标签
+                tag = Tag.query.filter_by(name=name).first()
+                if tag is not None:
+                    with self._lock:
+                        self._tag_ids[name] = tag_id = tag.id
+            tag_ids.append(tag_id)
+        return tag_ids
+
+    def filter(self, all_of=(), any_of=(), none_of=(), before=None, limit=20):
+        """
+        按标签组合筛选壁纸, 结果按 id 从大到小 (最新上传的在前)。
+
+        :param all_of: 必须同时带有的 tag_id (AND)
+        :param any_of: 至少带有其中一个的 tag_id (OR)
+        :param none_of: 不能带有的 tag_id (NOT)
+        :param before: 只返回 id 小于该值的壁纸, 用于翻页
+        :return: (当前页的 image_id 列表, 总数, 是否还有下一页, {tag_id: 结果中带有该标签的数量})
+        """
+        self.ensure_loaded()
+        with self._lock:
+            bits = self._all
+            for tag_id in all_of:
+                bits &= self._bitmaps.get(tag_id, 0)
+            if any_of:
+                union = 0
+                for tag_id in any_of:
+                    union |= self._bitmaps.get(tag_id, 0)
+                bits &= union
+            for tag_id in none_of:
+                bits &= ~self._bitmaps.get(tag_id, 0)
+
+            total = bits.bit_count()
+            facets = {tag_id: (bits & tag_bits).bit_count() for tag_id, tag_bits in self._bitmaps.items()}
+
+        if before is not None:
+            # before 来自客户端的游标: 超出最大 id 的部分没有意义, 避免构造巨大的掩码
+            before = max(0, min(before, bits.bit_length()))
+            page_bits = bits & ((1 << before) - 1)
+        else:
+            page_bits = bits
+        ids = _ids_desc(page_bits, limit + 1)
+        return ids[:limit], total, len(ids) > limit, facets
+
+    def tag_names(self):
+        self.ensure_loaded()
+        with self._lock:
+            return {tag_id: name for name, tag_id in self._tag_ids.items()}
+
+
+# 每个进程一份
+tag_index = TagIndex()
@@ -0,0 +1,245 @@
+# timeline.py
+# 关注流: 我关注的人发的帖子
+# - 写扩散 (fan-out on write): 作者发帖后, 后台线程用一条 INSERT ... SELECT 把帖子写入每个粉丝的收件箱
+#   (Timeline_Entry), 作者自己的收件箱也写一份; 读取时只是一次 (user_id, created_at, post_id) 索引范围读
+# - 粉丝数超过 TIMELINE_FANOUT_LIMIT 的大V不做写扩散 (包括自己的收件箱), 读取时按作者取帖子与收件箱合并;
+#   粉丝数降回 TIMELINE_FANOUT_LIMIT 时, 把作为大V期间没有写扩散的帖子补写到粉丝的收件箱
+# - 每个收件箱最多保留约 TIMELINE_INBOX_SIZE 条, 在写入收件箱时裁掉更早的 (读取时不写库)
+# - 关注时补写对方最近的帖子, 取消关注时从收件箱中移除对方的帖子
+import threading
+
+from flask import current_app
+from sqlalchemy import and_, exists, literal, or_, union_all
+
+from extensions import db
+from utils.pagination import DEFAULT_LIMIT, encode_cursor, keyset_paginate
+
+DEFAULT_FANOUT_LIMIT = 5000
+DEFAULT_INBOX_SIZE = 800
+# 关注某人时补写对方最近的帖子数
+BACKFILL_SIZE = 20
+# 写扩散时只裁剪 (user_id + post_id) % TRIM_EVERY == 0 的收件箱, 每个收件箱平均每写入这么多条裁剪一次,
+# 不必每发一个帖子都检查所有粉丝的收件箱
+TRIM_EVERY = 50
+
+
+def _fanout_limit():
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT', DEFAULT_FANOUT_LIMIT)
+
+
+def _inbox_size():
+    return current_app.config.get('TIMELINE_INBOX_SIZE', DEFAULT_INBOX_SIZE)
+
+
+def publish(post):
+    # 帖子提交后调用: 普通作者在后台线程中写扩散, 大V的帖子在读取时合并
+    from model.index import User
+
+    author = db.session.get(User, post.user_id)
+    if author is None:
+        return
+    if (author.followers_count or 0) > _fanout_limit():
+        return
+    app = current_app._get_current_object()
+    threading.Thread(target=_fan_out_in_background, args=(app, post.id), daemon=True).start()
+
+
+def _fan_out_in_background(app, post_id):
+    with app.app_context():
+        try:
+            fan_out(post_id)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('关注流写扩散失败: post_id=%s', post_id)
+
+
+def _insert_entries(recipients, posts):
+    # 把 posts (post_id, author_id, created_at) 写入 recipients (user_id) 中每个人的收件箱, 跳过已有的
+    from model.index import Timeline_Entry
+
+    recipients = recipients.subquery()
+    posts = posts.subquery()
+    rows = (db.select(recipients.c.user_id, posts.c.post_id, posts.c.author_id, posts.c.created_at)
+            .join(posts, literal(True))
+            .where(~exists().where(Timeline_Entry.user_id == recipients.c.user_id,
+                                   Timeline_Entry.post_id == posts.c.post_id)))
+    db.session.execute(
+        Timeline_Entry.__table__.insert().from_select(['user_id', 'post_id', 'author_id', 'created_at'], rows)
+    )
+
+
+def fan_out(post_id):
+    """
+    把帖子写入作者和所有粉丝的收件箱, 一条 INSERT ... SELECT 完成;
+    已经有这条帖子的收件箱 (如关注时补写过) 跳过。
+    """
+    from model.index import Post, user_followers
+
+    post = db.session.get(Post, post_id)
+    if post is None or post.deleted_at is not None:
+        return
+    recipients = union_all(
+        db.select(literal(post.user_id).label('user_id')),
+        db.select(user_followers.c.follower_id.label('user_id')).where(user_followers.c.followed_id == post.user_id),
+    )
+    _insert_entries(recipients, db.select(literal(post.id).label('post_id'), literal(post.user_id).label('author_id'),
+                                          literal(post.created_at).label('created_at')))
+
+    # 裁剪本次轮到的收件箱
+    recipients = [post.user_id] + list(db.session.scalars(
+        db.select(user_followers.c.follower_id).where(user_followers.c.followed_id == post.user_id)
+    ))
+    for user_id in recipients:
+        if (user_id + post.id) % TRIM_EVERY == 0:
+            trim(user_id)
+    db.session.commit()
+
+
+def on_followers_decreased(author_id):
+    """
+    取消关注提交之后调用: 粉丝数刚好降到 TIMELINE_FANOUT_LIMIT 时, 在后台线程中补写作者成为大V期间的帖子。
+    """
+    from model.index import User
+
+    followers_count = db.session.scalar(db.select(User.followers_count).where(User.id == author_id))
+    if followers_count != _fanout_limit():
+        return
+    app = current_app._get_current_object()
+    threading.Thread(target=_backfill_in_background, args=(app, author_id), daemon=True).start()
+
+
+def _backfill_in_background(app, author_id):
+    with app.app_context():
+        try:
+            backfill_author(author_id)
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('关注流补写失败: author_id=%s', author_id)
+
+
+def backfill_author(author_id):
+    """
+    把作者没有写扩散过的帖子 (作者自己的收件箱中没有的) 写入作者和所有粉丝的收件箱,
+    最多取最近的 TIMELINE_INBOX_SIZE 条, 写入后裁剪这些收件箱并提交。
+    """
+    from model.index import Post, Timeline_Entry, User, user_followers
+
+    author = db.session.get(User, author_id)
+    if author is None or (author.followers_count or 0) > _fanout_limit():
+        return
+    missing = (db.select(Post.id.label('post_id'), Post.user_id.label('author_id'), Post.created_at)
+               .where(Post.user_id == author_id, Post.deleted_at.is_(None),
+                      ~exists().where(Timeline_Entry.user_id == author_id, Timeline_Entry.post_id == Post.id))
+               .order_by(Post.created_at.desc(), Post.id.desc())
+               .limit(_inbox_size()))
+    recipients = union_all(
+        db.select(literal(author_id).label('user_id')),
+        db.select(user_followers.c.follower_id.label('user_id')).where(user_followers.c.followed_id == author_id),
+    )
+    _insert_entries(recipients, missing)
+    for user_id in db.session.execute(recipients).scalars():
+        trim(user_id)
+    db.session.commit()
+
+
+def on_follow(follower_id, followed_id):
+    """
+    关注后补写对方最近的帖子 (对方是大V时读取时合并, 不用补写), 调用方负责提交。
+    """
+    from model.index import Post, Timeline_Entry, User
+
+    followed = db.session.get(User, followed_id)
+    if followed is None or (followed.followers_count or 0) > _fanout_limit():
+        return
+    existing = db.select(Timeline_Entry.post_id).where(Timeline_Entry.user_id == follower_id)
+    recent = (db.select(literal(follower_id), Post.id, Post.user_id, Post.created_at)
+              .where(Post.user_id == followed_id, Post.deleted_at.is_(None), Post.id.not_in(existing))
+              .order_by(Post.created_at.desc(), Post.id.desc())
+              .limit(BACKFILL_SIZE))
+    db.session.execute(
+        Timeline_Entry.__table__.insert().from_select(['user_id', 'post_id', 'author_id', 'created_at'], recent)
+    )
+    trim(follower_id)
+
+
+def on_unfollow(follower_id, followed_id):
+    # 取消关注后从收件箱中移除对方的帖子, 调用方负责提交
+    from model.index import Timeline_Entry
+
+    Timeline_Entry.query.filter(Timeline_Entry.user_id == follower_id,
+                                Timeline_Entry.author_id == followed_id).delete(synchronize_session=False)
+
+
+def trim(user_id):
+    # 只保留收件箱中最新的 TIMELINE_INBOX_SIZE 条, 调用方负责提交
+    from model.index import Timeline_Entry
+
+    boundary = (db.session.query(Timeline_Entry.created_at, Timeline_Entry.post_id)
+                .filter(Timeline_Entry.user_id == user_id)
+                .order_by(Timeline_Entry.created_at.desc(), Timeline_Entry.post_id.desc())
+                .offset(_inbox_size())
+                .first())
+    if boundary is None:
+        return 0
+    deleted = Timeline_Entry.query.filter(
+        Timeline_Entry.user_id == user_id,
+        or_(Timeline_Entry.created_at < boundary.created_at,
+            and_(Timeline_Entry.created_at == boundary.created_at, Timeline_Entry.post_id <= boundary.post_id))
+    ).delete(synchronize_session=False)
+    return deleted
+
+
+def _celebrity_ids(user_id):
+    # user_id 关注的大V, 以及 user_id 自己是大V时的自己 (不做写扩散, 需要读取时合并)
+    from model.index import User, user_followers
+
+    limit = _fanout_limit()
+    ids = set(db.session.scalars(
+        db.select(User.id)
+        .join(user_followers, user_followers.c.followed_id == User.id)
+        .where(user_followers.c.follower_id == user_id, User.followers_count > limit)
+    ))
+    user = db.session.get(User, user_id)
+    if user is not None and (user.followers_count or 0) > limit:
+        ids.add(user.id)
+    return ids
+
+
+def read(user_id, after=None, limit=DEFAULT_LIMIT):
+    """
+    按发布时间倒序分页读取关注流。
+
+    :param after: 上一页返回的 next_cursor
+    :return: (帖子列表, 下一页的游标 或 None)
+    :raises ValueError: 游标无效
+    """
+    from model.index import Post, Timeline_Entry
+
+    # 收件箱: 一次索引范围读, 过滤已软删除的帖子
+    inbox = (db.session.query(Timeline_Entry.post_id, Timeline_Entry.created_at)
+             .join(Post, Post.id == Timeline_Entry.post_id)
+             .filter(Timeline_Entry.user_id == user_id, Post.deleted_at.is_(None)))
+    inbox_rows, inbox_cursor = keyset_paginate(inbox, Timeline_Entry.created_at, Timeline_Entry.post_id,
+                                               after=after, limit=limit)
+    # (发布时间, 帖子 id)
+    rows = [(row.created_at, row.post_id) for row in inbox_rows]
+    has_more = inbox_cursor is not None
+
+    # 大V的帖子读取时合并
+    celebrity_ids = _celebrity_ids(user_id)
+    if celebrity_ids:
+        posts = db.session.query(Post.id, Post.created_at).filter(Post.user_id.in_(celebrity_ids),
+                                                                  Post.deleted_at.is_(None))
+        celebrity_rows, celebrity_cursor = keyset_paginate(posts, Post.created_at, Post.id,
+                                                           after=after, limit=limit)
+        has_more = has_more or celebrity_cursor is not None
+        # 大V以前写扩散过的帖子会同时出现在收件箱中, 去重
+        rows = sorted(set(rows) | {(row.created_at, row.id) for row in celebrity_rows}, reverse=True)
+        if len(rows) > limit:
+            rows = rows[:limit]
+            has_more = True
+
+    next_cursor = encode_cursor(*rows[-1]) if rows and has_more else None
+    post_ids = [post_id for _, post_id in rows]
+    posts = {post.id: post for post in Post.query.filter(Post.id.in_(post_ids))}
+    return Post.serializeFeed([posts[post_id] for post_id in post_ids if post_id in posts]), next_cursor
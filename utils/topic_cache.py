@@ -0,0 +1,71 @@
+# topic_cache.py
+# 话题字典缓存
+# 话题数量少、读取频繁 (侧边栏、帖子上的话题名), 一条查询取回所有话题的 名称/描述/浏览量/帖子数 放在内存中;
+# 创建话题、绑定话题、删除帖子后清空, 其他进程的缓存最多延迟 TOPIC_CACHE_TTL 秒;
+# 清空时 '/topics' 等接口的响应缓存也一起失效
+import threading
+import time
+
+from extensions import db
+from utils.response_cache import response_cache
+
+
+class TopicCache(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # topic_id -> 话题数据, 按 id 排序
+        self._topics = None
+        self._loaded_at = 0
+        # 每次清空加一, 加载期间被清空时不保存本次加载的结果
+        self._version = 0
+        self.ttl = 30
+
+    def init_app(self, app):
+        self.ttl = app.config.get('TOPIC_CACHE_TTL', self.ttl)
+
+    def _get(self):
+        topics = self._topics
+        if topics is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return topics
+        from model.index import Topic
+
+        version = self._version
+        rows = (db.session.query(Topic.id, Topic.name, Topic.description, Topic.view_count, Topic.post_count)
+                .order_by(Topic.id)
+                .all())
+        topics = {
+            row.id: {'id': row.id, 'name': row.name, 'description': row.description,
+                     'views': row.view_count or 0, 'joins': row.post_count or 0}
+            for row in rows
+        }
+        with self._lock:
+            if version == self._version:
+                self._topics = topics
+                self._loaded_at = time.monotonic()
+        return topics
+
+    def invalidate(self):
+        with self._lock:
+            self._topics = None
+            self._version += 1
+        # 依赖话题列表的响应缓存一起失效
+        response_cache.invalidate('topic:*')
+
+    def all(self):
+        # 所有话题, 按 id 排序
+        return list(self._get().values())
+
+    def hot(self, limit=3):
+        # 浏览量最高的话题
+        return sorted(self._get().values(), key=lambda topic: (-topic['views'], topic['id']))[:limit]
+
+    def get(self, topic_id):
+        return self._get().get(int(topic_id))
+
+    def name(self, topic_id):
+        topic = self.get(topic_id)
+        return topic['name'] if topic else None
+
+
+topic_cache = TopicCache()